@@ -0,0 +1,172 @@
+# Agendador de climatização a partir da tabela agenda.
+#
+# Mantém uma fila de prioridade (heap) com os próximos eventos de ligar/desligar
+# de cada item da agenda. Alterações em um item só mexem nos eventos dele:
+# a versão do item é incrementada e as entradas antigas do heap são descartadas
+# quando chegam ao topo (remoção preguiçosa), sem varrer a agenda de novo.
+
+import heapq
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+
+def acoes_por_sala(eventos):
+    # Salas a ligar e a desligar de um lote de eventos vencidos. Em aulas seguidas
+    # na mesma sala o desligar da que termina e o ligar da que começa vencem
+    # juntos; como a fila de comandos fica só com o último comando de cada
+    # equipamento, o desligar é descartado para a sala seguir ligada
+    ligar = {id_sala for _, id_sala, acao in eventos if acao == 'ligar'}
+    desligar = {id_sala for _, id_sala, acao in eventos if acao == 'desligar'} - ligar
+    return ligar, desligar
+
+
+class RelogioReal:
+    def agora(self):
+        return datetime.now()
+
+
+class RelogioSimulado:
+    # Relógio controlado manualmente, para testar o agendador sem esperar
+    def __init__(self, inicio):
+        self.atual = inicio
+
+    def agora(self):
+        return self.atual
+
+    def avancar(self, segundos):
+        self.atual += timedelta(seconds=segundos)
+
+
+class Agendador:
+    def __init__(self, disparar, relogio=None):
+        # disparar recebe uma lista de eventos (id_agenda, id_sala, acao) vencidos
+        self.disparar = disparar
+        self.relogio = relogio or RelogioReal()
+        self._heap = []
+        self._versoes = {}
+        # Itens em andamento cujo ligar já foi disparado: id_agenda -> id_sala
+        self._ligados = {}
+        self._sequencia = 0
+        self._descartados = 0
+        self._condicao = threading.Condition()
+        self._thread = None
+        self._parar = False
+
+    def __len__(self):
+        return len(self._versoes)
+
+    def carregar(self, itens):
+        # itens: iterável de (id_agenda, id_sala, inicio, fim)
+        with self._condicao:
+            for item in itens:
+                self._agendar(*item)
+            self._condicao.notify()
+
+    def agendar(self, id_agenda, id_sala, inicio, fim):
+        with self._condicao:
+            self._agendar(id_agenda, id_sala, inicio, fim)
+            self._condicao.notify()
+
+    def remover(self, id_agenda):
+        with self._condicao:
+            if self._versoes.pop(id_agenda, None) is not None:
+                self._descartados += 2
+            self._ligados.pop(id_agenda, None)
+            self._compactar()
+
+    def proximo_instante(self):
+        with self._condicao:
+            self._limpar_topo()
+            return self._heap[0][0] if self._heap else None
+
+    def processar(self):
+        # Dispara todos os eventos vencidos de uma vez, para que o executor possa
+        # resolver os comandos de várias salas em uma única consulta
+        agora = self.relogio.agora()
+        vencidos = []
+        with self._condicao:
+            while self._heap:
+                self._limpar_topo()
+                if not self._heap or self._heap[0][0] > agora:
+                    break
+                _, _, versao, id_agenda, id_sala, acao = heapq.heappop(self._heap)
+                if acao == 'desligar':
+                    del self._versoes[id_agenda]
+                    self._ligados.pop(id_agenda, None)
+                else:
+                    self._ligados[id_agenda] = id_sala
+                vencidos.append((id_agenda, id_sala, acao))
+        if vencidos:
+            try:
+                self.disparar(vencidos)
+            except Exception:
+                traceback.print_exc()
+        return vencidos
+
+    def iniciar(self):
+        if self._thread is not None:
+            return
+        self._parar = False
+        self._thread = threading.Thread(target=self._executar, name='agendador', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                if self._parar:
+                    return
+                self._limpar_topo()
+                espera = None
+                if self._heap:
+                    espera = (self._heap[0][0] - self.relogio.agora()).total_seconds()
+                if espera is None or espera > 0:
+                    self._condicao.wait(timeout=espera)
+                    continue
+            self.processar()
+
+    def _agendar(self, id_agenda, id_sala, inicio, fim):
+        agora = self.relogio.agora()
+        if id_agenda in self._versoes:
+            self._descartados += 2
+        if fim <= agora:
+            self._versoes.pop(id_agenda, None)
+            self._ligados.pop(id_agenda, None)
+            return
+        # Versões vêm de um contador global para nunca reaproveitar entradas antigas
+        self._sequencia += 1
+        versao = self._sequencia
+        self._versoes[id_agenda] = versao
+        # Um item que já começou ainda precisa ligar a sala agora, a não ser que
+        # já a tenha ligado (edição de um item em andamento)
+        if inicio > agora or self._ligados.get(id_agenda) != id_sala:
+            self._empurrar(max(inicio, agora), versao, id_agenda, id_sala, 'ligar')
+        self._empurrar(fim, versao, id_agenda, id_sala, 'desligar')
+        self._compactar()
+
+    def _empurrar(self, instante, versao, id_agenda, id_sala, acao):
+        self._sequencia += 1
+        heapq.heappush(self._heap, (instante, self._sequencia, versao, id_agenda, id_sala, acao))
+
+    def _valido(self, entrada):
+        return self._versoes.get(entrada[3]) == entrada[2]
+
+    def _limpar_topo(self):
+        while self._heap and not self._valido(self._heap[0]):
+            heapq.heappop(self._heap)
+            self._descartados = max(0, self._descartados - 1)
+
+    def _compactar(self):
+        # Reconstrói o heap quando mais da metade das entradas está obsoleta
+        if self._descartados > len(self._heap) // 2:
+            self._heap = [e for e in self._heap if self._valido(e)]
+            heapq.heapify(self._heap)
+            self._descartados = 0
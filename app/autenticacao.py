@@ -0,0 +1,95 @@
+# Senhas, tokens e escopos de acesso.
+#
+# A senha só é verificada no login (PBKDF2, caro de propósito). O login devolve
+# um token assinado com HMAC que carrega o id do usuário, a validade e um
+# carimbo da senha gravada; conferir o token em cada requisição custa um HMAC,
+# sem acesso ao banco. Trocar a senha muda o carimbo e invalida os tokens
+# emitidos antes. As permissões de cada usuário são resolvidas em main.py e
+# guardadas num cache curto, invalidado quando usuário ou permissão mudam.
+
+import base64
+import hashlib
+import hmac
+import os
+import re
+import time
+
+ALGORITMO = 'pbkdf2_sha256'
+# Escopos conhecidos; 'total' (e 'admin') dão todos
+ESCOPOS = ('leitura', 'escrita', 'comando', 'admin')
+NIVEIS = {
+    'leitura': {'leitura'},
+    'escrita': {'leitura', 'escrita'},
+    'comando': {'leitura', 'comando'},
+    'admin': set(ESCOPOS),
+    'total': set(ESCOPOS),
+}
+SEPARADORES = re.compile(r'[\s,;]+')
+
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).rstrip(b'=').decode()
+
+
+def gerar_hash(senha, iteracoes=200_000):
+    sal = os.urandom(16)
+    derivada = hashlib.pbkdf2_hmac('sha256', senha.encode(), sal, iteracoes)
+    return f'{ALGORITMO}${iteracoes}${sal.hex()}${derivada.hex()}'
+
+
+def eh_hash(armazenada):
+    return bool(armazenada) and armazenada.startswith(ALGORITMO + '$')
+
+
+def conferir_senha(senha, armazenada):
+    # Senhas antigas ainda em texto puro são comparadas direto; quem chama deve
+    # regravá-las com gerar_hash() depois de um login bem-sucedido
+    if not armazenada or senha is None:
+        return False
+    if not eh_hash(armazenada):
+        return hmac.compare_digest(senha.encode(), armazenada.encode())
+    _, iteracoes, sal, esperada = armazenada.split('$')
+    derivada = hashlib.pbkdf2_hmac('sha256', senha.encode(), bytes.fromhex(sal), int(iteracoes))
+    return hmac.compare_digest(derivada.hex(), esperada)
+
+
+def carimbo(armazenada):
+    # Muda sempre que a senha gravada muda
+    return hashlib.sha256((armazenada or '').encode()).hexdigest()[:12]
+
+
+def escopos(*acessos):
+    # Junta os escopos de textos como "leitura, comando" ou "total"
+    resultado = set()
+    for acesso in acessos:
+        for nome in SEPARADORES.split((acesso or '').lower()):
+            resultado |= NIVEIS.get(nome, set())
+    return frozenset(resultado)
+
+
+class Tokens:
+    def __init__(self, segredo, validade=12 * 3600, relogio=time.time):
+        self.segredo = segredo.encode() if isinstance(segredo, str) else segredo
+        self.validade = validade
+        self.relogio = relogio
+
+    def _assinar(self, conteudo):
+        return _b64(hmac.new(self.segredo, conteudo.encode(), hashlib.sha256).digest())
+
+    def emitir(self, id_usuario, carimbo_senha):
+        expira = int(self.relogio() + self.validade)
+        conteudo = f'{id_usuario}.{expira}.{carimbo_senha}'
+        return conteudo + '.' + self._assinar(conteudo), expira
+
+    def validar(self, token):
+        # (id_usuario, carimbo) ou None se o token for inválido ou tiver expirado
+        if not token:
+            return None
+        conteudo, _, assinatura = token.rpartition('.')
+        # Em bytes: compare_digest recusa str com caracteres fora do ASCII
+        if not conteudo or not hmac.compare_digest(assinatura.encode(), self._assinar(conteudo).encode()):
+            return None
+        id_usuario, expira, carimbo_senha = conteudo.split('.')
+        if int(expira) < self.relogio():
+            return None
+        return int(id_usuario), carimbo_senha
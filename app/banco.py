@@ -0,0 +1,76 @@
+# Engine única da aplicação e estatísticas do pool de conexões.
+
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+
+class EstatisticasPool:
+    def __init__(self):
+        self.checkouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, espera, timeout=False):
+        with self._lock:
+            self.checkouts += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+            if timeout:
+                self.timeouts += 1
+
+
+class PoolMedido(QueuePool):
+    # QueuePool que mede quanto tempo cada checkout esperou por uma conexão livre
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estatisticas = EstatisticasPool()
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super()._do_get()
+        except Exception:
+            self.estatisticas.registrar(time.perf_counter() - inicio, timeout=True)
+            raise
+        self.estatisticas.registrar(time.perf_counter() - inicio)
+        return conexao
+
+
+def criar_engine(db_url, config):
+    return create_engine(
+        db_url,
+        poolclass=PoolMedido,
+        pool_size=config.getint('Pool', 'pool_size', fallback=10),
+        max_overflow=config.getint('Pool', 'max_overflow', fallback=20),
+        pool_timeout=config.getfloat('Pool', 'pool_timeout', fallback=30),
+        pool_recycle=config.getint('Pool', 'pool_recycle', fallback=1800),
+        pool_pre_ping=config.getboolean('Pool', 'pool_pre_ping', fallback=True)
+    )
+
+
+def estatisticas_pool(engine):
+    pool = engine.pool
+    dados = {'classe': pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        dados.update({
+            'tamanho': pool.size(),
+            'em_uso': pool.checkedout(),
+            'livres': pool.checkedin(),
+            'overflow': pool.overflow()
+        })
+    estatisticas = getattr(pool, 'estatisticas', None)
+    if estatisticas is not None:
+        with estatisticas._lock:
+            dados.update({
+                'checkouts': estatisticas.checkouts,
+                'espera_media_ms': round(estatisticas.espera_total / estatisticas.checkouts * 1000, 3)
+                if estatisticas.checkouts else 0.0,
+                'espera_max_ms': round(estatisticas.espera_max * 1000, 3),
+                'timeouts': estatisticas.timeouts
+            })
+    return dados
@@ -0,0 +1,89 @@
+# Cache em memória com TTL e remoção LRU para as tabelas de catálogo
+# (equipamento, comandos, protocolo, permissoes), que quase nunca mudam.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    def __init__(self, max_itens=1024, ttl=60, relogio=time.monotonic):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.relogio = relogio
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self._itens = OrderedDict()
+        self._geracao = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave, carregar):
+        # Devolve o valor em cache ou chama carregar() e guarda o resultado.
+        # Resultados None (registro inexistente) não são guardados.
+        agora = self.relogio()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[1] > agora:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return item[0]
+            self.falhas += 1
+            geracao = self._geracao
+
+        valor = carregar()
+
+        with self._lock:
+            # Se houve invalidação durante a carga o valor pode estar velho
+            if valor is not None and geracao == self._geracao:
+                self._itens[chave] = (valor, agora + self.ttl)
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+                    self.remocoes += 1
+        return valor
+
+    def consultar(self, chave):
+        # Como obter(), mas devolve None em vez de carregar o que falta; usado
+        # quando quem chama carrega várias chaves de uma vez com guardar()
+        agora = self.relogio()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[1] > agora:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return item[0]
+            self.falhas += 1
+            return None
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = (valor, self.relogio() + self.ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.remocoes += 1
+
+    def invalidar(self, *chaves):
+        with self._lock:
+            self._geracao += 1
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'max_itens': self.max_itens,
+                'ttl': self.ttl,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'remocoes': self.remocoes,
+                'taxa_acerto': round(self.acertos / total, 4) if total else None
+            }
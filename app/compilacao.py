@@ -0,0 +1,91 @@
+# Comandos já prontos para envio, por (equipamento, ação).
+#
+# O corpo enviado a um controlador depende só do equipamento e do texto do
+# comando do seu protocolo (comandos.id_protocolo = equipamento.id_protocolo).
+# Em vez de montar e codificar o JSON a cada envio, cada par é compilado uma vez
+# em bytes e guardado numa tabela imutável: quem envia faz um único get() e quem
+# altera comandos, protocolos ou equipamentos monta uma tabela nova só com as
+# entradas afetadas trocadas e a publica com uma atribuição.
+#
+# Cargas completas (thread do LISTEN) e recompilações parciais (requisições)
+# podem correr ao mesmo tempo. Cada publicação incrementa geracao; quem leu o
+# banco antes de outra publicação lê de novo em vez de trocar a tabela, para
+# uma leitura mais antiga nunca sobrescrever uma mais nova.
+
+import json
+import threading
+from types import MappingProxyType
+
+
+def compilar(id_equipamento, comando):
+    return json.dumps({'comando': comando, 'id_equipamento': id_equipamento}).encode()
+
+
+class TabelaComandos:
+    def __init__(self):
+        # (id_equipamento, ação em minúsculas) -> (payload, descrição do equipamento)
+        self.tabela = MappingProxyType({})
+        self.carregada = False
+        self.reconstrucoes = 0
+        self.geracao = 0
+        self._acoes = {}
+        self._lock = threading.Lock()
+
+    def obter(self, id_equipamento, acao):
+        return self.tabela.get((id_equipamento, acao))
+
+    @staticmethod
+    def _compilar(linhas):
+        # linhas: (id_equipamento, equipamento, ação, comando), na ordem de comandos.id;
+        # com duas ações iguais no mesmo protocolo vale a primeira
+        entradas = {}
+        for id_equipamento, equipamento, acao, comando in linhas:
+            if acao is None or comando is None:
+                continue
+            entradas.setdefault((id_equipamento, acao.lower()), (compilar(id_equipamento, comando), equipamento))
+        return entradas
+
+    def carregar(self, ler):
+        # ler() -> linhas de todos os equipamentos
+        while True:
+            geracao = self.geracao
+            entradas = self._compilar(ler())
+            acoes = {}
+            for id_equipamento, acao in entradas:
+                acoes[id_equipamento] = acoes.get(id_equipamento, ()) + (acao,)
+            with self._lock:
+                if self.geracao != geracao:
+                    continue
+                self._acoes = acoes
+                self.tabela = MappingProxyType(entradas)
+                self.carregada = True
+                self.geracao += 1
+                self.reconstrucoes += 1
+                return
+
+    def atualizar(self, ids_equipamento, ler):
+        # Recompila só os equipamentos informados; ler() -> linhas deles
+        # (equipamentos sem linha, por exemplo removidos, saem da tabela)
+        while True:
+            geracao = self.geracao
+            novas = self._compilar(ler())
+            with self._lock:
+                if self.geracao != geracao:
+                    continue
+                entradas = dict(self.tabela)
+                acoes = dict(self._acoes)
+                for id_equipamento in ids_equipamento:
+                    for acao in acoes.pop(id_equipamento, ()):
+                        entradas.pop((id_equipamento, acao), None)
+                for (id_equipamento, acao), valor in novas.items():
+                    entradas[(id_equipamento, acao)] = valor
+                    acoes[id_equipamento] = acoes.get(id_equipamento, ()) + (acao,)
+                self._acoes = acoes
+                self.tabela = MappingProxyType(entradas)
+                self.geracao += 1
+                self.reconstrucoes += 1
+                return
+
+    def estatisticas(self):
+        return {'entradas': len(self.tabela), 'equipamentos': len(self._acoes),
+                'carregada': self.carregada, 'reconstrucoes': self.reconstrucoes, 'geracao': self.geracao}
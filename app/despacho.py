@@ -0,0 +1,99 @@
+# Envio concorrente de comandos para os controladores das salas.
+#
+# Cada sala tem um controlador HTTP em salas.ip. As conexões são reaproveitadas
+# por host (keep-alive), a concorrência é limitada pelo tamanho do pool de
+# threads e cada envio tem timeout e novas tentativas com backoff exponencial.
+
+import http.client
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolConexoes:
+    def __init__(self, porta, timeout, max_por_host=4):
+        self.porta = porta
+        self.timeout = timeout
+        self.max_por_host = max_por_host
+        self._livres = {}
+        self._lock = threading.Lock()
+
+    def obter(self, host):
+        with self._lock:
+            livres = self._livres.get(host)
+            if livres:
+                return livres.pop()
+        # ip pode vir como "host:porta"; sem porta usa a padrão dos dispositivos
+        porta = None if ':' in host else self.porta
+        return http.client.HTTPConnection(host, porta, timeout=self.timeout)
+
+    def devolver(self, host, conexao):
+        with self._lock:
+            livres = self._livres.setdefault(host, [])
+            if len(livres) < self.max_por_host:
+                livres.append(conexao)
+                return
+        conexao.close()
+
+    def fechar(self):
+        with self._lock:
+            for livres in self._livres.values():
+                for conexao in livres:
+                    conexao.close()
+            self._livres.clear()
+
+
+class Despachante:
+    def __init__(self, porta=80, caminho='/comando', timeout=2.0, tentativas=3,
+                 backoff=0.1, concorrencia=64):
+        self.caminho = caminho
+        self.tentativas = tentativas
+        self.backoff = backoff
+        self.pool = PoolConexoes(porta, timeout)
+        self._executor = ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='despacho')
+
+    def enviar(self, ip, payload):
+        # payload: dict ou bytes já codificados (ver compilacao.py)
+        corpo = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        inicio = time.perf_counter()
+        erro = None
+        status = None
+        for tentativa in range(1, self.tentativas + 1):
+            conexao = self.pool.obter(ip)
+            try:
+                conexao.request('POST', self.caminho, body=corpo,
+                                headers={'Content-Type': 'application/json'})
+                resposta = conexao.getresponse()
+                resposta.read()
+                status = resposta.status
+                if resposta.will_close:
+                    conexao.close()
+                else:
+                    self.pool.devolver(ip, conexao)
+                if status < 500:
+                    break
+                erro = f'HTTP {status}'
+            except (OSError, http.client.HTTPException) as e:
+                conexao.close()
+                erro = str(e) or e.__class__.__name__
+            if tentativa < self.tentativas:
+                time.sleep(self.backoff * 2 ** (tentativa - 1) * (1 + random.random()))
+        ok = status is not None and 200 <= status < 300
+        return {
+            'ip': ip,
+            'ok': ok,
+            'status': status,
+            'erro': None if ok else (erro or f'HTTP {status}'),
+            'tentativas': tentativa,
+            'latencia_ms': round((time.perf_counter() - inicio) * 1000, 2)
+        }
+
+    def enviar_lote(self, envios):
+        # envios: lista de (ip, payload); os resultados voltam na mesma ordem
+        return list(self._executor.map(lambda envio: self.enviar(*envio), envios))
+
+    def fechar(self):
+        self._executor.shutdown(wait=True)
+        self.pool.fechar()
@@ -0,0 +1,79 @@
+# Último estado conhecido de cada equipamento, derivado dos logs.
+#
+# Guarda por id_equipamento a última ação registrada, quem a fez, quando e o
+# estado resultante (ligado/desligado), para responder sem varrer a tabela logs.
+# É carregado uma vez na subida e depois atualizado a cada log gravado; logs
+# mais antigos que o estado guardado são ignorados, então a ordem de chegada
+# dos avisos não importa.
+
+import threading
+from datetime import datetime
+
+ESTADOS = {'ligar': 'ligado', 'desligar': 'desligado'}
+CAMPOS = ('id_equipamento', 'acao', 'usuario', 'datas', 'sala', 'equipamento')
+
+
+def estado_da_acao(acao, anterior=None):
+    # Comandos que falharam deixam o estado incerto; outras ações não o alteram
+    if acao is None:
+        return anterior or 'desconhecido'
+    acao = acao.lower()
+    if acao.endswith(':falha'):
+        return 'desconhecido'
+    return ESTADOS.get(acao, anterior or 'desconhecido')
+
+
+def _data(valor):
+    if isinstance(valor, str):
+        try:
+            valor = datetime.fromisoformat(valor)
+        except ValueError:
+            return None
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        # A coluna é TIMESTAMP sem fuso; o PostgreSQL também descarta o deslocamento
+        valor = valor.replace(tzinfo=None)
+    return valor
+
+
+class EstadoDispositivos:
+    def __init__(self):
+        self.carregado = False
+        self._estados = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, log):
+        # log: dict com os campos de CAMPOS; devolve True se mudou o estado guardado
+        id_equipamento = log.get('id_equipamento')
+        datas = _data(log.get('datas'))
+        if id_equipamento is None or datas is None:
+            return False
+        with self._lock:
+            atual = self._estados.get(id_equipamento)
+            if atual is not None and atual['datas'] > datas:
+                return False
+            self._estados[id_equipamento] = {
+                'id_equipamento': id_equipamento,
+                'estado': estado_da_acao(log.get('acao'), atual['estado'] if atual else None),
+                'acao': log.get('acao'),
+                'usuario': log.get('usuario'),
+                'datas': datas,
+                'sala': log.get('sala'),
+                'equipamento': log.get('equipamento')
+            }
+            return True
+
+    def carregar(self, logs):
+        # Carga completa (subida ou reconexão); não apaga o que já chegou por aviso.
+        # Para cada equipamento, passe o último log que muda o estado antes do
+        # último log de todos, como aconteceria se tivessem chegado um a um.
+        for log in logs:
+            self.registrar(log)
+        self.carregado = True
+
+    def obter(self, id_equipamento):
+        with self._lock:
+            return self._estados.get(id_equipamento)
+
+    def todos(self):
+        with self._lock:
+            return [self._estados[id] for id in sorted(self._estados)]
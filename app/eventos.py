@@ -0,0 +1,104 @@
+# Pub/sub em memória para o stream de eventos (GET /eventos, Server-Sent Events).
+#
+# Cada conexão do stream é uma Assinatura com uma fila própria e limitada; o
+# Difusor entrega cada evento publicado às assinaturas cujo filtro o aceita.
+# Uma conexão parada espera numa Condition, sem consumir CPU, e um cliente
+# lento perde os eventos mais antigos da fila em vez de segurar os outros.
+# Entre workers os eventos chegam pelo LISTEN/NOTIFY do PostgreSQL (ver main.py):
+# cada worker publica no seu Difusor o que recebe do banco.
+
+import threading
+from collections import deque
+
+TIPOS = ('log', 'estado', 'agenda')
+
+
+class Assinatura:
+    def __init__(self, tipos=None, salas=None, blocos=None, tamanho_fila=256):
+        self.tipos = set(tipos) if tipos else None
+        self.salas = set(salas) if salas else None
+        self.blocos = set(blocos) if blocos else None
+        self.perdidos = 0
+        self.fechada = False
+        self._fila = deque(maxlen=tamanho_fila)
+        self._condicao = threading.Condition()
+
+    def aceita(self, evento):
+        if self.tipos is not None and evento['tipo'] not in self.tipos:
+            return False
+        if self.salas is None and self.blocos is None:
+            return True
+        # Com filtro de sala e de bloco basta atender a um dos dois
+        return bool((self.salas and self.salas & evento['salas'])
+                    or (self.blocos and self.blocos & evento['blocos']))
+
+    def entregar(self, evento):
+        with self._condicao:
+            if len(self._fila) == self._fila.maxlen:
+                self.perdidos += 1
+            self._fila.append(evento)
+            self._condicao.notify()
+
+    def proximos(self, timeout):
+        # Eventos pendentes; [] se passou o timeout sem nada e None se foi fechada
+        with self._condicao:
+            self._condicao.wait_for(lambda: self._fila or self.fechada, timeout)
+            if self.fechada:
+                return None
+            eventos = list(self._fila)
+            self._fila.clear()
+            return eventos
+
+    def fechar(self):
+        with self._condicao:
+            self.fechada = True
+            self._condicao.notify()
+
+
+class Difusor:
+    def __init__(self, max_assinaturas=1000, tamanho_fila=256):
+        self.max_assinaturas = max_assinaturas
+        self.tamanho_fila = tamanho_fila
+        self.publicados = dict.fromkeys(TIPOS, 0)
+        self._assinaturas = set()
+        self._lock = threading.Lock()
+
+    def assinar(self, tipos=None, salas=None, blocos=None):
+        # None quando o limite de conexões deste processo foi atingido
+        assinatura = Assinatura(tipos, salas, blocos, self.tamanho_fila)
+        with self._lock:
+            if len(self._assinaturas) >= self.max_assinaturas:
+                return None
+            self._assinaturas.add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+        assinatura.fechar()
+
+    def publicar(self, tipo, dados, salas=(), blocos=()):
+        evento = {'tipo': tipo, 'dados': dados, 'salas': set(salas), 'blocos': set(blocos)}
+        with self._lock:
+            self.publicados[tipo] = self.publicados.get(tipo, 0) + 1
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            if assinatura.aceita(evento):
+                assinatura.entregar(evento)
+
+    def fechar(self):
+        # Encerra todos os streams abertos (saída do worker)
+        with self._lock:
+            assinaturas = list(self._assinaturas)
+            self._assinaturas.clear()
+        for assinatura in assinaturas:
+            assinatura.fechar()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'conexoes': len(self._assinaturas),
+                'max_conexoes': self.max_assinaturas,
+                'publicados': dict(self.publicados),
+                'perdidos': sum(assinatura.perdidos for assinatura in self._assinaturas)
+            }
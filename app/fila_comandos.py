@@ -0,0 +1,225 @@
+# Fila de despacho de comandos na frente do Despachante.
+#
+# No começo de cada aula agenda e usuários mandam rajadas de comandos repetidos
+# para as mesmas salas. Aqui cada comando espera um pouco (janela) na fila do seu
+# segmento de rede (o bloco da sala) antes de sair:
+#   - comandos pendentes para o mesmo equipamento se fundem e vale o último;
+#     quem enviou o comando substituído recebe o resultado do que foi enviado;
+#   - um comando que só repete o último estado conhecido (ligar o que já está
+#     ligado) não é enviado;
+#   - cada segmento tem um balde de fichas (taxa por segundo, com rajada), para
+#     não inundar os controladores de um bloco;
+#   - um equipamento só recebe um comando por vez, na ordem de chegada.
+# Os envios saem em lotes pelo enviar_lote do Despachante e, depois de cada
+# lote, ao_concluir(comandos, resultados) registra o que foi de fato enviado.
+
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class Comando:
+    def __init__(self, id_equipamento, ip, segmento, acao, payload, estado=None, forcar=False, contexto=None):
+        # estado: o que o comando deixa no equipamento (None se não muda o estado);
+        # contexto: dados do chamador devolvidos em ao_concluir (sala, usuário...)
+        self.id_equipamento = id_equipamento
+        self.ip = ip
+        self.segmento = segmento
+        self.acao = acao
+        self.payload = payload
+        self.estado = estado
+        self.forcar = forcar
+        self.contexto = contexto or {}
+        self.futuros = [Future()]
+        self.chegada = None
+        # Instante (relógio da fila) em que o balde liberou o comando
+        self.saida = None
+
+    def resolver(self, resultado):
+        principal, *substituidos = self.futuros
+        principal.set_result(resultado)
+        for futuro in substituidos:
+            futuro.set_result({**resultado, 'coalescido': True})
+
+
+class Balde:
+    def __init__(self, taxa, rajada, agora):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.fichas = rajada
+        self.atualizado = agora
+
+    def encher(self, agora):
+        self.fichas = min(self.rajada, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    def espera(self):
+        # Segundos até a próxima ficha
+        return max(0.0, (1 - self.fichas) / self.taxa)
+
+
+class FilaComandos:
+    def __init__(self, enviar_lote, ao_concluir=None, estado_atual=None, taxa=20.0, rajada=20,
+                 janela=0.1, lotes_simultaneos=8, relogio=time.monotonic):
+        # enviar_lote([(ip, payload)]) -> resultados na mesma ordem;
+        # estado_atual(id_equipamento) -> último estado conhecido ou None
+        self.enviar_lote = enviar_lote
+        self.ao_concluir = ao_concluir
+        self.estado_atual = estado_atual or (lambda id_equipamento: None)
+        self.taxa = taxa
+        self.rajada = rajada
+        self.janela = janela
+        self.relogio = relogio
+        self.recebidos = 0
+        self.coalescidos = 0
+        self.ignorados = 0
+        self.enviados = 0
+        self.falhas = 0
+        self._segmentos = {}
+        self._baldes = {}
+        self._em_envio = set()
+        self._condicao = threading.Condition()
+        self._parar = False
+        self._executor = ThreadPoolExecutor(max_workers=lotes_simultaneos, thread_name_prefix='fila-comandos')
+        self._thread = None
+
+    def enfileirar(self, comandos):
+        # Devolve um Future por comando, na mesma ordem
+        futuros = []
+        with self._condicao:
+            if self._parar:
+                for comando in comandos:
+                    comando.futuros[0].set_result({'ip': comando.ip, 'ok': False, 'status': None,
+                                                   'erro': 'fila de comandos encerrada'})
+                return [comando.futuros[0] for comando in comandos]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name='fila-comandos', daemon=True)
+                self._thread.start()
+            agora = self.relogio()
+            for comando in comandos:
+                self.recebidos += 1
+                futuro = comando.futuros[0]
+                futuros.append(futuro)
+                pendentes = self._segmentos.setdefault(comando.segmento, OrderedDict())
+                anterior = pendentes.get(comando.id_equipamento)
+                if anterior is not None:
+                    # Vale o último, mas na posição e com a chegada do primeiro
+                    self.coalescidos += 1
+                    comando.futuros = [futuro] + anterior.futuros
+                    comando.chegada = anterior.chegada
+                    comando.forcar = comando.forcar or anterior.forcar
+                else:
+                    comando.chegada = agora
+                pendentes[comando.id_equipamento] = comando
+            self._condicao.notify()
+        return futuros
+
+    def _redundante(self, comando):
+        return (not comando.forcar and comando.estado is not None
+                and self.estado_atual(comando.id_equipamento) == comando.estado)
+
+    def _prontos(self, agora):
+        # Retira os comandos que já podem sair; devolve (lote, ignorados, segundos
+        # até o próximo ficar pronto ou None se não há pendentes)
+        lote, ignorados, proxima = [], [], None
+        for segmento, pendentes in list(self._segmentos.items()):
+            balde = self._baldes.get(segmento)
+            if balde is None:
+                balde = self._baldes[segmento] = Balde(self.taxa, self.rajada, agora)
+            balde.encher(agora)
+            for id_equipamento, comando in list(pendentes.items()):
+                if comando.chegada + self.janela > agora:
+                    # Os seguintes chegaram depois e também não estão prontos
+                    espera = comando.chegada + self.janela - agora
+                    proxima = espera if proxima is None else min(proxima, espera)
+                    break
+                if id_equipamento in self._em_envio:
+                    continue
+                if self._redundante(comando):
+                    del pendentes[id_equipamento]
+                    ignorados.append(comando)
+                    continue
+                if balde.fichas < 1:
+                    espera = balde.espera()
+                    proxima = espera if proxima is None else min(proxima, espera)
+                    break
+                balde.fichas -= 1
+                comando.saida = agora
+                del pendentes[id_equipamento]
+                self._em_envio.add(id_equipamento)
+                lote.append(comando)
+            if not pendentes:
+                del self._segmentos[segmento]
+                # Sem pendentes o balde só interessa enquanto não estiver cheio
+                if balde.fichas >= balde.rajada:
+                    del self._baldes[segmento]
+        # proxima None: nada pendente ou só equipamentos com envio em andamento,
+        # e _enviar avisa quando termina
+        return lote, ignorados, proxima
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                lote, ignorados, proxima = self._prontos(self.relogio())
+                self.ignorados += sum(len(comando.futuros) for comando in ignorados)
+                if not lote and not ignorados:
+                    if self._parar and not self._segmentos and not self._em_envio:
+                        return
+                    self._condicao.wait(proxima)
+                    continue
+            for comando in ignorados:
+                comando.resolver({'ip': comando.ip, 'ok': True, 'status': None, 'erro': None,
+                                  'ignorado': 'já está ' + comando.estado})
+            if lote:
+                self._executor.submit(self._enviar, lote)
+
+    def _enviar(self, lote):
+        try:
+            resultados = self.enviar_lote([(comando.ip, comando.payload) for comando in lote])
+        except Exception as e:
+            traceback.print_exc()
+            resultados = [{'ip': comando.ip, 'ok': False, 'status': None, 'erro': str(e)} for comando in lote]
+        with self._condicao:
+            self.enviados += len(lote)
+            self.falhas += sum(1 for resultado in resultados if not resultado['ok'])
+            for comando in lote:
+                self._em_envio.discard(comando.id_equipamento)
+            self._condicao.notify()
+        for comando, resultado in zip(lote, resultados):
+            resultado['acao'] = comando.acao
+            comando.resolver(resultado)
+        if self.ao_concluir is not None:
+            try:
+                self.ao_concluir(lote, resultados)
+            except Exception:
+                traceback.print_exc()
+
+    def parar(self, timeout=30):
+        # Envia o que ainda está na fila e espera os envios em andamento
+        with self._condicao:
+            self._parar = True
+            self.janela = 0
+            self._condicao.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+    def estatisticas(self):
+        with self._condicao:
+            return {
+                'pendentes': sum(len(pendentes) for pendentes in self._segmentos.values()),
+                'em_envio': len(self._em_envio),
+                'por_segmento': {str(segmento): len(pendentes) for segmento, pendentes in self._segmentos.items()},
+                'recebidos': self.recebidos,
+                'coalescidos': self.coalescidos,
+                'ignorados': self.ignorados,
+                'enviados': self.enviados,
+                'falhas': self.falhas,
+                'taxa_coalescencia': round(self.coalescidos / self.recebidos, 4) if self.recebidos else None,
+                'taxa_por_segmento': self.taxa,
+                'rajada_por_segmento': self.rajada,
+                'janela': self.janela
+            }
@@ -0,0 +1,269 @@
+# Gravação assíncrona (write-behind) dos logs.
+#
+# Quem gera um log só o coloca numa fila em memória limitada; uma thread grava
+# a fila em lotes quando ela chega a "lote" registros ou a cada "intervalo"
+# segundos. Com a fila cheia quem adiciona espera até "espera" segundos por
+# espaço e depois recebe FilaCheia (backpressure). Em parar() a fila é gravada
+# antes de a thread sair.
+#
+# Durabilidade: com um diretório de spool cada registro também é anexado a um
+# arquivo NDJSON do processo antes de entrar na fila. A cada lote retirado da
+# fila o arquivo é trocado por um novo, e o antigo só é apagado depois de o lote
+# estar no banco. Os arquivos ficam presos com flock enquanto o processo vive;
+# na partida, os que estiverem livres (de processos que morreram) são gravados
+# de novo e apagados. A entrega é "pelo menos uma vez": um processo que morre
+# entre o commit e a remoção do arquivo faz o lote ser gravado duas vezes.
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import date, datetime
+
+
+class FilaCheia(Exception):
+    pass
+
+
+def _json_padrao(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f'{type(valor).__name__} não é serializável')
+
+
+class Spool:
+    def __init__(self, diretorio, fsync=False):
+        os.makedirs(diretorio, exist_ok=True)
+        self.diretorio = diretorio
+        self.fsync = fsync
+        self.arquivo = self._abrir()
+
+    def _abrir(self):
+        # O horário no nome evita reaproveitar o arquivo de um processo morto com o mesmo pid
+        caminho = os.path.join(self.diretorio, f'logs-{os.getpid()}-{time.time_ns()}.ndjson')
+        arquivo = open(caminho, 'ab')
+        fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return arquivo
+
+    def anexar(self, registros):
+        self.arquivo.write(b''.join(json.dumps(registro, default=_json_padrao).encode() + b'\n'
+                                    for registro in registros))
+        self.arquivo.flush()
+        if self.fsync:
+            os.fsync(self.arquivo.fileno())
+
+    def rotacionar(self):
+        # Devolve o arquivo atual, cujos registros acabaram de sair da fila
+        anterior = self.arquivo
+        self.arquivo = self._abrir()
+        return anterior
+
+    def rejeitar(self, registro):
+        with open(os.path.join(self.diretorio, 'rejeitados.ndjson'), 'ab') as arquivo:
+            arquivo.write(json.dumps(registro, default=_json_padrao).encode() + b'\n')
+
+    def orfaos(self):
+        # Arquivos de processos que já morreram (o flock deles foi liberado)
+        for caminho in sorted(glob.glob(os.path.join(self.diretorio, 'logs-*.ndjson'))):
+            try:
+                arquivo = open(caminho, 'rb')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # Outro processo pode tê-lo regravado e apagado enquanto esperávamos
+                if os.fstat(arquivo.fileno()).st_ino != os.stat(caminho).st_ino:
+                    raise FileNotFoundError(caminho)
+            except OSError:
+                arquivo.close()
+                continue
+            yield arquivo
+
+    @staticmethod
+    def ler(arquivo):
+        registros = []
+        for linha in arquivo:
+            try:
+                registros.append(json.loads(linha))
+            except ValueError:
+                # Última linha cortada pela queda do processo
+                continue
+        return registros
+
+    @staticmethod
+    def apagar(arquivo):
+        os.remove(arquivo.name)
+        arquivo.close()
+
+    def fechar(self):
+        self.arquivo.close()
+
+
+class GravadorLogs:
+    def __init__(self, gravar, max_fila=10000, lote=500, intervalo=0.5, espera=2.0,
+                 diretorio_spool=None, fsync=False, permanente=lambda erro: False,
+                 decodificar=None, backoff=0.5, tentativas_ao_parar=3):
+        # gravar(registros) grava um lote e levanta exceção se falhar;
+        # permanente(erro) diz se o erro é do registro (não adianta repetir) ou do
+        # banco; decodificar(registro) refaz um registro lido do spool
+        self.gravar = gravar
+        self.max_fila = max_fila
+        self.lote = lote
+        self.intervalo = intervalo
+        self.espera = espera
+        self.diretorio_spool = diretorio_spool
+        self.fsync = fsync
+        self.permanente = permanente
+        self.decodificar = decodificar
+        self.backoff = backoff
+        self.tentativas_ao_parar = tentativas_ao_parar
+        self.spool = None
+        self.gravados = 0
+        self.rejeitados = 0
+        self.recusados = 0
+        self.esperas = 0
+        self.reaplicados = 0
+        self.falhas = 0
+        self._fila = deque()
+        self._em_gravacao = 0
+        self._condicao = threading.Condition()
+        self._parar = False
+        self._thread = None
+
+    def iniciar(self):
+        with self._condicao:
+            if self._thread is not None:
+                return
+            self._parar = False
+            if self.diretorio_spool:
+                self.spool = Spool(self.diretorio_spool, self.fsync)
+            self._thread = threading.Thread(target=self._executar, name='gravacao-logs', daemon=True)
+            self._thread.start()
+
+    def adicionar(self, registros):
+        registros = list(registros)
+        if self._thread is None:
+            self.iniciar()
+        with self._condicao:
+            cabe = lambda: not self._fila or len(self._fila) + len(registros) <= self.max_fila
+            if not cabe():
+                self.esperas += 1
+                if not self._condicao.wait_for(lambda: cabe() or self._parar, self.espera) or self._parar:
+                    self.recusados += len(registros)
+                    raise FilaCheia(f'fila de logs cheia ({len(self._fila)} registros)')
+            if self.spool is not None:
+                self.spool.anexar(registros)
+            self._fila.extend(registros)
+            if len(self._fila) >= self.lote:
+                self._condicao.notify_all()
+
+    def _executar(self):
+        if self.spool is not None:
+            self._reaplicar()
+        while True:
+            with self._condicao:
+                self._condicao.wait_for(lambda: len(self._fila) >= self.lote or self._parar, self.intervalo)
+                if not self._fila:
+                    if self._parar:
+                        return
+                    continue
+                pendentes = list(self._fila)
+                self._fila.clear()
+                self._em_gravacao = len(pendentes)
+                arquivo = self.spool.rotacionar() if self.spool is not None else None
+                # Libera quem espera por espaço na fila
+                self._condicao.notify_all()
+            completo = self._gravar(pendentes)
+            with self._condicao:
+                self._em_gravacao = 0
+            if arquivo is not None:
+                if completo:
+                    Spool.apagar(arquivo)
+                else:
+                    # Fica para a próxima partida (ao fechar, o flock é liberado)
+                    arquivo.close()
+
+    def _reaplicar(self):
+        for arquivo in self.spool.orfaos():
+            registros = Spool.ler(arquivo)
+            if self.decodificar is not None:
+                registros = [self.decodificar(registro) for registro in registros]
+            if self._gravar(registros):
+                self.reaplicados += len(registros)
+                Spool.apagar(arquivo)
+            else:
+                arquivo.close()
+
+    def _gravar(self, registros):
+        # True quando todos os registros foram gravados ou rejeitados; False só se
+        # o gravador está parando e o banco continua fora
+        for inicio in range(0, len(registros), self.lote):
+            if not self._gravar_lote(registros[inicio:inicio + self.lote]):
+                return False
+        return True
+
+    def _gravar_lote(self, lote):
+        tentativa = 0
+        while True:
+            try:
+                self.gravar(lote)
+                self.gravados += len(lote)
+                return True
+            except Exception as erro:
+                self.falhas += 1
+                if self.permanente(erro):
+                    return self._gravar_um_a_um(lote) if len(lote) > 1 else self._rejeitar(lote[0], erro)
+                traceback.print_exc()
+                tentativa += 1
+                if self._parar and tentativa >= self.tentativas_ao_parar:
+                    return False
+                time.sleep(min(self.backoff * 2 ** (tentativa - 1), 30))
+
+    def _gravar_um_a_um(self, lote):
+        # Um registro ruim (ex.: equipamento inexistente) derruba o lote inteiro;
+        # separa-o para os outros serem gravados
+        return all([self._gravar_lote([registro]) for registro in lote])
+
+    def _rejeitar(self, registro, erro):
+        self.rejeitados += 1
+        print(f"Log descartado ({erro.__class__.__name__}: {erro}): {registro}")
+        if self.spool is not None:
+            self.spool.rejeitar(registro)
+        return True
+
+    def parar(self, timeout=30):
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._condicao:
+            self._thread = None
+            if self.spool is not None:
+                self.spool.fechar()
+                # Sobrou só o arquivo vazio aberto após a última troca
+                if not self._fila and os.path.exists(self.spool.arquivo.name) \
+                        and os.path.getsize(self.spool.arquivo.name) == 0:
+                    os.remove(self.spool.arquivo.name)
+                self.spool = None
+
+    def estatisticas(self):
+        with self._condicao:
+            return {
+                'fila': len(self._fila),
+                'em_gravacao': self._em_gravacao,
+                'max_fila': self.max_fila,
+                'lote': self.lote,
+                'gravados': self.gravados,
+                'rejeitados': self.rejeitados,
+                'recusados': self.recusados,
+                'esperas': self.esperas,
+                'reaplicados': self.reaplicados,
+                'falhas': self.falhas,
+                'spool': self.diretorio_spool
+            }
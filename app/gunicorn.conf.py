@@ -0,0 +1,64 @@
+# Configuração do gunicorn para produção (ver dockerfile).
+#
+# A aplicação é carregada uma vez no processo master (preload_app) e os workers
+# são criados por fork. Cada worker descarta as conexões herdadas do master,
+# aquece o próprio pool e os caches e só então passa a aceitar requisições.
+# No SIGTERM o gunicorn para de aceitar conexões e espera as requisições em
+# andamento terminarem por até graceful_timeout segundos.
+
+import configparser
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Não pode se chamar "config": o gunicorn trata esse nome como uma configuração
+configuracao = configparser.ConfigParser()
+configuracao.read('config.ini')
+
+bind = configuracao.get('Servidor', 'bind', fallback='0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             configuracao.getint('Servidor', 'workers', fallback=multiprocessing.cpu_count() * 2 + 1)))
+# Cada conexão aberta de /eventos (SSE) prende uma thread enquanto durar; as
+# threads extras ficam paradas esperando eventos e só são criadas quando usadas.
+# As demais rotas continuam limitadas a [Servidor] threads por worker: acima
+# disso esperam por uma vaga (ocupar_vaga em main.py)
+conexoes_eventos = configuracao.getint('Eventos', 'max_conexoes', fallback=1000)
+threads = configuracao.getint('Servidor', 'threads', fallback=4) + conexoes_eventos
+worker_connections = threads
+worker_class = 'gthread'
+preload_app = True
+timeout = configuracao.getint('Servidor', 'timeout', fallback=30)
+graceful_timeout = configuracao.getint('Servidor', 'graceful_timeout', fallback=30)
+keepalive = configuracao.getint('Servidor', 'keepalive', fallback=5)
+accesslog = '-'
+
+# Diretório onde cada worker grava suas métricas para o /metrics somar; definido
+# aqui, antes do preload, para que main.py o encontre
+if not os.environ.get('METRICAS_DIR'):
+    os.environ['METRICAS_DIR'] = (configuracao.get('Metricas', 'diretorio', fallback='')
+                                  or os.path.join(tempfile.gettempdir(), 'climabom-metricas'))
+
+
+def on_starting(server):
+    # Retratos de uma execução anterior não devem entrar na soma
+    shutil.rmtree(os.environ['METRICAS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICAS_DIR'], exist_ok=True)
+
+
+def post_fork(server, worker):
+    import main
+    # Conexões abertas no master durante o preload não podem ser compartilhadas
+    main.engine.dispose(close=False)
+    main.iniciar_replicas()
+    main.aquecer()
+    main.metricas.iniciar()
+    main.iniciar_agendador()
+    main.iniciar_estado()
+    main.iniciar_particoes_logs()
+    main.iniciar_gravacao_logs()
+
+
+def worker_exit(server, worker):
+    import main
+    main.encerrar()
@@ -1,10 +1,45 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, has_request_context, jsonify, request
 from flask_pydantic_spec import FlaskPydanticSpec
-from sqlalchemy import create_engine, Column, Integer, String, text, ForeignKey, DateTime, TIMESTAMP
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import Column, Integer, String, text, ForeignKey, DateTime, TIMESTAMP
+from sqlalchemy.orm import Session as SessaoOrm, sessionmaker, scoped_session, relationship
 from sqlalchemy.orm.decl_api import declarative_base
-from datetime import datetime
+from sqlalchemy import and_, or_, tuple_, func, cast, exists, Date, Time, Index, delete, bindparam, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy import event
+from pydantic import BaseModel, ValidationError
+from typing import Optional
+from datetime import date, datetime, timedelta
+from concurrent.futures import TimeoutError as FuturesTimeout
 import configparser
+import functools
+import itertools
+import os
+import select
+import threading
+import time
+import traceback
+from agendador import Agendador, acoes_por_sala
+from autenticacao import Tokens, carimbo, conferir_senha, eh_hash, escopos, gerar_hash
+from despacho import Despachante
+from cache import CacheLRU
+from compilacao import TabelaComandos
+from estado import CAMPOS as CAMPOS_ESTADO, ESTADOS, EstadoDispositivos
+from eventos import TIPOS as TIPOS_EVENTO, Difusor
+from fila_comandos import Comando, FilaComandos
+from gravacao import FilaCheia, GravadorLogs
+from banco import criar_engine, estatisticas_pool
+from migracao import aplicar_migracoes
+from metricas import Registro
+from particoes import ParticoesLogs
+from replicas import Replicas
+from relatorios import colunas, colunas_agregadas, compactar, juntar_dias, somar_por_grupo, uso_por_dia
+from serializacao import (FORMATOS_EXPORTACAO, Codificador, data_iso, dumps, hora_iso, pyarrow, quer_ndjson,
+                          resposta_exportacao, resposta_json, resposta_ndjson)
+import base64
+import csv
+import io
+import json
 
 # Criar um objeto ConfigParser
 config = configparser.ConfigParser()
@@ -19,26 +54,37 @@ usuario = config['BancoDeDados']['usuario']
 senha = config['BancoDeDados']['senha']
 banco = config['BancoDeDados']['banco']
 
-# # Construir a string de conexão
-db_url = f"postgresql+psycopg2://{usuario}:{senha}@db:{porta}/{banco}"
+# # Construir a string de conexão (DATABASE_URL sobrescreve, ex.: nos benchmarks)
+db_url = os.environ.get('DATABASE_URL', f"postgresql+psycopg2://{usuario}:{senha}@db:{porta}/{banco}")
 
 
-# Criar uma conexão com o banco de dados
-engine = create_engine(db_url)
+# Engine única da aplicação; o pool é configurado na seção [Pool] do config.ini
+engine = criar_engine(db_url, config)
 
-with open('model.sql', 'r') as arquivo_sql:
-    comandos_sql = arquivo_sql.read()
+# Réplicas de leitura da seção [Replicas] (REPLICAS_URLS sobrescreve); sem
+# nenhuma, tudo vai para a engine acima (ver ROTEAMENTO DE LEITURAS)
+urls_replicas = (os.environ.get('REPLICAS_URLS') or config.get('Replicas', 'urls', fallback='')).split(',')
+engines_replicas = [criar_engine(url.strip(), config) for url in urls_replicas if url.strip()]
+replicas = Replicas(
+    [(engine_replica.url.render_as_string(hide_password=True), engine_replica) for engine_replica in engines_replicas],
+    atraso_max=config.getfloat('Replicas', 'atraso_max', fallback=5),
+    intervalo=config.getfloat('Replicas', 'intervalo', fallback=2)
+)
 
-# Executar os comandos SQL no banco de dados
-with engine.connect() as connection:
-    trans = connection.begin()  # Iniciar uma transação
+# Aplicar somente as migrações pendentes de migracoes/ (ver migracao.py). Elas
+# são SQL do PostgreSQL; com outro banco (o SQLite das verificações em
+# benchmarks/) quem usa cria o esquema a partir dos modelos (Base.metadata.create_all)
+if engine.dialect.name == 'postgresql':
     try:
-        connection.execute(text(comandos_sql))  # Executar os comandos SQL
-        trans.commit()  # Confirmar a transação se executou com sucesso
-        print("Comandos SQL executados com sucesso!")
+        aplicadas = aplicar_migracoes(engine, 'migracoes')
+        for versao, nome in aplicadas:
+            print(f"Migração {versao:04d}_{nome} aplicada com sucesso!")
     except Exception as e:
-        trans.rollback()  # Reverter a transação se ocorreu algum erro
-        print(f"Erro ao executar os comandos SQL: {e}")
+        # Subir sem o esquema esperado só trocaria o erro por outros, mais tarde
+        print(f"Erro ao aplicar as migrações: {e}")
+        raise
+else:
+    print(f"Migrações não aplicadas: {engine.dialect.name} não é PostgreSQL")
 
 
 
@@ -49,11 +95,158 @@ spec.register(app)
 
 
 
-engine = create_engine(db_url)
-Session = sessionmaker(bind=engine)
+class SessaoRoteada(SessaoOrm):
+    # Numa requisição de leitura as consultas vão para a réplica escolhida em
+    # rotear_leitura(); flush, escritas e tudo fora de requisições, para a primária
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if not self._flushing and not getattr(clause, 'is_dml', False) and has_request_context():
+            replica = g.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+# Uma sessão por thread/requisição, descartada no fim de cada requisição
+Session = scoped_session(sessionmaker(bind=engine, class_=SessaoRoteada))
 Base = declarative_base()
 
-Base.metadata.create_all(engine)
+
+@app.teardown_appcontext
+def remover_sessao(exception=None):
+    Session.remove()
+
+
+@app.route('/pool', methods=['GET'])
+def get_pool():
+    return jsonify(estatisticas_pool(engine))
+
+
+###### MÉTRICAS #######
+
+# Exportadas em /metrics no formato do Prometheus. No gunicorn cada worker grava
+# as suas em METRICAS_DIR (ver gunicorn.conf.py) e /metrics soma as de todos.
+metricas = Registro(diretorio=os.environ.get('METRICAS_DIR') or config.get('Metricas', 'diretorio', fallback='') or None,
+                    intervalo=config.getfloat('Metricas', 'intervalo', fallback=5))
+REQUISICOES = metricas.contador('climabom_requisicoes_total', 'Requisições atendidas',
+                                ('metodo', 'rota', 'status'))
+DURACAO_REQUISICAO = metricas.histograma('climabom_requisicao_segundos', 'Duração das requisições',
+                                         ('metodo', 'rota'))
+EM_ANDAMENTO = metricas.medidor('climabom_requisicoes_em_andamento', 'Requisições sendo atendidas agora')
+CONSULTAS_REQUISICAO = metricas.histograma('climabom_sql_comandos_por_requisicao',
+                                           'Comandos SQL executados por requisição', ('metodo', 'rota'),
+                                           limites=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+TEMPO_SQL_REQUISICAO = metricas.histograma('climabom_sql_segundos_por_requisicao',
+                                           'Tempo gasto no banco por requisição', ('metodo', 'rota'))
+POOL_TAMANHO = metricas.medidor('climabom_pool_tamanho', 'Tamanho configurado do pool de conexões')
+POOL_CONEXOES = metricas.medidor('climabom_pool_conexoes', 'Conexões do pool por estado', ('estado',))
+POOL_CHECKOUTS = metricas.contador('climabom_pool_checkouts_total', 'Conexões retiradas do pool')
+POOL_ESPERA = metricas.contador('climabom_pool_espera_segundos_total', 'Tempo esperando uma conexão livre')
+POOL_TIMEOUTS = metricas.contador('climabom_pool_timeouts_total', 'Esperas por conexão que estouraram o tempo')
+
+# Requisições acima de lento_ms são registradas no log com os comandos SQL e,
+# no PostgreSQL, o EXPLAIN (ANALYZE, BUFFERS) dos SELECTs mais demorados.
+# O EXPLAIN ANALYZE executa a consulta de novo, por isso roda um de cada vez.
+LIMITE_LENTA = config.getfloat('Metricas', 'lento_ms', fallback=0) / 1000
+EXPLICAR_LENTAS = config.getboolean('Metricas', 'explicar', fallback=True)
+explicando = threading.BoundedSemaphore(1)
+
+
+@metricas.coletor
+def coletar_pool():
+    dados = estatisticas_pool(engine)
+    POOL_TAMANHO.definir(dados.get('tamanho', 0))
+    POOL_CONEXOES.definir(dados.get('em_uso', 0), ('em_uso',))
+    POOL_CONEXOES.definir(dados.get('livres', 0), ('livres',))
+    POOL_CONEXOES.definir(max(dados.get('overflow', 0), 0), ('overflow',))
+    estatisticas = getattr(engine.pool, 'estatisticas', None)
+    if estatisticas is not None:
+        POOL_CHECKOUTS.definir(estatisticas.checkouts)
+        POOL_ESPERA.definir(estatisticas.espera_total)
+        POOL_TIMEOUTS.definir(estatisticas.timeouts)
+
+
+@event.listens_for(engine, 'before_cursor_execute')
+def antes_do_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.inicio_sql = time.perf_counter()
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+def depois_do_sql(conn, cursor, statement, parameters, context, executemany):
+    # Só conta comandos feitos dentro de uma requisição (não os do agendador)
+    if context is None or not has_request_context() or 'inicio_requisicao' not in g:
+        return
+    duracao = time.perf_counter() - context.inicio_sql
+    g.comandos_sql += 1
+    g.tempo_sql += duracao
+    if g.sql_executado is not None:
+        g.sql_executado.append((duracao, statement, None if executemany else parameters))
+
+
+for replica in replicas.replicas:
+    event.listen(replica.engine, 'before_cursor_execute', antes_do_sql)
+    event.listen(replica.engine, 'after_cursor_execute', depois_do_sql)
+
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.comandos_sql = 0
+    g.tempo_sql = 0.0
+    g.sql_executado = [] if LIMITE_LENTA else None
+    EM_ANDAMENTO.inc()
+
+
+@app.after_request
+def guardar_status(response):
+    g.status_resposta = response.status_code
+    return response
+
+
+@app.teardown_request
+def finalizar_medicao(exception=None):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is None:
+        return
+    duracao = time.perf_counter() - inicio
+    EM_ANDAMENTO.dec()
+    # O modelo da rota (/salas/<int:id>) e não o caminho, para não explodir a cardinalidade
+    rota = request.url_rule.rule if request.url_rule is not None else 'desconhecida'
+    status = 500 if exception is not None else g.get('status_resposta', 500)
+    REQUISICOES.inc(rotulos=(request.method, rota, str(status)))
+    DURACAO_REQUISICAO.observar(duracao, (request.method, rota))
+    CONSULTAS_REQUISICAO.observar(g.comandos_sql, (request.method, rota))
+    TEMPO_SQL_REQUISICAO.observar(g.tempo_sql, (request.method, rota))
+    if LIMITE_LENTA and duracao >= LIMITE_LENTA:
+        # Fora da thread da requisição para não atrasar a resposta com o EXPLAIN
+        threading.Thread(target=registrar_lenta, daemon=True,
+                         args=(request.method, request.full_path, duracao, g.tempo_sql, g.sql_executado)).start()
+
+
+def registrar_lenta(metodo, caminho, duracao, tempo_sql, executado):
+    linhas = [f"Requisição lenta: {metodo} {caminho} {duracao * 1000:.1f} ms, "
+              f"{len(executado)} comandos SQL em {tempo_sql * 1000:.1f} ms"]
+    for tempo, comando, parametros in executado:
+        linhas.append(f"  {tempo * 1000:8.1f} ms  {' '.join(comando.split())}  {parametros}")
+    if EXPLICAR_LENTAS and engine.dialect.name == 'postgresql' and explicando.acquire(blocking=False):
+        try:
+            consultas = [item for item in executado if item[2] is not None
+                         and item[1].lstrip().upper().startswith(('SELECT', 'WITH'))]
+            for tempo, comando, parametros in sorted(consultas, key=lambda item: item[0], reverse=True)[:3]:
+                with engine.connect() as conexao:
+                    plano = conexao.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS) ' + comando, parametros).scalars().all()
+                linhas.append(f"  Plano do comando de {tempo * 1000:.1f} ms:")
+                linhas.extend('    ' + linha for linha in plano)
+        except Exception as e:
+            linhas.append(f"  Erro ao executar o EXPLAIN: {e}")
+        finally:
+            explicando.release()
+    app.logger.warning('\n'.join(linhas))
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metricas.texto(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 class Sala(Base):
@@ -72,8 +265,7 @@ class Equipamento(Base):
     marca = Column(String)
     id_protocolo = Column(Integer)
     comandos = relationship('Comandos', back_populates='equipamento')
-    logs = relationship('Logs', back_populates='equipamento')
-    usuarios = relationship('Usuario', back_populates='equipamento')
+    logs = relationship('Logs', back_populates='equipamento_ref')
     relacoes = relationship('Relacao', back_populates='equipamento')
 
 class Comandos(Base):
@@ -105,7 +297,7 @@ class Logs(Base):
     sala = Column(String)
     acao = Column(String)
 
-    equipamento = relationship('Equipamento', back_populates='logs')
+    equipamento_ref = relationship('Equipamento', back_populates='logs')
 
 class Permissoes(Base):
     __tablename__ = 'permissoes'
@@ -121,9 +313,8 @@ class Usuario(Base):
     senha = Column(String)
     permissao = Column(String)
     id_permissoes = Column(Integer, ForeignKey('permissoes.id'))
-    id_logs = Column(Integer, ForeignKey('logs.id'))
-
-    equipamento = relationship('Equipamento', back_populates='usuarios')
+    # Sem chave estrangeira desde que logs é particionada (migração 0007)
+    id_logs = Column(Integer)
 
 class Relacao(Base):
     __tablename__ = 'relacao'
@@ -133,142 +324,664 @@ class Relacao(Base):
 
     equipamento = relationship('Equipamento', back_populates='relacoes')
 
+    __table_args__ = (Index('uq_relacao_sala_equipamento', 'id_sala', 'id_equipamento', unique=True),)
+
 class Protocolo(Base):
     __tablename__ = 'protocolo'
     id = Column(Integer, primary_key=True)
     descricao = Column(String)
     id_comando = Column(Integer, ForeignKey('comandos.id'))
+
+###### CODIFICADORES #######
+
+# Campos e conversões de cada modelo, montados uma vez (ver serializacao.py)
+CODIFICADOR_SALA = Codificador.do_modelo(Sala)
+CODIFICADOR_EQUIPAMENTO = Codificador.do_modelo(Equipamento)
+CODIFICADOR_COMANDOS = Codificador.do_modelo(Comandos)
+CODIFICADOR_AGENDA = Codificador.do_modelo(Agenda, conversores={
+    'datas': data_iso,
+    'hora_inicio': hora_iso,
+    'hora_fim': hora_iso
+})
+CODIFICADOR_LOGS = Codificador.do_modelo(Logs)
+CODIFICADOR_PERMISSOES = Codificador.do_modelo(Permissoes)
+# Sem a coluna senha: o hash nunca sai pela API
+CODIFICADOR_USUARIO = Codificador(*(coluna for coluna in Usuario.__table__.columns if coluna.key != 'senha'))
+CODIFICADOR_RELACAO = Codificador.do_modelo(Relacao)
+CODIFICADOR_PROTOCOLO = Codificador.do_modelo(Protocolo)
+
+###### MODELOS DE VALIDAÇÃO #######
+
+# Modelos pydantic usados direto nos handlers, linha a linha (POST /logs/bulk
+# rejeita só as linhas inválidas); não passam pelo spec.validate, que valida o
+# corpo inteiro contra um modelo só
+class LogModel(BaseModel):
+    datas: Optional[datetime] = None
+    hora: Optional[datetime] = None
+    equipamento: Optional[str] = None
+    id_equipamento: Optional[int] = None
+    usuario: Optional[str] = None
+    sala: Optional[str] = None
+    acao: Optional[str] = None
+
+class AgendaModel(BaseModel):
+    disciplina: Optional[str] = None
+    datas: datetime
+    hora_inicio: datetime
+    hora_fim: datetime
+    id_sala: int
+
 # Rota para buscar todos os registros de uma tabela
 
+###### ROTEAMENTO DE LEITURAS #######
+
+# Com réplicas configuradas, cada GET escolhe uma em rotear_leitura() e usa só
+# ela (SessaoRoteada); sem réplica disponível a leitura fica na primária.
+# Read-your-writes: uma escrita bem-sucedida devolve o cookie ler_primaria e,
+# enquanto ele vale, as leituras daquele cliente vão para a primária; clientes
+# sem cookies podem mandar o cabeçalho X-Ler-Primaria. Os caches compartilhados
+# pelo worker (catálogo, permissões, comandos, estado) são sempre carregados da
+# primária (na_primaria), para uma réplica atrasada não ficar guardada neles.
+FIXAR_APOS_ESCRITA = config.getint('Replicas', 'fixar_apos_escrita', fallback=5)
+COOKIE_PRIMARIA = 'ler_primaria'
+REPLICA_DISPONIVEL = metricas.medidor('climabom_replica_disponivel', 'Réplica de leitura no rodízio (1) ou fora (0)',
+                                      ('replica',))
+REPLICA_ATRASO = metricas.medidor('climabom_replica_atraso_segundos', 'Atraso da réplica em relação à primária',
+                                  ('replica',))
+LEITURAS_REPLICA = metricas.contador('climabom_replica_leituras_total', 'Requisições de leitura por banco',
+                                     ('banco',))
+
+
+@metricas.coletor
+def coletar_replicas():
+    if not replicas:
+        return
+    dados = replicas.estatisticas()
+    LEITURAS_REPLICA.definir(dados['leituras_na_primaria'], ('primaria',))
+    for replica in dados['replicas']:
+        REPLICA_DISPONIVEL.definir(int(replica['disponivel']), (replica['nome'],))
+        REPLICA_ATRASO.definir(replica['atraso'] if replica['atraso'] is not None else -1, (replica['nome'],))
+        LEITURAS_REPLICA.definir(replica['leituras'], (replica['nome'],))
+
+
+@app.before_request
+def rotear_leitura():
+    g.replica = None
+    if not replicas or request.method not in METODOS_LEITURA:
+        return None
+    if request.cookies.get(COOKIE_PRIMARIA) or request.headers.get('X-Ler-Primaria'):
+        return None
+    g.replica = replicas.escolher()
+    return None
+
+
+@app.after_request
+def fixar_primaria(response):
+    if replicas and FIXAR_APOS_ESCRITA and request.method not in METODOS_LEITURA and response.status_code < 400:
+        response.set_cookie(COOKIE_PRIMARIA, '1', max_age=FIXAR_APOS_ESCRITA, httponly=True, samesite='Lax')
+    return response
+
+
+def na_primaria(funcao):
+    @functools.wraps(funcao)
+    def executar(*args, **kwargs):
+        replica = g.get('replica') if has_request_context() else None
+        if replica is None:
+            return funcao(*args, **kwargs)
+        g.replica = None
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            g.replica = replica
+    return executar
+
+
+def iniciar_replicas():
+    replicas.descartar_conexoes()
+    replicas.iniciar()
+
+
+@app.route('/replicas', methods=['GET'])
+def get_replicas():
+    return jsonify(replicas.estatisticas())
+
+###### CACHE DO CATÁLOGO #######
+
+# Leituras de equipamento, comandos, protocolo e permissoes passam por este cache.
+# Chaves: (tabela, None) para a listagem e (tabela, id) para um registro.
+# Cada worker tem o seu: quem grava invalida o próprio e, no PostgreSQL, avisa
+# os outros pelo canal 'catalogo' (ver escutar_estado).
+cache_catalogo = CacheLRU(
+    max_itens=config.getint('Cache', 'max_itens', fallback=1024),
+    ttl=config.getfloat('Cache', 'ttl', fallback=60)
+)
+# Acima disso o aviso limpa o cache inteiro (o NOTIFY aceita até 8000 bytes)
+MAX_IDS_AVISO_CATALOGO = 500
+
+
+def invalidar_catalogo(tabela, *ids):
+    # Chamado depois do commit
+    ids = [str(id) for id in ids]
+    cache_catalogo.invalidar((tabela, None), *[(tabela, id) for id in ids])
+    if engine.dialect.name == 'postgresql':
+        aviso = {'origem': os.getpid(), 'tabela': tabela,
+                 'ids': ids if len(ids) <= MAX_IDS_AVISO_CATALOGO else None}
+        Session.execute(text("SELECT pg_notify('catalogo', :aviso)"), {'aviso': json.dumps(aviso)})
+        Session.commit()
+
+
+def aplicar_aviso_catalogo(aviso):
+    dados = json.loads(aviso)
+    if dados['origem'] == os.getpid():
+        return
+    if dados['ids'] is None:
+        cache_catalogo.limpar()
+    else:
+        cache_catalogo.invalidar((dados['tabela'], None), *[(dados['tabela'], id) for id in dados['ids']])
+
+
+@na_primaria
+def carregar_todos(codificador):
+    linhas = Session.execute(codificador.select().order_by(codificador.coluna('id'))).all()
+    return codificador.lista(linhas)
+
+
+@na_primaria
+def carregar_por_id(codificador, id):
+    linha = Session.execute(codificador.select().where(codificador.coluna('id') == id)).first()
+    return codificador.dict(linha) if linha else None
+
+
+def listar(codificador, *filtros):
+    # Listagem completa; com ?formato=ndjson as linhas são enviadas à medida que chegam
+    consulta = codificador.select().where(*filtros).order_by(codificador.coluna('id'))
+    if quer_ndjson():
+        return resposta_ndjson(Session.execute(consulta.execution_options(yield_per=1000)), codificador)
+    return codificador.lista(Session.execute(consulta).all())
+
+
+@app.route('/cache', methods=['GET'])
+def get_cache():
+    return jsonify(cache_catalogo.estatisticas())
+
+###### AUTENTICAÇÃO #######
+
+# POST /login confere a senha (PBKDF2, só aqui) e devolve um token assinado
+# (ver autenticacao.py). Em cada requisição o token é conferido com um HMAC e os
+# escopos do usuário (usuario.permissao + permissoes.acesso) vêm de um cache
+# curto por usuário, sem join no banco. Alterar usuário ou permissão invalida o
+# cache aqui e, no PostgreSQL, nos outros workers (NOTIFY 'permissoes').
+#
+# Escopos exigidos: leitura para GET, escrita para as demais, comando para
+# POST /salas/comando e admin para /usuarios e /permissoes. Com exigir = false
+# requisições sem token passam como antes, mas um token enviado ainda é conferido
+# e as rotas de ESCOPOS_SEMPRE_EXIGIDOS continuam exigindo token (o primeiro
+# administrador é criado direto no banco; a senha em texto puro vira hash no
+# primeiro login).
+EXIGIR_AUTENTICACAO = config.getboolean('Autenticacao', 'exigir', fallback=False)
+ESCOPOS_SEMPRE_EXIGIDOS = {'admin', 'comando'}
+if not EXIGIR_AUTENTICACAO:
+    print('AVISO: [Autenticacao] exigir = false: requisições sem token são aceitas '
+          f'(exceto nas rotas de escopo {", ".join(sorted(ESCOPOS_SEMPRE_EXIGIDOS))})')
+ITERACOES_SENHA = config.getint('Autenticacao', 'iteracoes', fallback=200_000)
+# Sem segredo configurado cada boot sorteia um (compartilhado pelos workers via
+# preload) e os tokens emitidos antes deixam de valer
+tokens = Tokens(os.environ.get('SEGREDO_TOKENS') or config.get('Autenticacao', 'segredo', fallback='')
+                or os.urandom(32),
+                validade=config.getfloat('Autenticacao', 'validade_horas', fallback=12) * 3600)
+cache_permissoes = CacheLRU(
+    max_itens=config.getint('Autenticacao', 'max_usuarios', fallback=4096),
+    ttl=config.getfloat('Autenticacao', 'ttl_permissoes', fallback=30)
+)
+ROTAS_PUBLICAS = {'login', 'health', 'get_metrics', 'static'}
+ROTAS_ADMIN = ('/usuarios', '/permissoes')
+METODOS_LEITURA = {'GET', 'HEAD', 'OPTIONS'}
+
+
+@na_primaria
+def resolver_permissoes(id_usuario):
+    linha = (Session.query(Usuario.senha, Usuario.permissao, Permissoes.acesso)
+             .outerjoin(Permissoes, Permissoes.id == Usuario.id_permissoes)
+             .filter(Usuario.id == id_usuario)
+             .first())
+    if linha is None:
+        return None
+    return {'escopos': escopos(linha.permissao, linha.acesso), 'carimbo': carimbo(linha.senha)}
+
+
+def permissoes_alteradas(id_usuario=None):
+    # id_usuario=None: uma permissão mudou e pode valer para qualquer usuário
+    if id_usuario is None:
+        cache_permissoes.limpar()
+    else:
+        cache_permissoes.invalidar(int(id_usuario))
+    if engine.dialect.name == 'postgresql':
+        Session.execute(text("SELECT pg_notify('permissoes', :aviso)"),
+                        {'aviso': '' if id_usuario is None else str(int(id_usuario))})
+        Session.commit()
+
+
+def aplicar_aviso_permissoes(aviso):
+    if aviso:
+        cache_permissoes.invalidar(int(aviso))
+    else:
+        cache_permissoes.limpar()
+
+
+def escopo_necessario():
+    if request.endpoint == 'enviar_comando_salas':
+        return 'comando'
+    if request.path.startswith(ROTAS_ADMIN):
+        return 'admin'
+    return 'leitura' if request.method in METODOS_LEITURA else 'escrita'
+
+
+def token_da_requisicao():
+    # EventSource (GET /eventos) não envia cabeçalhos, daí o ?token=
+    cabecalho = request.headers.get('Authorization', '')
+    if cabecalho[:7].lower() == 'bearer ':
+        return cabecalho[7:].strip()
+    return request.args.get('token')
+
+
+@app.before_request
+def autenticar():
+    if request.endpoint in ROTAS_PUBLICAS or request.path.startswith('/apidoc'):
+        return None
+    token = token_da_requisicao()
+    if not token:
+        if EXIGIR_AUTENTICACAO or escopo_necessario() in ESCOPOS_SEMPRE_EXIGIDOS:
+            return jsonify({'message': 'Autenticação necessária'}), 401
+        return None
+    identificacao = tokens.validar(token)
+    if identificacao is None:
+        return jsonify({'message': 'Token inválido ou expirado'}), 401
+    id_usuario, carimbo_senha = identificacao
+    permissoes = cache_permissoes.obter(id_usuario, lambda: resolver_permissoes(id_usuario))
+    # Usuário removido ou senha trocada depois da emissão do token
+    if permissoes is None or permissoes['carimbo'] != carimbo_senha:
+        return jsonify({'message': 'Token inválido ou expirado'}), 401
+    if escopo_necessario() not in permissoes['escopos']:
+        return jsonify({'message': 'Permissão insuficiente'}), 403
+    g.id_usuario = id_usuario
+    return None
+
+
+@app.route('/login', methods=['POST'])
+def login():
+    # Corpo: {"email": "...", "senha": "..."}
+    data = request.get_json(silent=True) or {}
+    usuario = Session.query(Usuario).filter_by(email=data.get('email')).first()
+    if usuario is None or not conferir_senha(data.get('senha'), usuario.senha):
+        return jsonify({'message': 'Email ou senha inválidos'}), 401
+    if not eh_hash(usuario.senha):
+        # Senha ainda em texto puro (gravada antes do hash): regrava já com hash
+        usuario.senha = gerar_hash(data['senha'], ITERACOES_SENHA)
+        Session.commit()
+        permissoes_alteradas(usuario.id)
+    token, expira = tokens.emitir(usuario.id, carimbo(usuario.senha))
+    permissoes = cache_permissoes.obter(usuario.id, lambda: resolver_permissoes(usuario.id))
+    return jsonify({'token': token, 'expira_em': datetime.fromtimestamp(expira).isoformat(),
+                    'escopos': sorted(permissoes['escopos'])})
+
+
+@app.route('/login/estatisticas', methods=['GET'])
+def get_estatisticas_login():
+    return jsonify(cache_permissoes.estatisticas())
+
+###### FILTROS E BUSCA NO CATÁLOGO #######
+
+# GET /salas e GET /equipamentos aceitam filtros exatos (?bloco=A ou ?bloco=A,B),
+# trecho de texto (?descricao=, sem diferenciar maiúsculas, atendido pelo índice
+# de trigramas da migração 0008), ?ordenar=bloco,-andar e paginação por cursor
+# (keyset) com ?limite= e ?cursor=, como em /logs. Sem limite nem cursor a
+# resposta continua sendo a lista completa.
+ITENS_POR_PAGINA_MAX = 1000
+# Por tabela: filtros exatos, filtros por trecho e campos de ordenação
+FILTROS_CATALOGO = {
+    'salas': (CODIFICADOR_SALA, ('id', 'bloco', 'andar', 'ip'), ('descricao',),
+              ('descricao', 'bloco', 'andar', 'ip')),
+    'equipamentos': (CODIFICADOR_EQUIPAMENTO, ('id', 'marca', 'modelo', 'id_protocolo'), ('descricao',),
+                     ('descricao', 'marca', 'modelo')),
+}
+
+
+def escapar_like(valor):
+    return valor.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def filtros_catalogo(codificador, args, exatos, trechos):
+    # Levanta ValueError para valores que não convertem no tipo da coluna
+    filtros = []
+    for campo in exatos:
+        if args.get(campo):
+            coluna = codificador.coluna(campo)
+            valores = [coluna.type.python_type(valor) for valor in args[campo].split(',')]
+            filtros.append(coluna.in_(valores) if len(valores) > 1 else coluna == valores[0])
+    for campo in trechos:
+        if args.get(campo):
+            filtros.append(codificador.coluna(campo).ilike(f'%{escapar_like(args[campo])}%', escape='\\'))
+    return filtros
+
+
+def ordem_catalogo(codificador, args, ordenaveis):
+    # [(campo, expressão, descendente)] terminando em id, que desempata e fecha o cursor.
+    # Os campos de texto são ordenados com NULL como '' para o cursor poder compará-los
+    ordem = []
+    for nome in filter(None, args.get('ordenar', '').split(',')):
+        campo = nome.lstrip('-')
+        if campo not in ordenaveis:
+            raise ValueError(f'ordenar: campo inválido {campo}')
+        ordem.append((campo, func.coalesce(codificador.coluna(campo), ''), nome.startswith('-')))
+    ordem.append(('id', codificador.coluna('id'), False))
+    return ordem
+
+
+def apos_cursor(ordem, valores):
+    # Linhas depois do cursor na ordem dada: a > x OR (a = x AND b > y) OR ...
+    condicoes = []
+    for i, (_, expressao, descendente) in enumerate(ordem):
+        iguais = [anterior == valor for (_, anterior, _), valor in zip(ordem[:i], valores)]
+        condicoes.append(and_(*iguais, expressao < valores[i] if descendente else expressao > valores[i]))
+    return or_(*condicoes)
+
+
+def codificar_cursor_catalogo(ordem, linha):
+    valores = [getattr(linha, campo) if campo == 'id' else getattr(linha, campo) or '' for campo, _, _ in ordem]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+
+def decodificar_cursor_catalogo(cursor, ordem):
+    valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(valores, list) or len(valores) != len(ordem):
+        raise ValueError('cursor não corresponde à ordenação')
+    return valores
+
+
+def listar_catalogo(nome, args):
+    codificador, exatos, trechos, ordenaveis = FILTROS_CATALOGO[nome]
+    paginar = 'limite' in args or 'cursor' in args
+    try:
+        filtros = filtros_catalogo(codificador, args, exatos, trechos)
+        ordem = ordem_catalogo(codificador, args, ordenaveis)
+        limite = min(int(args.get('limite', ITENS_POR_PAGINA_MAX)), ITENS_POR_PAGINA_MAX)
+        if limite < 1:
+            raise ValueError('limite deve ser positivo')
+        if args.get('cursor'):
+            filtros.append(apos_cursor(ordem, decodificar_cursor_catalogo(args['cursor'], ordem)))
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Parâmetros de consulta inválidos: {e}'}), 400
+
+    consulta = (codificador.select().where(*filtros)
+                .order_by(*(expressao.desc() if descendente else expressao for _, expressao, descendente in ordem)))
+    if paginar:
+        consulta = consulta.limit(limite)
+    if quer_ndjson():
+        return resposta_ndjson(Session.execute(consulta.execution_options(yield_per=1000)), codificador)
+    linhas = Session.execute(consulta).all()
+    if not paginar:
+        return resposta_json(codificador.lista(linhas))
+    proximo = codificar_cursor_catalogo(ordem, linhas[-1]) if len(linhas) == limite else None
+    return resposta_json({nome: codificador.lista(linhas), 'proximo': proximo})
+
+
+# GET /busca?q= procura em salas (descricao, bloco, andar) e equipamentos
+# (descricao, modelo, marca). No PostgreSQL casa trechos (ILIKE) e palavras
+# parecidas (pg_trgm, operador <%) pelos índices da migração 0008, com quem
+# começa pelo termo primeiro e depois os mais parecidos. Nos demais bancos só
+# casa trechos.
+BUSCA_POR_TIPO = 20
+BUSCA_POR_TIPO_MAX = 100
+# Mesmas expressões dos índices idx_*_busca_trgm
+TEXTO_BUSCA = {
+    'salas': ('salas', CODIFICADOR_SALA,
+              "coalesce(descricao, '') || ' ' || coalesce(bloco, '') || ' ' || coalesce(andar, '')"),
+    'equipamentos': ('equipamento', CODIFICADOR_EQUIPAMENTO,
+                     "coalesce(descricao, '') || ' ' || coalesce(modelo, '') || ' ' || coalesce(marca, '')"),
+}
+
+
+def buscar(tipo, termo, limite):
+    tabela, codificador, texto = TEXTO_BUSCA[tipo]
+    escapado = escapar_like(termo)
+    parametros = {'q': termo, 'trecho': f'%{escapado}%', 'inicio': f'{escapado}%',
+                  'palavra': f'% {escapado}%', 'limite': limite}
+    if engine.dialect.name == 'postgresql':
+        casa = lambda parametro: f'{texto} ILIKE :{parametro}'
+        similaridade = f'word_similarity(:q, {texto})'
+        condicao = f"{casa('trecho')} OR :q <% {texto}"
+    else:
+        # LIKE do SQLite já ignora maiúsculas (ASCII), mas não tem escape padrão
+        casa = lambda parametro: f"{texto} LIKE :{parametro} ESCAPE '\\'"
+        similaridade = 'NULL'
+        condicao = casa('trecho')
+    linhas = Session.execute(text(f"""
+        SELECT {', '.join(codificador.nomes)}, {similaridade} AS similaridade,
+               ({casa('inicio')} OR {casa('palavra')}) AS prefixo
+        FROM {tabela}
+        WHERE {condicao}
+        ORDER BY prefixo DESC, similaridade DESC, id
+        LIMIT :limite
+    """), parametros).all()
+    resultados = []
+    for linha in linhas:
+        item = codificador.dict(linha)
+        if linha.similaridade is not None:
+            item['similaridade'] = round(linha.similaridade, 3)
+        resultados.append(item)
+    return resultados
+
+
+@app.route('/busca', methods=['GET'])
+def get_busca():
+    # ?q=termo&tipos=salas,equipamentos&limite=20
+    termo = request.args.get('q', '').strip()
+    if not termo:
+        return jsonify({'message': 'Informe o termo em q'}), 400
+    tipos = [tipo for tipo in request.args.get('tipos', ','.join(TEXTO_BUSCA)).split(',') if tipo]
+    try:
+        limite = min(int(request.args.get('limite', BUSCA_POR_TIPO)), BUSCA_POR_TIPO_MAX)
+        if limite < 1 or not tipos or any(tipo not in TEXTO_BUSCA for tipo in tipos):
+            raise ValueError
+    except ValueError:
+        return jsonify({'message': 'Parâmetros de consulta inválidos'}), 400
+    return resposta_json({'q': termo, **{tipo: buscar(tipo, termo, limite) for tipo in tipos}})
+
 ###### SALAS #######
 
 @app.route('/salas', methods=['GET'])
 def get_salas():
-    Session = sessionmaker(bind=engine)
-    Session = Session()
-    salas = Session.query(Sala).all()
-    Session.close()
-    return jsonify([s.__dict__ for s in salas])
+    return listar_catalogo('salas', request.args)
 
 @app.route('/salas', methods=['POST'])
 def create_sala():
     data = request.get_json()
     nova_sala = Sala(**data)
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     Session.add(nova_sala)
     Session.commit()
     Session.close()
+    invalidar_catalogo('localizacao')
     return jsonify({'message': 'Sala criada com sucesso!'}), 201
 
+@app.route('/salas/livres', methods=['GET'])
+def get_salas_livres():
+    try:
+        inicio = datetime.fromisoformat(request.args['inicio'])
+        fim = datetime.fromisoformat(request.args['fim'])
+    except (KeyError, ValueError):
+        return jsonify({'message': 'Informe inicio e fim no formato ISO 8601'}), 400
+    if fim <= inicio:
+        return jsonify({'message': 'fim deve ser maior que inicio'}), 400
+
+    # Mesma expressão da restrição agenda_sem_conflito, para usar o índice GiST
+    reserva = func.tsrange(cast(Agenda.datas, Date) + cast(Agenda.hora_inicio, Time),
+                           cast(Agenda.datas, Date) + cast(Agenda.hora_fim, Time))
+    ocupada = exists().where(Agenda.id_sala == Sala.id,
+                             reserva.op('&&')(func.tsrange(inicio, fim)))
+    session = Session()
+    consulta = session.query(Sala).filter(~ocupada)
+    for campo in ('bloco', 'andar'):
+        valor = request.args.get(campo)
+        if valor is not None:
+            consulta = consulta.filter(getattr(Sala, campo) == valor)
+    salas = consulta.order_by(Sala.id).all()
+    session.close()
+    output = [{
+        'id': sala.id,
+        'descricao': sala.descricao,
+        'andar': sala.andar,
+        'bloco': sala.bloco,
+        'ip': sala.ip
+    } for sala in salas]
+    return jsonify({'salas': output})
+
+def montar_planos(*filtros):
+    # Uma única consulta traz sala, equipamentos, protocolo e comandos; as linhas
+    # (sala x equipamento x comando) são agrupadas em um só passe, sem carregar
+    # objetos ORM nem disparar os relationships preguiçosos de Equipamento
+    session = Session()
+    linhas = (session.query(Sala.id, Sala.descricao, Sala.andar, Sala.bloco, Sala.ip,
+                            Equipamento.id, Equipamento.modelo, Equipamento.descricao, Equipamento.marca,
+                            Protocolo.id, Protocolo.descricao,
+                            Comandos.id, Comandos.comando, Comandos.descricao)
+              .outerjoin(Relacao, Relacao.id_sala == Sala.id)
+              .outerjoin(Equipamento, Equipamento.id == Relacao.id_equipamento)
+              .outerjoin(Protocolo, Protocolo.id == Equipamento.id_protocolo)
+              .outerjoin(Comandos, Comandos.id_protocolo == Equipamento.id_protocolo)
+              .filter(*filtros)
+              .order_by(Sala.id, Equipamento.id, Comandos.id)
+              .all())
+    session.close()
+
+    planos = []
+    sala = equipamento = None
+    for (id_sala, descricao_sala, andar, bloco, ip, id_equipamento, modelo, descricao_equipamento,
+         marca, id_protocolo, descricao_protocolo, id_comando, comando, descricao_comando) in linhas:
+        if sala is None or sala['id'] != id_sala:
+            sala = {'id': id_sala, 'descricao': descricao_sala, 'andar': andar, 'bloco': bloco,
+                    'ip': ip, 'equipamentos': []}
+            planos.append(sala)
+            equipamento = None
+        if id_equipamento is None:
+            continue
+        if equipamento is None or equipamento['id'] != id_equipamento:
+            equipamento = {'id': id_equipamento, 'modelo': modelo, 'descricao': descricao_equipamento,
+                           'marca': marca, 'comandos': [],
+                           'protocolo': {'id': id_protocolo, 'descricao': descricao_protocolo}
+                           if id_protocolo is not None else None}
+            sala['equipamentos'].append(equipamento)
+        if id_comando is not None:
+            equipamento['comandos'].append({'id': id_comando, 'comando': comando,
+                                            'descricao': descricao_comando})
+    return planos
+
+
+@app.route('/salas/<int:id>/plano', methods=['GET'])
+def get_plano_sala(id):
+    planos = montar_planos(Sala.id == id)
+    if not planos:
+        return jsonify({'message': 'Sala não encontrada'}), 404
+    return jsonify({'plano': planos[0]})
+
+
+@app.route('/salas/plano', methods=['GET'])
+def get_planos_salas():
+    filtros = [getattr(Sala, campo) == request.args[campo]
+               for campo in ('bloco', 'andar') if campo in request.args]
+    return jsonify({'planos': montar_planos(*filtros)})
+
 @app.route('/salas/<int:id>', methods=['GET'])
 def get_sala(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    sala = Session.query(Sala).filter_by(id=id).first()
-    Session.close()
-    return jsonify(sala.__dict__)
+    sala = carregar_por_id(CODIFICADOR_SALA, id)
+    if not sala:
+        return jsonify({'message': 'Sala não encontrada'}), 404
+    return resposta_json(sala)
 
 @app.route('/salas/<int:id>', methods=['PUT'])
 def update_sala(id):
     data = request.get_json()
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     sala = Session.query(Sala).filter_by(id=id).first()
     for key, value in data.items():
         setattr(sala, key, value)
     Session.commit()
     Session.close()
+    invalidar_catalogo('localizacao')
     return jsonify({'message': 'Sala atualizada com sucesso!'})
 
 
 @app.route('/salas/<int:id>', methods=['DELETE'])
 def delete_sala(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     sala = Session.query(Sala).filter_by(id=id).first()
     Session.delete(sala)
     Session.commit()
     Session.close()
+    invalidar_catalogo('localizacao')
     return jsonify({'message': 'Sala excluída com sucesso!'})
 
 ####### EQUIPAMENTO #######
 
 @app.route('/equipamentos', methods=['GET'])
 def get_equipamentos():
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    equipamentos = Session.query(Equipamento).all()
-    Session.close()
-    return jsonify([e.__dict__ for e in equipamentos])
+    if request.args:
+        return listar_catalogo('equipamentos', request.args)
+    equipamentos = cache_catalogo.obter(('equipamento', None), lambda: carregar_todos(CODIFICADOR_EQUIPAMENTO))
+    return resposta_json(equipamentos)
 
 @app.route('/equipamentos', methods=['POST'])
 def create_equipamento():
     data = request.get_json()
     novo_equipamento = Equipamento(**data) 
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     Session.add(novo_equipamento)
     Session.commit()
+    id_equipamento = novo_equipamento.id
     Session.close()
+    invalidar_catalogo('equipamento')
+    comandos_alterados(equipamentos=[id_equipamento])
     return jsonify({'message': 'Equipamento criado com sucesso!'}), 201
 
 @app.route('/equipamentos/<int:id>', methods=['GET'])
 def get_equipamento(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    equipamento = Session.query(Equipamento).filter_by(id=id).first()
-    Session.close()
-    return jsonify(equipamento.__dict__)
+    equipamento = cache_catalogo.obter(
+        ('equipamento', str(id)), lambda: carregar_por_id(CODIFICADOR_EQUIPAMENTO, id))
+    if not equipamento:
+        return jsonify({'message': 'Equipamento não encontrado'}), 404
+    return resposta_json(equipamento)
 
 @app.route('/equipamentos/<int:id>', methods=['PUT'])
 def update_equipamento(id):
     data = request.get_json()
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     equipamento = Session.query(Equipamento).filter_by(id=id).first()
     for key, value in data.items():
         setattr(equipamento, key, value)
     Session.commit()
     Session.close()
+    invalidar_catalogo('equipamento', id)
+    comandos_alterados(equipamentos=[id])
     return jsonify({'message': 'Equipamento atualizado com sucesso!'})
 
 @app.route('/equipamentos/<int:id>', methods=['DELETE'])
 def delete_equipamento(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     equipamento = Session.query(Equipamento).filter_by(id=id).first()
     Session.delete(equipamento)
     Session.commit()
     Session.close()
+    invalidar_catalogo('equipamento', id)
+    comandos_alterados(equipamentos=[id])
     return jsonify({'message': 'Equipamento excluído com sucesso!'})
 
 ########### COMANDOS #####################
 
 @app.route('/comandos', methods=['GET'])
 def get_comandos():
-    comandos = Comandos.query.all()
-    output = []
-    for comando in comandos:
-        comando_data = {}
-        comando_data['id'] = comando.id
-        comando_data['comando'] = comando.comando
-        comando_data['descricao'] = comando.descricao
-        comando_data['id_protocolo'] = comando.id_protocolo
-        output.append(comando_data)
-    return jsonify({'comandos': output})
+    output = cache_catalogo.obter(('comandos', None), lambda: carregar_todos(CODIFICADOR_COMANDOS))
+    return resposta_json({'comandos': output})
 
 @app.route('/comandos/<id>', methods=['GET'])
 def get_comando(id):
-    comando = Comandos.query.get(id)
-    if not comando:
+    comando_data = cache_catalogo.obter(('comandos', str(id)), lambda: carregar_por_id(CODIFICADOR_COMANDOS, id))
+    if not comando_data:
         return jsonify({'message': 'Comando não encontrado'})
-    comando_data = {}
-    comando_data['id'] = comando.id
-    comando_data['comando'] = comando.comando
-    comando_data['descricao'] = comando.descricao
-    comando_data['id_protocolo'] = comando.id_protocolo
-    return jsonify({'comando': comando_data})
+    return resposta_json({'comando': comando_data})
 
 @app.route('/comandos', methods=['POST'])
 def add_comando():
@@ -276,27 +989,35 @@ def add_comando():
     new_comando = Comandos(comando=data['comando'], descricao=data['descricao'], id_protocolo=data['id_protocolo'])
     Session.add(new_comando)
     Session.commit()
+    invalidar_catalogo('comandos')
+    comandos_alterados(protocolos=[new_comando.id_protocolo])
     return jsonify({'message': 'Comando criado com sucesso'})
 
 @app.route('/comandos/<id>', methods=['PUT'])
 def update_comando(id):
-    comando = Comandos.query.get(id)
+    comando = Session.get(Comandos, id)
     if not comando:
         return jsonify({'message': 'Comando não encontrado'})
     data = request.get_json()
+    protocolo_anterior = comando.id_protocolo
     comando.comando = data['comando']
     comando.descricao = data['descricao']
     comando.id_protocolo = data['id_protocolo']
     Session.commit()
+    invalidar_catalogo('comandos', id)
+    comandos_alterados(protocolos=[protocolo_anterior, data['id_protocolo']])
     return jsonify({'message': 'Comando atualizado com sucesso'})
 
 @app.route('/comandos/<id>', methods=['DELETE'])
 def delete_comando(id):
-    comando = Comandos.query.get(id)
+    comando = Session.get(Comandos, id)
     if not comando:
         return jsonify({'message': 'Comando não encontrado'})
+    id_protocolo = comando.id_protocolo
     Session.delete(comando)
     Session.commit()
+    invalidar_catalogo('comandos', id)
+    comandos_alterados(protocolos=[id_protocolo])
     return jsonify({'message': 'Comando excluído com sucesso'})
 
 
@@ -304,109 +1025,614 @@ def delete_comando(id):
 
 @app.route('/agenda', methods=['GET'])
 def get_agenda():
-    agenda = Agenda.query.all()
-    output = []
-    for item in agenda:
-        agenda_data = {
-            'id': item.id,
-            'disciplina': item.disciplina,
-            'datas': item.datas.strftime("%Y-%m-%d"),
-            'hora_inicio': item.hora_inicio.strftime("%H:%M:%S"),
-            'hora_fim': item.hora_fim.strftime("%H:%M:%S"),
-            'id_sala': item.id_sala
-        }
-        output.append(agenda_data)
-    return jsonify({'agenda': output})
+    output = listar(CODIFICADOR_AGENDA)
+    if quer_ndjson():
+        return output
+    return resposta_json({'agenda': output})
 
 @app.route('/agenda/<id>', methods=['GET'])
 def get_agenda_by_id(id):
-    item = Agenda.query.get(id)
-    if not item:
+    agenda_data = carregar_por_id(CODIFICADOR_AGENDA, id)
+    if not agenda_data:
         return jsonify({'message': 'Item da agenda não encontrado'})
-    
-    agenda_data = {
-        'id': item.id,
-        'disciplina': item.disciplina,
-        'datas': item.datas.strftime("%Y-%m-%d"),
-        'hora_inicio': item.hora_inicio.strftime("%H:%M:%S"),
-        'hora_fim': item.hora_fim.strftime("%H:%M:%S"),
-        'id_sala': item.id_sala
-    }
-    return jsonify({'agenda': agenda_data})
+    return resposta_json({'agenda': agenda_data})
+
+# Código do PostgreSQL para violação de exclusão (restrição agenda_sem_conflito)
+CONFLITO_AGENDA = '23P01'
+CHAVE_ESTRANGEIRA_INVALIDA = '23503'
+
+
+def validar_agenda():
+    # (campos, None) ou (None, resposta 400), antes de tocar no banco
+    try:
+        item = AgendaModel(**(request.get_json(silent=True) or {}))
+    except ValidationError as e:
+        return None, (jsonify({'message': 'Item da agenda inválido', 'erros': erros_validacao(e)}), 400)
+    # Só o horário conta (ver intervalo_agenda)
+    if item.hora_fim.time() <= item.hora_inicio.time():
+        return None, (jsonify({'message': 'hora_fim deve ser maior que hora_inicio'}), 400)
+    return item.model_dump(), None
+
+
+def erro_gravacao_agenda(e):
+    Session.rollback()
+    codigo = getattr(e.orig, 'pgcode', None)
+    if codigo == CONFLITO_AGENDA:
+        return jsonify({'message': 'A sala já está reservada neste horário'}), 409
+    if codigo == CHAVE_ESTRANGEIRA_INVALIDA:
+        return jsonify({'message': 'Sala não encontrada'}), 400
+    return jsonify({'message': f'Item da agenda inválido: {e.orig}'}), 400
+
 
 @app.route('/agenda', methods=['POST'])
 def add_agenda():
-    data = request.get_json()
-    new_item = Agenda(
-        disciplina=data['disciplina'],
-        datas=data['datas'],
-        hora_inicio=data['hora_inicio'],
-        hora_fim=data['hora_fim'],
-        id_sala=data['id_sala']
-    )
+    data, erro = validar_agenda()
+    if erro:
+        return erro
+    new_item = Agenda(**data)
     Session.add(new_item)
-    Session.commit()
+    try:
+        Session.commit()
+    except (IntegrityError, DataError) as e:
+        return erro_gravacao_agenda(e)
+    agenda_alterada(new_item.id, new_item.id_sala)
     return jsonify({'message': 'Item da agenda criado com sucesso'})
 
 @app.route('/agenda/<id>', methods=['PUT'])
 def update_agenda(id):
-    item = Agenda.query.get(id)
+    item = Session.get(Agenda, id)
     if not item:
         return jsonify({'message': 'Item da agenda não encontrado'})
-    data = request.get_json()
-    item.disciplina = data['disciplina']
-    item.datas = data['datas']
-    item.hora_inicio = data['hora_inicio']
-    item.hora_fim = data['hora_fim']
-    item.id_sala = data['id_sala']
-    Session.commit()
+    sala_anterior = item.id_sala
+    data, erro = validar_agenda()
+    if erro:
+        return erro
+    for campo, valor in data.items():
+        setattr(item, campo, valor)
+    try:
+        Session.commit()
+    except (IntegrityError, DataError) as e:
+        return erro_gravacao_agenda(e)
+    agenda_alterada(item.id, item.id_sala, sala_anterior)
     return jsonify({'message': 'Item da agenda atualizado com sucesso'})
 
 @app.route('/agenda/<id>', methods=['DELETE'])
 def delete_agenda(id):
-    item = Agenda.query.get(id)
+    item = Session.get(Agenda, id)
     if not item:
         return jsonify({'message': 'Item da agenda não encontrado'})
+    id_sala = item.id_sala
     Session.delete(item)
     Session.commit()
+    agenda_alterada(item.id, id_sala)
     return jsonify({'message': 'Item da agenda excluído com sucesso'})
 
 
 
+########## COMANDOS COMPILADOS #############
+
+# Payload de cada (equipamento, ação) codificado uma vez (ver compilacao.py).
+# Escritas em /comandos, /protocolo e /equipamentos recompilam só os
+# equipamentos afetados, aqui e, pelo NOTIFY 'comandos', nos outros workers.
+tabela_comandos = TabelaComandos()
+# Acima disso o aviso pede a recarga completa (o NOTIFY aceita até 8000 bytes)
+MAX_IDS_AVISO = 500
+
+
+@na_primaria
+def linhas_comandos(*filtros):
+    return (Session.query(Equipamento.id, Equipamento.descricao, Comandos.descricao, Comandos.comando)
+            .join(Comandos, Comandos.id_protocolo == Equipamento.id_protocolo)
+            .filter(*filtros)
+            .order_by(Comandos.id)
+            .all())
+
+
+def carregar_comandos():
+    tabela_comandos.carregar(linhas_comandos)
+
+
+def garantir_comandos():
+    if not tabela_comandos.carregada:
+        carregar_comandos()
+
+
+def recompilar_comandos(equipamentos=(), protocolos=()):
+    if not tabela_comandos.carregada:
+        return
+    ids = set(equipamentos)
+    if protocolos:
+        ids.update(id for id, in Session.query(Equipamento.id).filter(Equipamento.id_protocolo.in_(protocolos)))
+    if ids:
+        tabela_comandos.atualizar(ids, lambda: linhas_comandos(Equipamento.id.in_(ids)))
+
+
+def aplicar_aviso_comandos(aviso):
+    dados = json.loads(aviso)
+    # O worker que alterou já recompilou em comandos_alterados
+    if dados.get('origem') == os.getpid():
+        return
+    if dados.get('todos'):
+        carregar_comandos()
+    else:
+        recompilar_comandos(dados.get('equipamentos', ()), dados.get('protocolos', ()))
+
+
+def comandos_alterados(equipamentos=(), protocolos=()):
+    # Chamado depois do commit. protocolos: valores de id_protocolo (o de antes e
+    # o de depois, se mudou); os equipamentos desses protocolos são recompilados
+    equipamentos = sorted({int(id) for id in equipamentos if id is not None})
+    protocolos = sorted({int(id) for id in protocolos if id is not None})
+    recompilar_comandos(equipamentos, protocolos)
+    if engine.dialect.name == 'postgresql':
+        if len(equipamentos) + len(protocolos) > MAX_IDS_AVISO:
+            aviso = {'origem': os.getpid(), 'todos': True}
+        else:
+            aviso = {'origem': os.getpid(), 'equipamentos': equipamentos, 'protocolos': protocolos}
+        Session.execute(text("SELECT pg_notify('comandos', :aviso)"), {'aviso': json.dumps(aviso)})
+        Session.commit()
+
+
+@app.route('/comandos/compilados', methods=['GET'])
+def get_comandos_compilados():
+    return jsonify(tabela_comandos.estatisticas())
+
+
+########## AGENDADOR #############
+
+def intervalo_agenda(item):
+    # datas guarda o dia e hora_inicio/hora_fim o horário da aula
+    dia = item.datas.date()
+    return (datetime.combine(dia, item.hora_inicio.time()),
+            datetime.combine(dia, item.hora_fim.time()))
+
+
+def carregar_agenda_futura():
+    hoje = datetime.combine(datetime.now().date(), datetime.min.time())
+    session = Session()
+    itens = session.query(Agenda).filter(Agenda.datas >= hoje).all()
+    session.close()
+    return [(item.id, item.id_sala) + intervalo_agenda(item) for item in itens]
+
+
+def resolver_comandos(id_salas, acao):
+    # Salas e equipamentos vêm do banco; o comando de cada equipamento, já
+    # codificado, vem da tabela compilada (um get() por equipamento)
+    garantir_comandos()
+    session = Session()
+    linhas = (session.query(Relacao.id_sala, Sala.descricao, Sala.ip, Sala.bloco, Relacao.id_equipamento)
+              .join(Sala, Sala.id == Relacao.id_sala)
+              .filter(Relacao.id_sala.in_(id_salas))
+              .all())
+    session.close()
+    acao = acao.lower()
+    resolvidos = []
+    for id_sala, sala, ip, bloco, id_equipamento in linhas:
+        compilado = tabela_comandos.obter(id_equipamento, acao)
+        if compilado is not None:
+            payload, equipamento = compilado
+            resolvidos.append((id_sala, sala, ip, id_equipamento, equipamento, payload, bloco))
+    return resolvidos
+
+
+def disparar_agenda(eventos):
+    ligar, desligar = acoes_por_sala(eventos)
+    for acao, id_salas in (('ligar', ligar), ('desligar', desligar)):
+        if id_salas:
+            # Não espera: os resultados vão para logs quando cada lote sai
+            executar_comandos(resolver_comandos(id_salas, acao), acao, 'agendador')
+
+
+agendador = Agendador(disparar_agenda)
+
+# Chave do advisory lock que elege o processo responsável pelo agendador
+CHAVE_AGENDADOR = 7020250002
+
+
+def atualizar_item_agenda(id):
+    item = Session.get(Agenda, id)
+    if item is None:
+        agendador.remover(id)
+    else:
+        agendador.agendar(item.id, item.id_sala, *intervalo_agenda(item))
+    Session.remove()
+
+
+def agenda_alterada(id, *salas):
+    # No PostgreSQL avisa o processo que roda o agendador (que pode ser outro
+    # worker) e o stream de eventos de todos os workers com NOTIFY; sem ele, o
+    # agendador e os streams são sempre os deste processo. salas: a sala do item
+    # e, se ele mudou de sala, a anterior
+    salas = sorted({id_sala for id_sala in salas if id_sala is not None})
+    if engine.dialect.name == 'postgresql':
+        Session.execute(text("SELECT pg_notify('agenda', :aviso)"),
+                        {'aviso': json.dumps({'id': int(id), 'salas': salas})})
+        Session.commit()
+    else:
+        atualizar_item_agenda(id)
+        publicar_agenda(id, salas)
+
+
+def disputar_agendador(intervalo=30):
+    # Com vários workers só um processo pode disparar a agenda. Quem obtém o
+    # advisory lock de sessão assume e passa a escutar o canal 'agenda'; se o
+    # processo morrer o PostgreSQL libera o lock e outro worker assume.
+    while True:
+        conexao = None
+        try:
+            conexao = engine.raw_connection()
+            dbapi = conexao.driver_connection
+            dbapi.autocommit = True
+            cursor = dbapi.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (CHAVE_AGENDADOR,))
+            if cursor.fetchone()[0]:
+                cursor.execute("LISTEN agenda")
+                agendador.carregar(carregar_agenda_futura())
+                Session.remove()
+                agendador.iniciar()
+                while True:
+                    if select.select([dbapi], [], [], intervalo) == ([], [], []):
+                        cursor.execute("SELECT 1")
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        atualizar_item_agenda(json.loads(dbapi.notifies.pop(0).payload)['id'])
+        except Exception:
+            traceback.print_exc()
+            agendador.parar()
+            if conexao is not None:
+                conexao.invalidate()
+                conexao = None
+        finally:
+            if conexao is not None:
+                conexao.close()
+        time.sleep(intervalo)
+
+
+def iniciar_agendador():
+    if engine.dialect.name != 'postgresql':
+        agendador.carregar(carregar_agenda_futura())
+        agendador.iniciar()
+        return
+    threading.Thread(target=disputar_agendador, name='eleicao-agendador', daemon=True).start()
+
+
+########## DESPACHO DE COMANDOS #############
+
+despachante = Despachante(
+    porta=config.getint('Dispositivos', 'porta', fallback=80),
+    caminho=config.get('Dispositivos', 'caminho', fallback='/comando'),
+    timeout=config.getfloat('Dispositivos', 'timeout', fallback=2.0),
+    tentativas=config.getint('Dispositivos', 'tentativas', fallback=3),
+    backoff=config.getfloat('Dispositivos', 'backoff', fallback=0.1),
+    concorrencia=config.getint('Dispositivos', 'concorrencia', fallback=64)
+)
+
+
+# Todo comando passa pela fila de fila_comandos.py: pendentes para o mesmo
+# equipamento se fundem, comandos que repetem o estado conhecido não saem e cada
+# bloco (ou a sub-rede /24 do ip, para salas sem bloco) tem sua taxa máxima. A
+# fila é por worker; as rajadas da agenda saem todas do worker que a dispara.
+def segmento_da_sala(bloco, ip):
+    if bloco:
+        return bloco
+    return (ip or '').split(':')[0].rsplit('.', 1)[0] or None
+
+
+def estado_conhecido(id_equipamento):
+    estado = estado_dispositivos.obter(id_equipamento)
+    return estado['estado'] if estado else None
+
+
+def registrar_envios(comandos, resultados):
+    # Um log por comando de fato enviado (os fundidos e os ignorados não geram log)
+    agora = datetime.now()
+    registrar_logs([{'datas': agora, 'hora': agora, 'equipamento': comando.contexto['equipamento'],
+                     'id_equipamento': comando.id_equipamento, 'usuario': comando.contexto['usuario'],
+                     'sala': comando.contexto['sala'],
+                     'acao': comando.acao if resultado['ok'] else f'{comando.acao}:falha'}
+                    for comando, resultado in zip(comandos, resultados)])
+
+
+fila_comandos = FilaComandos(
+    despachante.enviar_lote,
+    ao_concluir=registrar_envios,
+    estado_atual=estado_conhecido,
+    taxa=config.getfloat('Dispositivos', 'taxa_por_bloco', fallback=20),
+    rajada=config.getint('Dispositivos', 'rajada_por_bloco', fallback=20),
+    janela=config.getfloat('Dispositivos', 'janela_coalescencia', fallback=0.1)
+)
+ESPERA_COMANDOS = config.getfloat('Dispositivos', 'espera_resposta', fallback=10)
+
+COMANDOS_FILA = metricas.medidor('climabom_comandos_fila', 'Comandos esperando envio')
+COMANDOS_RECEBIDOS = metricas.contador('climabom_comandos_recebidos_total', 'Comandos recebidos pela fila')
+COMANDOS_COALESCIDOS = metricas.contador('climabom_comandos_coalescidos_total',
+                                         'Comandos substituídos por um mais novo para o mesmo equipamento')
+COMANDOS_IGNORADOS = metricas.contador('climabom_comandos_ignorados_total',
+                                       'Comandos não enviados por repetirem o estado conhecido')
+COMANDOS_ENVIADOS = metricas.contador('climabom_comandos_enviados_total', 'Comandos enviados aos controladores')
+
+
+@metricas.coletor
+def coletar_fila_comandos():
+    estatisticas = fila_comandos.estatisticas()
+    COMANDOS_FILA.definir(estatisticas['pendentes'] + estatisticas['em_envio'])
+    COMANDOS_RECEBIDOS.definir(estatisticas['recebidos'])
+    COMANDOS_COALESCIDOS.definir(estatisticas['coalescidos'])
+    COMANDOS_IGNORADOS.definir(estatisticas['ignorados'])
+    COMANDOS_ENVIADOS.definir(estatisticas['enviados'])
+
+
+def executar_comandos(linhas, acao, usuario, forcar=False, espera=None):
+    # linhas vêm de resolver_comandos. Com espera=None só enfileira; senão espera
+    # até "espera" segundos e devolve os resultados (os que não saíram a tempo
+    # vêm como pendentes)
+    comandos = [Comando(id_equipamento, ip, segmento_da_sala(bloco, ip), acao, payload,
+                        estado=ESTADOS.get(acao.lower()), forcar=forcar,
+                        contexto={'id_sala': id_sala, 'sala': sala, 'equipamento': equipamento, 'usuario': usuario})
+                for id_sala, sala, ip, id_equipamento, equipamento, payload, bloco in linhas]
+    futuros = fila_comandos.enfileirar(comandos)
+    if espera is None:
+        return None
+    limite = time.monotonic() + espera
+    resultados = []
+    for comando, futuro in zip(comandos, futuros):
+        try:
+            resultado = dict(futuro.result(max(limite - time.monotonic(), 0)))
+        except FuturesTimeout:
+            resultado = {'ip': comando.ip, 'ok': None, 'status': None, 'erro': None, 'pendente': True}
+        resultado.update({'id_sala': comando.contexto['id_sala'], 'id_equipamento': comando.id_equipamento})
+        resultados.append(resultado)
+    return resultados
+
+
+@app.route('/salas/comando/fila', methods=['GET'])
+def get_fila_comandos():
+    return jsonify(fila_comandos.estatisticas())
+
+
+@app.route('/salas/comando', methods=['POST'])
+def enviar_comando_salas():
+    # Corpo: {"acao": "desligar", "bloco": "B", "andar": "2", "id_salas": [...], "usuario": "..."}
+    # Sem id_salas, bloco nem andar o comando iria para o campus inteiro: só
+    # com "todas": true. id_salas vazio não seleciona nenhuma sala.
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Envie um objeto JSON'}), 400
+    acao = data.get('acao')
+    if not acao:
+        return jsonify({'message': 'Informe a acao'}), 400
+    if 'id_salas' in data and not isinstance(data['id_salas'], list):
+        return jsonify({'message': 'id_salas deve ser uma lista'}), 400
+    if 'id_salas' not in data and data.get('bloco') is None and data.get('andar') is None \
+            and data.get('todas') is not True:
+        return jsonify({'message': 'Informe id_salas, bloco ou andar (ou "todas": true para todas as salas)'}), 400
+    if data.get('id_salas') == []:
+        return jsonify({'message': 'Nenhuma sala encontrada', 'resultados': []}), 404
+    session = Session()
+    consulta = session.query(Sala.id)
+    if 'id_salas' in data:
+        consulta = consulta.filter(Sala.id.in_(data['id_salas']))
+    for campo in ('bloco', 'andar'):
+        if data.get(campo) is not None:
+            consulta = consulta.filter(getattr(Sala, campo) == data[campo])
+    id_salas = [id for id, in consulta.all()]
+    session.close()
+    if not id_salas:
+        return jsonify({'message': 'Nenhuma sala encontrada', 'resultados': []}), 404
+
+    # "forcar": envia mesmo que o equipamento já esteja no estado pedido;
+    # "aguardar": false responde 202 logo depois de enfileirar
+    linhas = resolver_comandos(id_salas, acao)
+    if data.get('aguardar') is False:
+        executar_comandos(linhas, acao, data.get('usuario'), forcar=bool(data.get('forcar')))
+        return jsonify({'message': f'{len(linhas)} comandos enfileirados'}), 202
+    resultados = executar_comandos(linhas, acao, data.get('usuario'), forcar=bool(data.get('forcar')),
+                                   espera=ESPERA_COMANDOS)
+    enviados = sum(1 for r in resultados if r['ok'] and not r.get('ignorado'))
+    ignorados = sum(1 for r in resultados if r.get('ignorado'))
+    pendentes = sum(1 for r in resultados if r.get('pendente'))
+    return jsonify({'message': f'Comando enviado para {enviados} de {len(resultados)} equipamentos '
+                               f'({ignorados} já estavam no estado pedido, {pendentes} ainda na fila)',
+                    'resultados': resultados})
+
+
 ############## LOGS ##################
 
+# Tamanho padrão e máximo de uma página de logs
+LOGS_POR_PAGINA = 100
+LOGS_POR_PAGINA_MAX = 1000
+
+
+def codificar_cursor(datas, id):
+    bruto = f"{datas.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    bruto = base64.urlsafe_b64decode(cursor.encode()).decode()
+    datas, id = bruto.split('|')
+    return datetime.fromisoformat(datas), int(id)
+
+
+def filtros_logs(args):
+    # Filtros comuns das consultas de logs; levanta ValueError para datas inválidas
+    filtros = [Logs.datas.isnot(None)]
+    if args.get('since'):
+        filtros.append(Logs.datas >= datetime.fromisoformat(args['since']))
+    if args.get('until'):
+        filtros.append(Logs.datas < datetime.fromisoformat(args['until']))
+    if args.get('id_equipamento'):
+        filtros.append(Logs.id_equipamento == int(args['id_equipamento']))
+    for campo in ('sala', 'usuario', 'acao'):
+        if args.get(campo) is not None:
+            filtros.append(getattr(Logs, campo) == args[campo])
+    return filtros
+
+
 @app.route('/logs', methods=['GET'])
 def get_logs():
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    logs = Session.query(Logs).all()
-    Session.close()
-    return jsonify([l.__dict__ for l in logs])
+    # Paginação por cursor (keyset) em (datas, id), do mais recente para o mais antigo.
+    # Cada página é uma varredura de intervalo nos índices (datas, id) criados na
+    # migração 0002 e recriados na tabela particionada pela 0007, então o custo
+    # não cresce com o tamanho da tabela como acontecia com OFFSET ou .all()
+    try:
+        limite = min(int(request.args.get('limite', LOGS_POR_PAGINA)), LOGS_POR_PAGINA_MAX)
+        if limite < 1:
+            raise ValueError('limite deve ser positivo')
+        filtros = filtros_logs(request.args)
+        cursor = request.args.get('cursor')
+        if cursor:
+            datas, id = decodificar_cursor(cursor)
+            # O limite só em datas deixa o PostgreSQL descartar as partições
+            # mais novas que o cursor; a comparação de tupla não permite isso
+            filtros += [Logs.datas <= datas, tuple_(Logs.datas, Logs.id) < (datas, id)]
+    except ValueError:
+        return jsonify({'message': 'Parâmetros de consulta inválidos'}), 400
+
+    consulta = (CODIFICADOR_LOGS.select().where(*filtros)
+                .order_by(Logs.datas.desc(), Logs.id.desc()).limit(limite))
+    if quer_ndjson():
+        return resposta_ndjson(Session.execute(consulta), CODIFICADOR_LOGS)
+    logs = Session.execute(consulta).all()
+
+    proximo = None
+    if len(logs) == limite:
+        proximo = codificar_cursor(logs[-1].datas, logs[-1].id)
+    return resposta_json({'logs': CODIFICADOR_LOGS.lista(logs), 'proximo': proximo})
+
+# Linhas buscadas por vez do cursor no servidor durante a exportação
+LOTE_EXPORTACAO = 5000
+
+
+@app.route('/logs/export', methods=['GET'])
+def export_logs():
+    # Exporta todos os logs do intervalo (e dos filtros de /logs) em ordem
+    # cronológica. A consulta usa um cursor no servidor (yield_per) e a resposta
+    # sai em chunks à medida que os lotes chegam, então a memória não depende
+    # do número de linhas.
+    formato = request.args.get('format', 'csv')
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'message': f"Formato inválido; use {', '.join(FORMATOS_EXPORTACAO)}"}), 400
+    if formato == 'parquet' and pyarrow is None:
+        return jsonify({'message': 'Exportação em parquet requer o pyarrow instalado'}), 400
+    try:
+        filtros = filtros_logs(request.args)
+    except ValueError:
+        return jsonify({'message': 'Parâmetros de consulta inválidos'}), 400
+
+    consulta = CODIFICADOR_LOGS.select().where(*filtros).order_by(Logs.datas, Logs.id)
+    resultado = Session.execute(consulta, execution_options={'yield_per': LOTE_EXPORTACAO})
+    return resposta_exportacao(resultado.partitions(), CODIFICADOR_LOGS, formato, 'logs')
 
 @app.route('/logs', methods=['POST'])
 def create_log():
     data = request.get_json()
+    if gravador_logs is not None:
+        return enfileirar_log(data)
+    # Logs sem data ficariam fora da paginação por (datas, id) e, com logs
+    # particionada por datas, nem poderiam ser gravados ("datas": null também)
+    if data.get('datas') is None:
+        data['datas'] = datetime.now()
     novo_log = Logs(**data)
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     Session.add(novo_log)
+    registros = resumir_estado([data])
+    for aviso in avisos_estado(registros):
+        Session.execute(text("SELECT pg_notify('estado', :aviso)"), {'aviso': aviso})
     Session.commit()
     Session.close()
+    aplicar_estado(registros)
     return jsonify({'message': 'Log criado com sucesso!'}), 201
 
+def erros_validacao(e):
+    return [{'campo': '.'.join(str(p) for p in erro['loc']), 'erro': erro['msg']} for erro in e.errors()]
+
+
+COLUNAS_LOG = ['datas', 'hora', 'equipamento', 'id_equipamento', 'usuario', 'sala', 'acao']
+
+
+def ler_logs_em_lote():
+    # Aceita um array JSON ou NDJSON (um objeto por linha)
+    if request.mimetype == 'application/x-ndjson':
+        for numero, linha in enumerate(request.stream):
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                yield numero, json.loads(linha)
+            except ValueError:
+                yield numero, None
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return
+        for numero, item in enumerate(data):
+            yield numero, item
+
+
+def inserir_logs_em_lote(linhas):
+    # No PostgreSQL usa COPY, que é bem mais rápido que INSERTs; nos demais bancos
+    # cai para um executemany em uma única transação
+    registros = resumir_estado(linhas)
+    if engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        for linha in linhas:
+            escritor.writerow(['\\N' if linha[c] is None else linha[c] for c in COLUNAS_LOG])
+        buffer.seek(0)
+        conexao = engine.raw_connection()
+        try:
+            cursor = conexao.cursor()
+            cursor.copy_expert(
+                f"COPY logs ({', '.join(COLUNAS_LOG)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+            for aviso in avisos_estado(registros):
+                cursor.execute("SELECT pg_notify('estado', %s)", (aviso,))
+            conexao.commit()
+        except Exception:
+            conexao.rollback()
+            raise
+        finally:
+            conexao.close()
+    else:
+        with engine.begin() as connection:
+            connection.execute(Logs.__table__.insert(), linhas)
+    aplicar_estado(registros)
+
+
+@app.route('/logs/bulk', methods=['POST'])
+def create_logs_bulk():
+    validos = []
+    rejeitados = []
+    agora = datetime.now()
+    for numero, item in ler_logs_em_lote():
+        if not isinstance(item, dict):
+            rejeitados.append({'linha': numero, 'erros': [{'campo': None, 'erro': 'Objeto JSON inválido'}]})
+            continue
+        try:
+            log = LogModel(**item).model_dump()
+        except ValidationError as e:
+            rejeitados.append({'linha': numero, 'erros': erros_validacao(e)})
+            continue
+        if log['datas'] is None:
+            log['datas'] = agora
+        validos.append(log)
+
+    if not validos:
+        return jsonify({'message': 'Nenhum log válido recebido', 'inseridos': 0, 'rejeitados': rejeitados}), 400
+
+    inserir_logs_em_lote(validos)
+    return jsonify({'message': 'Logs criados com sucesso!', 'inseridos': len(validos), 'rejeitados': rejeitados}), 201
+
 @app.route('/logs/<int:id>', methods=['GET'])
 def get_log_by_id(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    log = Session.query(Logs).filter_by(id=id).first()
-    Session.close()
-    return jsonify(log.__dict__)
+    log = carregar_por_id(CODIFICADOR_LOGS, id)
+    if not log:
+        return jsonify({'message': 'Log não encontrado'}), 404
+    return resposta_json(log)
 
 @app.route('/logs/<int:id>', methods=['PUT'])
 def update_log(id):
     data = request.get_json()
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     log = Session.query(Logs).filter_by(id=id).first()
     for key, value in data.items():
         setattr(log, key, value)
@@ -416,8 +1642,6 @@ def update_log(id):
 
 @app.route('/logs/<int:id>', methods=['DELETE'])
 def delete_log(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     log = Session.query(Logs).filter_by(id=id).first()
     Session.delete(log)
     Session.commit()
@@ -425,56 +1649,713 @@ def delete_log(id):
     return jsonify({'message': 'Log excluído com sucesso!'})
 
 
+########## GRAVAÇÃO ASSÍNCRONA DE LOGS #############
+
+# Com gravacao_assincrona = true, POST /logs e os logs dos comandos entram numa
+# fila em memória gravada em lotes por uma thread (ver gravacao.py), tirando o
+# commit do caminho da requisição. O estado dos equipamentos e /eventos passam a
+# ver o log quando o lote é gravado (até intervalo_gravacao segundos depois).
+# Com spool_logs preenchido a fila também vai para disco e é regravada se o
+# worker morrer. POST /logs/bulk continua síncrono: ele já grava em lote.
+GRAVACAO_ASSINCRONA = config.getboolean('Logs', 'gravacao_assincrona', fallback=False)
+
+
+def erro_permanente(erro):
+    # Erros do registro (chave estrangeira, valor inválido), não do banco
+    dbapi = engine.dialect.loaded_dbapi
+    return isinstance(erro, (IntegrityError, DataError, dbapi.IntegrityError, dbapi.DataError))
+
+
+def decodificar_log(registro):
+    return LogModel(**registro).model_dump()
+
+
+gravador_logs = GravadorLogs(
+    inserir_logs_em_lote,
+    max_fila=config.getint('Logs', 'fila_gravacao', fallback=10000),
+    lote=config.getint('Logs', 'lote_gravacao', fallback=500),
+    intervalo=config.getfloat('Logs', 'intervalo_gravacao', fallback=0.5),
+    espera=config.getfloat('Logs', 'espera_fila', fallback=2),
+    diretorio_spool=config.get('Logs', 'spool', fallback='') or None,
+    fsync=config.getboolean('Logs', 'fsync_spool', fallback=False),
+    permanente=erro_permanente,
+    decodificar=decodificar_log
+) if GRAVACAO_ASSINCRONA else None
+
+LOGS_FILA = metricas.medidor('climabom_logs_fila', 'Logs esperando gravação')
+LOGS_GRAVADOS = metricas.contador('climabom_logs_gravados_total', 'Logs gravados pela fila assíncrona')
+LOGS_REJEITADOS = metricas.contador('climabom_logs_rejeitados_total', 'Logs descartados por erro no registro')
+LOGS_RECUSADOS = metricas.contador('climabom_logs_recusados_total', 'Logs recusados com a fila cheia')
+
+
+@metricas.coletor
+def coletar_gravacao():
+    if gravador_logs is None:
+        return
+    estatisticas = gravador_logs.estatisticas()
+    LOGS_FILA.definir(estatisticas['fila'] + estatisticas['em_gravacao'])
+    LOGS_GRAVADOS.definir(estatisticas['gravados'])
+    LOGS_REJEITADOS.definir(estatisticas['rejeitados'])
+    LOGS_RECUSADOS.definir(estatisticas['recusados'])
+
+
+def registrar_logs(registros):
+    # Logs gerados pelo servidor (comandos): com a fila cheia grava direto para não perdê-los
+    if gravador_logs is None:
+        return inserir_logs_em_lote(registros)
+    try:
+        gravador_logs.adicionar(registros)
+    except FilaCheia:
+        inserir_logs_em_lote(registros)
+
+
+def enfileirar_log(data):
+    # POST /logs no modo assíncrono: valida agora, já que um registro ruim só
+    # falharia depois, longe do cliente
+    try:
+        log = LogModel(**(data or {})).model_dump()
+    except ValidationError as e:
+        return jsonify({'message': 'Log inválido', 'erros': erros_validacao(e)}), 400
+    if log['datas'] is None:
+        log['datas'] = datetime.now()
+    try:
+        gravador_logs.adicionar([log])
+    except FilaCheia:
+        return jsonify({'message': 'Fila de logs cheia, tente novamente'}), 503, {'Retry-After': '1'}
+    return jsonify({'message': 'Log recebido'}), 202
+
+
+def iniciar_gravacao_logs():
+    # Abre o spool do worker e regrava o que sobrou de workers anteriores
+    if gravador_logs is not None:
+        gravador_logs.iniciar()
+
+
+@app.route('/logs/gravacao', methods=['GET'])
+def get_gravacao_logs():
+    if gravador_logs is None:
+        return jsonify({'assincrona': False})
+    return jsonify({'assincrona': True, **gravador_logs.estatisticas()})
+
+
+########## PARTIÇÕES E ARQUIVO DE LOGS #############
+
+# logs é particionada por mês (migração 0007). Os meses além de meses_retidos
+# saem do banco para arquivos comprimidos em diretorio_arquivo (ver particoes.py)
+# e continuam consultáveis por /logs/arquivo/<mes>.
+particoes_logs = ParticoesLogs(
+    engine,
+    diretorio=config.get('Logs', 'diretorio_arquivo', fallback='arquivo_logs'),
+    meses_adiante=config.getint('Logs', 'meses_adiante', fallback=3),
+    meses_retidos=config.getint('Logs', 'meses_retidos', fallback=12),
+    formato=config.get('Logs', 'formato_arquivo', fallback='csv.gz')
+)
+
+# Chave do advisory lock que impede dois processos de mexer nas partições ao mesmo tempo
+CHAVE_PARTICOES = 7020250003
+
+
+def manter_particoes_logs(intervalo):
+    while True:
+        try:
+            for mes in particoes_logs.manter(CHAVE_PARTICOES):
+                print(f"Logs de {mes:%Y-%m} arquivados em {particoes_logs.diretorio}")
+        except Exception:
+            traceback.print_exc()
+        time.sleep(intervalo)
+
+
+def iniciar_particoes_logs():
+    if engine.dialect.name != 'postgresql':
+        return
+    intervalo = config.getfloat('Logs', 'intervalo_manutencao', fallback=3600)
+    threading.Thread(target=manter_particoes_logs, args=(intervalo,), name='particoes-logs',
+                     daemon=True).start()
+
+
+def filtro_arquivo(args):
+    # Os mesmos filtros de filtros_logs, aplicados às tuplas lidas do arquivo
+    posicao = {nome: i for i, nome in enumerate(CODIFICADOR_LOGS.nomes)}
+    condicoes = []
+    if args.get('since'):
+        since = datetime.fromisoformat(args['since'])
+        condicoes.append(lambda linha: linha[posicao['datas']] >= since)
+    if args.get('until'):
+        until = datetime.fromisoformat(args['until'])
+        condicoes.append(lambda linha: linha[posicao['datas']] < until)
+    if args.get('id_equipamento'):
+        id_equipamento = int(args['id_equipamento'])
+        condicoes.append(lambda linha: linha[posicao['id_equipamento']] == id_equipamento)
+    for campo in ('sala', 'usuario', 'acao'):
+        if args.get(campo) is not None:
+            condicoes.append(lambda linha, i=posicao[campo], valor=args[campo]: linha[i] == valor)
+    if args.get('cursor'):
+        datas, id = decodificar_cursor(args['cursor'])
+        condicoes.append(lambda linha: (linha[posicao['datas']], linha[posicao['id']]) < (datas, id))
+    return lambda linha: all(condicao(linha) for condicao in condicoes)
+
+
+@app.route('/logs/arquivo', methods=['GET'])
+def get_meses_arquivados():
+    meses = particoes_logs.arquivos()
+    return jsonify({'meses': [{'mes': f'{mes:%Y-%m}', 'arquivo': os.path.basename(meses[mes])}
+                              for mes in sorted(meses)]})
+
+
+@app.route('/logs/arquivo/<mes>', methods=['GET'])
+def get_logs_arquivados(mes):
+    # Mesmos filtros e paginação de /logs, lendo o arquivo do mês em sequência
+    try:
+        mes = datetime.strptime(mes, '%Y-%m').date()
+        limite = min(int(request.args.get('limite', LOGS_POR_PAGINA)), LOGS_POR_PAGINA_MAX)
+        if limite < 1:
+            raise ValueError('limite deve ser positivo')
+        filtro = filtro_arquivo(request.args)
+    except ValueError:
+        return jsonify({'message': 'Parâmetros de consulta inválidos'}), 400
+    linhas = particoes_logs.ler(mes)
+    if linhas is None:
+        return jsonify({'message': 'Mês não arquivado'}), 404
+
+    linhas = itertools.islice(filter(filtro, linhas), limite)
+    if quer_ndjson():
+        return resposta_ndjson(linhas, CODIFICADOR_LOGS)
+    logs = list(linhas)
+
+    logs = CODIFICADOR_LOGS.lista(logs)
+    proximo = None
+    if len(logs) == limite:
+        proximo = codificar_cursor(logs[-1]['datas'], logs[-1]['id'])
+    return resposta_json({'logs': logs, 'proximo': proximo})
+
+
+########## ESTADO DOS EQUIPAMENTOS #############
+
+# Último estado de cada equipamento (ver estado.py), mantido em memória em cada
+# worker. Todo log gravado pela API atualiza o estado local e publica os eventos
+# de /eventos deste worker; no PostgreSQL avisa os outros workers pelo canal
+# 'estado' na mesma transação do log (o worker que gravou ignora o próprio aviso).
+estado_dispositivos = EstadoDispositivos()
+# O NOTIFY aceita até 8000 bytes por mensagem
+TAMANHO_AVISO = 7000
+
+
+def resumir_estado(linhas):
+    # Só o log mais recente de cada equipamento interessa ao estado
+    lote = EstadoDispositivos()
+    for linha in linhas:
+        lote.registrar(linha)
+    return lote.todos()
+
+
+def avisos_estado(registros):
+    if engine.dialect.name != 'postgresql':
+        return []
+    return montar_avisos_estado(registros)
+
+
+def montar_avisos_estado(registros):
+    # {"origem": pid, "registros": [...]} em pedaços que cabem num NOTIFY
+    avisos = []
+    atual = []
+    tamanho = 0
+    for registro in registros:
+        item = json.dumps({campo: registro[campo] for campo in CAMPOS_ESTADO}, default=str)
+        if atual and tamanho + len(item) > TAMANHO_AVISO:
+            avisos.append(aviso_estado(atual))
+            atual = []
+            tamanho = 0
+        atual.append(item)
+        tamanho += len(item) + 1
+    if atual:
+        avisos.append(aviso_estado(atual))
+    return avisos
+
+
+def aviso_estado(itens):
+    return '{"origem": ' + str(os.getpid()) + ', "registros": [' + ','.join(itens) + ']}'
+
+
+def aplicar_estado(registros):
+    for registro in registros:
+        anterior = estado_dispositivos.obter(registro.get('id_equipamento'))
+        estado_dispositivos.registrar(registro)
+        publicar_log(registro, anterior)
+
+
+def aplicar_aviso_estado(aviso):
+    # O worker que gravou o log já aplicou e publicou o estado em aplicar_estado
+    dados = json.loads(aviso)
+    if dados['origem'] == os.getpid():
+        return
+    aplicar_estado(dados['registros'])
+
+
+@na_primaria
+def carregar_estado():
+    # Para cada equipamento, o último log e o último que mudou o estado (ligar,
+    # desligar ou falha), para que ações como ajuste de temperatura não apaguem
+    # o estado. No PostgreSQL cada LATERAL é uma busca no índice
+    # (id_equipamento, datas DESC, id DESC) por equipamento, em vez de percorrer o
+    # índice inteiro como um DISTINCT ON faria.
+    if engine.dialect.name == 'postgresql':
+        linhas = Session.execute(text("""
+            SELECT e.id,
+                   m.acao, m.usuario, m.datas, m.sala, m.equipamento,
+                   u.acao, u.usuario, u.datas, u.sala, u.equipamento
+            FROM equipamento e
+            CROSS JOIN LATERAL (
+                SELECT acao, usuario, datas, sala, equipamento
+                FROM logs
+                WHERE logs.id_equipamento = e.id AND logs.datas IS NOT NULL
+                ORDER BY logs.datas DESC, logs.id DESC
+                LIMIT 1
+            ) u
+            LEFT JOIN LATERAL (
+                SELECT acao, usuario, datas, sala, equipamento
+                FROM logs
+                WHERE logs.id_equipamento = e.id AND logs.datas IS NOT NULL
+                  AND (lower(logs.acao) IN :estados OR logs.acao LIKE '%:falha')
+                ORDER BY logs.datas DESC, logs.id DESC
+                LIMIT 1
+            ) m ON true
+        """).bindparams(bindparam('estados', expanding=True)), {'estados': list(ESTADOS)}).all()
+        logs = []
+        for linha in linhas:
+            if linha[3] is not None:
+                logs.append(dict(zip(CAMPOS_ESTADO, (linha[0],) + tuple(linha[1:6]))))
+            logs.append(dict(zip(CAMPOS_ESTADO, (linha[0],) + tuple(linha[6:11]))))
+    else:
+        logs = (ultimos_logs(func.lower(Logs.acao).in_(list(ESTADOS)) | Logs.acao.like('%:falha'))
+                + ultimos_logs())
+    Session.remove()
+    estado_dispositivos.carregar(logs)
+
+
+def ultimos_logs(*filtros):
+    # Último log de cada equipamento com row_number(), para bancos sem LATERAL
+    ordem = func.row_number().over(partition_by=Logs.id_equipamento,
+                                   order_by=(Logs.datas.desc(), Logs.id.desc())).label('ordem')
+    recentes = (Session.query(Logs.id_equipamento, Logs.acao, Logs.usuario, Logs.datas, Logs.sala,
+                              Logs.equipamento, ordem)
+                .filter(Logs.id_equipamento.isnot(None), Logs.datas.isnot(None), *filtros)
+                .subquery())
+    return [dict(linha._mapping) for linha in
+            Session.query(*[recentes.c[campo] for campo in CAMPOS_ESTADO]).filter(recentes.c.ordem == 1)]
+
+
+def garantir_estado():
+    if not estado_dispositivos.carregado:
+        carregar_estado()
+
+
+def escutar_estado(intervalo=30):
+    # Recebe os logs gravados pelos outros workers, as alterações da agenda (para
+    # /eventos), as de usuários e permissões (cache da autenticação), as do
+    # catálogo de comandos (tabela compilada) e as do cache do catálogo. Avisos
+    # perdidos enquanto a conexão estava caída não voltam, então cada conexão
+    # recarrega o estado depois do LISTEN e as reconexões limpam os caches.
+    reconexao = False
+    while True:
+        conexao = None
+        try:
+            conexao = engine.raw_connection()
+            dbapi = conexao.driver_connection
+            dbapi.autocommit = True
+            cursor = dbapi.cursor()
+            cursor.execute("LISTEN estado")
+            # Só para o stream de eventos; quem dispara a agenda escuta à parte
+            cursor.execute("LISTEN agenda")
+            cursor.execute("LISTEN permissoes")
+            cursor.execute("LISTEN comandos")
+            cursor.execute("LISTEN catalogo")
+            carregar_estado()
+            carregar_comandos()
+            if reconexao:
+                cache_catalogo.limpar()
+                cache_permissoes.limpar()
+            reconexao = True
+            while True:
+                if select.select([dbapi], [], [], intervalo) == ([], [], []):
+                    cursor.execute("SELECT 1")
+                    continue
+                dbapi.poll()
+                while dbapi.notifies:
+                    aviso = dbapi.notifies.pop(0)
+                    if aviso.channel == 'agenda':
+                        dados = json.loads(aviso.payload)
+                        publicar_agenda(dados['id'], dados['salas'])
+                    elif aviso.channel == 'permissoes':
+                        aplicar_aviso_permissoes(aviso.payload)
+                    elif aviso.channel == 'comandos':
+                        aplicar_aviso_comandos(aviso.payload)
+                    elif aviso.channel == 'catalogo':
+                        aplicar_aviso_catalogo(aviso.payload)
+                    else:
+                        aplicar_aviso_estado(aviso.payload)
+                Session.remove()
+        except Exception:
+            traceback.print_exc()
+            if conexao is not None:
+                conexao.invalidate()
+                conexao = None
+        finally:
+            if conexao is not None:
+                conexao.close()
+        time.sleep(intervalo)
+
+
+def iniciar_estado():
+    if engine.dialect.name != 'postgresql':
+        carregar_estado()
+        return
+    threading.Thread(target=escutar_estado, name='estado-equipamentos', daemon=True).start()
+
+
+@app.route('/equipamentos/estado', methods=['GET'])
+def get_estado_equipamentos():
+    # ?ids=1,2,3 limita aos equipamentos informados
+    garantir_estado()
+    if request.args.get('ids'):
+        try:
+            ids = [int(id) for id in request.args['ids'].split(',')]
+        except ValueError:
+            return jsonify({'message': 'ids deve ser uma lista de inteiros separados por vírgula'}), 400
+        estados = [estado for estado in map(estado_dispositivos.obter, ids) if estado is not None]
+    else:
+        estados = estado_dispositivos.todos()
+    return resposta_json({'estados': estados})
+
+
+@app.route('/salas/<int:id>/estado', methods=['GET'])
+def get_estado_sala(id):
+    garantir_estado()
+    equipamentos = (Session.query(Sala.id, Equipamento.id, Equipamento.descricao)
+                    .outerjoin(Relacao, Relacao.id_sala == Sala.id)
+                    .outerjoin(Equipamento, Equipamento.id == Relacao.id_equipamento)
+                    .filter(Sala.id == id)
+                    .order_by(Equipamento.id)
+                    .all())
+    if not equipamentos:
+        return jsonify({'message': 'Sala não encontrada'}), 404
+    saida = []
+    for _, id_equipamento, descricao in equipamentos:
+        if id_equipamento is None:
+            continue
+        estado = estado_dispositivos.obter(id_equipamento)
+        saida.append({'id_equipamento': id_equipamento, 'descricao': descricao,
+                      'estado': estado['estado'] if estado else 'desconhecido',
+                      'acao': estado['acao'] if estado else None,
+                      'usuario': estado['usuario'] if estado else None,
+                      'datas': estado['datas'] if estado else None})
+    return resposta_json({'sala': id, 'equipamentos': saida})
+
+
+########## EVENTOS (SSE) #############
+
+# GET /eventos mantém a conexão aberta e envia logs gravados, mudanças de estado
+# dos equipamentos e alterações da agenda assim que acontecem (ver eventos.py).
+# Os eventos de log vêm do mesmo resumo que alimenta o estado: logs com
+# equipamento e, num lote, só o último de cada equipamento.
+# Cada conexão ocupa uma thread do worker enquanto estiver aberta, parada numa
+# espera sem custo de CPU; o gunicorn.conf.py reserva threads para elas e
+# ocupar_vaga impede que as outras rotas as usem.
+difusor = Difusor(
+    max_assinaturas=config.getint('Eventos', 'max_conexoes', fallback=1000),
+    tamanho_fila=config.getint('Eventos', 'fila', fallback=256)
+)
+# Sem eventos, um comentário a cada tantos segundos mantém proxies e clientes
+# com a conexão aberta e revela clientes que já foram embora
+INTERVALO_PING = config.getfloat('Eventos', 'ping', fallback=15)
+
+EVENTOS_CONEXOES = metricas.medidor('climabom_eventos_conexoes', 'Conexões abertas em /eventos')
+EVENTOS_PUBLICADOS = metricas.contador('climabom_eventos_publicados_total', 'Eventos publicados em /eventos',
+                                       ('tipo',))
+
+
+@metricas.coletor
+def coletar_eventos():
+    estatisticas = difusor.estatisticas()
+    EVENTOS_CONEXOES.definir(estatisticas['conexoes'])
+    for tipo, quantidade in estatisticas['publicados'].items():
+        EVENTOS_PUBLICADOS.definir(quantidade, (tipo,))
+
+
+@na_primaria
+def carregar_localizacao():
+    # Salas de cada equipamento e bloco de cada sala, para os filtros de /eventos
+    salas = {}
+    for id_sala, id_equipamento in Session.query(Relacao.id_sala, Relacao.id_equipamento):
+        salas.setdefault(id_equipamento, []).append(id_sala)
+    return {'salas': salas, 'blocos': dict(Session.query(Sala.id, Sala.bloco).all())}
+
+
+def localizar(salas=None, id_equipamento=None):
+    # (salas, blocos) de uma lista de salas ou das salas de um equipamento
+    localizacao = cache_catalogo.obter(('localizacao', None), carregar_localizacao)
+    if salas is None:
+        salas = localizacao['salas'].get(id_equipamento, [])
+    return salas, [localizacao['blocos'].get(id_sala) for id_sala in salas]
+
+
+def publicar_log(registro, anterior):
+    # registro: log no formato de CAMPOS_ESTADO; anterior: estado guardado antes dele
+    salas, blocos = localizar(id_equipamento=registro.get('id_equipamento'))
+    difusor.publicar('log', registro, salas, blocos)
+    atual = estado_dispositivos.obter(registro.get('id_equipamento'))
+    if atual is not None and atual is not anterior and (anterior is None or anterior['estado'] != atual['estado']):
+        difusor.publicar('estado', atual, salas, blocos)
+
+
+def publicar_agenda(id, salas):
+    item = carregar_por_id(CODIFICADOR_AGENDA, id)
+    difusor.publicar('agenda', item or {'id': int(id), 'removido': True}, *localizar(salas))
+
+
+# O gunicorn.conf.py dá a cada worker threads + max_conexoes threads, mas só as
+# conexões de /eventos podem usar as threads extras: as demais rotas disputam
+# [Servidor] threads vagas e esperam por uma até [Servidor] timeout segundos
+# antes de responder 503. A vaga é devolvida no teardown da requisição.
+VAGAS_REQUISICOES = threading.BoundedSemaphore(config.getint('Servidor', 'threads', fallback=4))
+ESPERA_VAGA = config.getfloat('Servidor', 'timeout', fallback=30)
+ROTAS_SEM_VAGA = {'get_eventos'}
+
+
+@app.before_request
+def ocupar_vaga():
+    if request.endpoint in ROTAS_SEM_VAGA:
+        return None
+    if not VAGAS_REQUISICOES.acquire(timeout=ESPERA_VAGA):
+        return jsonify({'message': 'Servidor ocupado, tente novamente'}), 503
+    g.vaga = True
+    return None
+
+
+@app.teardown_request
+def liberar_vaga(exception=None):
+    if g.pop('vaga', False):
+        VAGAS_REQUISICOES.release()
+
+
+def evento_sse(evento):
+    return b'event: ' + evento['tipo'].encode() + b'\ndata: ' + dumps(evento['dados']) + b'\n\n'
+
+
+@app.route('/eventos', methods=['GET'])
+def get_eventos():
+    # Server-Sent Events. Filtros opcionais (vários valores separados por vírgula):
+    # ?tipos=log,estado,agenda, ?sala=<id da sala> e ?bloco=<bloco>; com sala e
+    # bloco, basta o evento atender a um deles. Ao reconectar o cliente deve
+    # reler o estado (/equipamentos/estado): eventos perdidos não são reenviados.
+    try:
+        tipos = [tipo for tipo in request.args.get('tipos', '').split(',') if tipo]
+        salas = [int(id) for id in request.args.get('sala', '').split(',') if id]
+    except ValueError:
+        return jsonify({'message': 'Parâmetros de consulta inválidos'}), 400
+    if any(tipo not in TIPOS_EVENTO for tipo in tipos):
+        return jsonify({'message': f"tipos deve conter apenas {', '.join(TIPOS_EVENTO)}"}), 400
+    blocos = [bloco for bloco in request.args.get('bloco', '').split(',') if bloco]
+
+    assinatura = difusor.assinar(tipos, salas, blocos)
+    if assinatura is None:
+        return jsonify({'message': 'Limite de conexões de eventos atingido'}), 503
+
+    # Sem stream_with_context: a requisição (e a sessão do banco) termina aqui e
+    # o stream só lê da assinatura
+    def gerar():
+        try:
+            yield b'retry: 3000\n\n'
+            while True:
+                eventos = assinatura.proximos(INTERVALO_PING)
+                if eventos is None:
+                    return
+                if not eventos:
+                    yield b': ping\n\n'
+                    continue
+                yield b''.join(evento_sse(evento) for evento in eventos)
+        finally:
+            difusor.cancelar(assinatura)
+
+    return Response(gerar(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/eventos/estatisticas', methods=['GET'])
+def get_eventos_estatisticas():
+    return jsonify(difusor.estatisticas())
+
+
+########## RELATÓRIOS DE USO #############
+
+# Horas de ar ligado por sala e dia comparadas com a agenda (ver relatorios.py).
+# O resultado de cada dia encerrado fica em cache; o dia de hoje é recalculado.
+cache_relatorios = CacheLRU(
+    max_itens=config.getint('Relatorios', 'max_dias', fallback=400),
+    ttl=config.getfloat('Relatorios', 'ttl', fallback=3600)
+)
+# Quanto buscar antes do período para saber quais ares já estavam ligados no início
+ANTECEDENCIA_USO = timedelta(hours=config.getfloat('Relatorios', 'antecedencia_horas', fallback=24))
+DIAS_USO_MAX = 366
+AGRUPAMENTOS_USO = ('sala', 'bloco', 'andar')
+
+
+def em_segundos(instante):
+    # Segundos desde 1970-01-01 no horário gravado (TIMESTAMP sem fuso)
+    if engine.dialect.name == 'postgresql':
+        return func.date_part('epoch', instante)
+    return (func.julianday(instante) - 2440587.5) * 86400.0
+
+
+def horario_agenda(hora):
+    # Dia de datas com o horário de hora_inicio/hora_fim, como intervalo_agenda()
+    if engine.dialect.name == 'postgresql':
+        return em_segundos(cast(Agenda.datas, Date) + cast(hora, Time))
+    return em_segundos(func.date(Agenda.datas).op('||')(' ').op('||')(func.time(hora)))
+
+
+def consultar_colunas(consulta):
+    # Resultado numérico como uma array por coluna. No PostgreSQL cada coluna vem
+    # inteira num array_agg (uma linha só); nos demais as linhas são achatadas
+    # direto para o NumPy. Executa pelo Core, sem montar linhas do ORM
+    conexao = Session.connection()
+    if engine.dialect.name == 'postgresql':
+        subconsulta = consulta.subquery()
+        agregada = Session.query(*[func.array_agg(coluna) for coluna in subconsulta.c]).statement
+        return colunas_agregadas(conexao.execute(agregada).one())
+    return colunas(conexao.execute(consulta.statement), len(consulta.statement.selected_columns))
+
+
+def calcular_uso(inicio, dias):
+    origem = datetime.combine(inicio, datetime.min.time())
+    fim = origem + timedelta(days=dias)
+    eventos = consultar_colunas(
+        Session.query(Relacao.id_sala, Logs.id_equipamento, em_segundos(Logs.datas),
+                      case((func.lower(Logs.acao) == 'ligar', 1), else_=0))
+        .join(Relacao, Relacao.id_equipamento == Logs.id_equipamento)
+        .filter(Logs.datas >= origem - ANTECEDENCIA_USO, Logs.datas < fim, Relacao.id_sala.isnot(None),
+                func.lower(Logs.acao).in_(list(ESTADOS)) | Logs.acao.like('%:falha')))
+    aulas = consultar_colunas(
+        Session.query(Agenda.id_sala, horario_agenda(Agenda.hora_inicio), horario_agenda(Agenda.hora_fim))
+        .filter(Agenda.datas >= origem - timedelta(days=1), Agenda.datas < fim, Agenda.id_sala.isnot(None)))
+    Session.remove()
+    return uso_por_dia(eventos, aulas, (origem - datetime(1970, 1, 1)).total_seconds(), dias)
+
+
+def uso_por_sala(inicio, dias):
+    # Salas e arrays sala x dia (ligado, ocupado, vazio) de [inicio, inicio + dias).
+    # Os dias fora do cache são calculados juntos, numa só consulta
+    hoje = date.today()
+    datas = [inicio + timedelta(days=n) for n in range(dias)]
+    diarios = {dia: cache_relatorios.consultar(dia) if dia < hoje else None for dia in datas}
+    faltando = [dia for dia in datas if diarios[dia] is None]
+    if faltando:
+        primeiro = faltando[0]
+        quantidade = (faltando[-1] - primeiro).days + 1
+        salas, *valores = calcular_uso(primeiro, quantidade)
+        for n in range(quantidade):
+            dia = primeiro + timedelta(days=n)
+            diarios[dia] = compactar(salas, *(valor[:, n] for valor in valores))
+            if dia < hoje:
+                cache_relatorios.guardar(dia, diarios[dia])
+    return juntar_dias([diarios[dia] for dia in datas])
+
+
+def horas(segundos):
+    return round(float(segundos) / 3600, 2)
+
+
+@app.route('/relatorios/uso', methods=['GET'])
+def get_relatorio_uso():
+    # ?inicio=AAAA-MM-DD&fim=AAAA-MM-DD (fim exclusivo; padrão: últimos 30 dias
+    # incluindo hoje) e ?agrupar=sala|bloco|andar. Os grupos saem do que mais
+    # ficou com ar ligado sem aula para o que menos ficou.
+    agrupar = request.args.get('agrupar', 'sala')
+    try:
+        fim = date.fromisoformat(request.args['fim']) if request.args.get('fim') else date.today() + timedelta(days=1)
+        inicio = date.fromisoformat(request.args['inicio']) if request.args.get('inicio') else fim - timedelta(days=30)
+    except ValueError:
+        return jsonify({'message': 'Datas inválidas; use AAAA-MM-DD'}), 400
+    dias = (fim - inicio).days
+    if agrupar not in AGRUPAMENTOS_USO:
+        return jsonify({'message': f"agrupar deve ser {', '.join(AGRUPAMENTOS_USO)}"}), 400
+    if dias < 1 or dias > DIAS_USO_MAX:
+        return jsonify({'message': f'O período deve ter de 1 a {DIAS_USO_MAX} dias'}), 400
+
+    salas, (ligado, ocupado, vazio) = uso_por_sala(inicio, dias)
+    cadastro = {linha.id: linha for linha in Session.query(Sala.id, Sala.descricao, Sala.bloco, Sala.andar)}
+    Session.remove()
+    if agrupar == 'sala':
+        grupos = salas
+    else:
+        grupos = [getattr(cadastro[id], agrupar) if id in cadastro else None for id in salas.tolist()]
+        grupos, (ligado, ocupado, vazio) = somar_por_grupo([str(g) if g is not None else '' for g in grupos],
+                                                           ligado, ocupado, vazio)
+
+    resultado = []
+    for n, grupo in enumerate(grupos.tolist()):
+        item = {agrupar: grupo if agrupar == 'sala' or grupo != '' else None}
+        if agrupar == 'sala':
+            item['descricao'] = cadastro[grupo].descricao if grupo in cadastro else None
+        item.update({
+            'horas_ligado': horas(ligado[n].sum()),
+            'horas_ocupado': horas(ocupado[n].sum()),
+            'horas_ligado_vazio': horas(vazio[n].sum()),
+            'dias': [{'dia': (inicio + timedelta(days=d)).isoformat(), 'horas_ligado': horas(ligado[n, d]),
+                      'horas_ocupado': horas(ocupado[n, d]), 'horas_ligado_vazio': horas(vazio[n, d])}
+                     for d in range(dias) if ligado[n, d] or ocupado[n, d]]
+        })
+        resultado.append(item)
+    resultado.sort(key=lambda item: item['horas_ligado_vazio'], reverse=True)
+    return resposta_json({'inicio': inicio.isoformat(), 'fim': fim.isoformat(), 'agrupar': agrupar,
+                          'grupos': resultado})
+
+
 ######## PERMISSOES ##########
 
 
 @app.route('/permissoes', methods=['GET'])
 def get_permissoes():
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    permissoes = Session.query(Permissoes).all()
-    Session.close()
-    return jsonify([p.__dict__ for p in permissoes])
+    permissoes = cache_catalogo.obter(('permissoes', None), lambda: carregar_todos(CODIFICADOR_PERMISSOES))
+    return resposta_json(permissoes)
 
 @app.route('/permissoes', methods=['POST'])
 def create_permissao():
     data = request.get_json()
     nova_permissao = Permissoes(**data)
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     Session.add(nova_permissao)
     Session.commit()
     Session.close()
+    invalidar_catalogo('permissoes')
     return jsonify({'message': 'Permissão criada com sucesso!'}), 201
 
 @app.route('/permissoes/<int:id>', methods=['GET'])
 def get_permissao_by_id(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
-    permissao = Session.query(Permissoes).filter_by(id=id).first()
-    Session.close()
-    return jsonify(permissao.__dict__)
+    permissao = cache_catalogo.obter(
+        ('permissoes', str(id)), lambda: carregar_por_id(CODIFICADOR_PERMISSOES, id))
+    if not permissao:
+        return jsonify({'message': 'Permissão não encontrada'}), 404
+    return resposta_json(permissao)
 
 @app.route('/permissoes/<int:id>', methods=['PUT'])
 def update_permissao(id):
     data = request.get_json()
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     permissao = Session.query(Permissoes).filter_by(id=id).first()
     for key, value in data.items():
         setattr(permissao, key, value)
     Session.commit()
     Session.close()
+    invalidar_catalogo('permissoes', id)
+    permissoes_alteradas()
     return jsonify({'message': 'Permissão atualizada com sucesso!'})
 
 @app.route('/permissoes/<int:id>', methods=['DELETE'])
 def delete_permissao(id):
-    Session = Sessionmaker(bind=engine)
-    Session = Session()
     permissao = Session.query(Permissoes).filter_by(id=id).first()
     Session.delete(permissao)
     Session.commit()
     Session.close()
+    invalidar_catalogo('permissoes', id)
+    permissoes_alteradas()
     return jsonify({'message': 'Permissão excluída com sucesso!'})
 
 
@@ -483,36 +2364,17 @@ def delete_permissao(id):
 
 @app.route('/usuarios', methods=['GET'])
 def get_usuarios():
-    usuarios = Usuario.query.all()
-    output = []
-    for usuario in usuarios:
-        usuario_data = {
-            'id': usuario.id,
-            'nome': usuario.nome,
-            'email': usuario.email,
-            'senha': usuario.senha,
-            'permissao': usuario.permissao,
-            'id_permissoes': usuario.id_permissoes,
-            'id_logs': usuario.id_logs
-        }
-        output.append(usuario_data)
-    return jsonify({'usuarios': output})
+    output = listar(CODIFICADOR_USUARIO)
+    if quer_ndjson():
+        return output
+    return resposta_json({'usuarios': output})
 
 @app.route('/usuarios/<id>', methods=['GET'])
 def get_usuario(id):
-    usuario = Usuario.query.get(id)
-    if not usuario:
+    usuario_data = carregar_por_id(CODIFICADOR_USUARIO, id)
+    if not usuario_data:
         return jsonify({'message': 'Usuário não encontrado'})
-    usuario_data = {
-        'id': usuario.id,
-        'nome': usuario.nome,
-        'email': usuario.email,
-        'senha': usuario.senha,
-        'permissao': usuario.permissao,
-        'id_permissoes': usuario.id_permissoes,
-        'id_logs': usuario.id_logs
-    }
-    return jsonify({'usuario': usuario_data})
+    return resposta_json({'usuario': usuario_data})
 
 @app.route('/usuarios', methods=['POST'])
 def add_usuario():
@@ -520,7 +2382,7 @@ def add_usuario():
     new_usuario = Usuario(
         nome=data['nome'],
         email=data['email'],
-        senha=data['senha'],
+        senha=gerar_hash(data['senha'], ITERACOES_SENHA),
         permissao=data['permissao'],
         id_permissoes=data['id_permissoes'],
         id_logs=data['id_logs']
@@ -531,26 +2393,30 @@ def add_usuario():
 
 @app.route('/usuarios/<id>', methods=['PUT'])
 def update_usuario(id):
-    usuario = Usuario.query.get(id)
+    usuario = Session.get(Usuario, id)
     if not usuario:
         return jsonify({'message': 'Usuário não encontrado'})
     data = request.get_json()
     usuario.nome = data['nome']
     usuario.email = data['email']
-    usuario.senha = data['senha']
+    # Sem "senha" no corpo a senha atual é mantida
+    if data.get('senha'):
+        usuario.senha = gerar_hash(data['senha'], ITERACOES_SENHA)
     usuario.permissao = data['permissao']
     usuario.id_permissoes = data['id_permissoes']
     usuario.id_logs = data['id_logs']
     Session.commit()
+    permissoes_alteradas(id)
     return jsonify({'message': 'Usuário atualizado com sucesso'})
 
 @app.route('/usuarios/<id>', methods=['DELETE'])
 def delete_usuario(id):
-    usuario = Usuario.query.get(id)
+    usuario = Session.get(Usuario, id)
     if not usuario:
         return jsonify({'message': 'Usuário não encontrado'})
     Session.delete(usuario)
     Session.commit()
+    permissoes_alteradas(id)
     return jsonify({'message': 'Usuário excluído com sucesso'})
 
 
@@ -558,29 +2424,17 @@ def delete_usuario(id):
 
 @app.route('/relacao', methods=['GET'])
 def get_relacao():
-    relacao = Relacao.query.all()
-    output = []
-    for item in relacao:
-        relacao_data = {
-            'id': item.id,
-            'id_sala': item.id_sala,
-            'id_equipamento': item.id_equipamento
-        }
-        output.append(relacao_data)
-    return jsonify({'relacao': output})
+    output = listar(CODIFICADOR_RELACAO)
+    if quer_ndjson():
+        return output
+    return resposta_json({'relacao': output})
 
 @app.route('/relacao/<id>', methods=['GET'])
 def get_relacao_by_id(id):
-    item = Relacao.query.get(id)
-    if not item:
+    relacao_data = carregar_por_id(CODIFICADOR_RELACAO, id)
+    if not relacao_data:
         return jsonify({'message': 'Relação não encontrada'})
-    
-    relacao_data = {
-        'id': item.id,
-        'id_sala': item.id_sala,
-        'id_equipamento': item.id_equipamento
-    }
-    return jsonify({'relacao': relacao_data})
+    return resposta_json({'relacao': relacao_data})
 
 @app.route('/relacao', methods=['POST'])
 def add_relacao():
@@ -590,58 +2444,249 @@ def add_relacao():
         id_equipamento=data['id_equipamento']
     )
     Session.add(new_item)
-    Session.commit()
+    try:
+        Session.commit()
+    except IntegrityError:
+        Session.rollback()
+        return jsonify({'message': 'O equipamento já está relacionado a esta sala'}), 409
+    invalidar_catalogo('localizacao')
     return jsonify({'message': 'Relação criada com sucesso'})
 
 @app.route('/relacao/<id>', methods=['PUT'])
 def update_relacao(id):
-    item = Relacao.query.get(id)
+    item = Session.get(Relacao, id)
     if not item:
         return jsonify({'message': 'Relação não encontrada'})
     data = request.get_json()
     item.id_sala = data['id_sala']
     item.id_equipamento = data['id_equipamento']
-    Session.commit()
+    try:
+        Session.commit()
+    except IntegrityError:
+        Session.rollback()
+        return jsonify({'message': 'O equipamento já está relacionado a esta sala'}), 409
+    invalidar_catalogo('localizacao')
     return jsonify({'message': 'Relação atualizada com sucesso'})
 
 @app.route('/relacao/<id>', methods=['DELETE'])
 def delete_relacao(id):
-    item = Relacao.query.get(id)
+    item = Session.get(Relacao, id)
     if not item:
         return jsonify({'message': 'Relação não encontrada'})
     Session.delete(item)
     Session.commit()
+    invalidar_catalogo('localizacao')
     return jsonify({'message': 'Relação excluída com sucesso'})
 
 
+############## OPERAÇÕES EM LOTE ###############
+
+# Cadastro de um prédio inteiro em poucas requisições: cada lote é gravado em
+# uma única transação com INSERT ... ON CONFLICT DO UPDATE de várias linhas, em
+# vez de uma sessão e um commit por registro.
+
+class SalaLoteModel(BaseModel):
+    id: Optional[int] = None
+    descricao: Optional[str] = None
+    andar: Optional[str] = None
+    bloco: Optional[str] = None
+    ip: Optional[str] = None
+
+class EquipamentoLoteModel(BaseModel):
+    id: Optional[int] = None
+    modelo: Optional[str] = None
+    descricao: Optional[str] = None
+    marca: Optional[str] = None
+    id_protocolo: Optional[int] = None
+
+class RelacaoLoteModel(BaseModel):
+    id_sala: int
+    id_equipamento: int
+
+
+def validar_lote(modelo):
+    # Devolve (itens, rejeitados); cada item tem só os campos enviados
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return [], [{'linha': None, 'erros': [{'campo': None, 'erro': 'Envie um array JSON'}]}]
+    itens = []
+    rejeitados = []
+    for numero, item in enumerate(data):
+        if not isinstance(item, dict):
+            rejeitados.append({'linha': numero, 'erros': [{'campo': None, 'erro': 'Objeto JSON inválido'}]})
+            continue
+        try:
+            itens.append(modelo(**item).model_dump(exclude_unset=True))
+        except ValidationError as e:
+            rejeitados.append({'linha': numero, 'erros': erros_validacao(e)})
+    return itens, rejeitados
+
+
+def insert_do_banco(tabela):
+    if engine.dialect.name == 'postgresql':
+        return postgresql.insert(tabela)
+    return sqlite.insert(tabela)
+
+
+def gravar_em_lote(modelo, itens, chave):
+    # Itens com todas as colunas da chave atualizam o registro existente (ou o
+    # criam com essa chave); os demais são inseridos. Itens com os mesmos campos
+    # vão no mesmo INSERT de várias linhas. Devolve, na ordem recebida, (id, criado).
+    tabela = modelo.__table__
+    colunas_chave = [tabela.c[coluna] for coluna in chave]
+    chaves = [tuple(item[coluna] for coluna in chave) if all(item.get(coluna) is not None for coluna in chave)
+              else None for item in itens]
+
+    existentes = set()
+    informadas = {valor for valor in chaves if valor is not None}
+    if informadas:
+        existentes = {tuple(linha) for linha in
+                      Session.query(*colunas_chave).filter(tuple_(*colunas_chave).in_(list(informadas)))}
+
+    # Um registro repetido no lote é juntado em um só (os campos posteriores
+    # prevalecem); o ON CONFLICT não aceita a mesma linha duas vezes no mesmo comando
+    unicos = {}
+    for posicao, (valor, item) in enumerate(zip(chaves, itens)):
+        if valor is None:
+            # Campos da chave enviados como null contam como ausentes: o item vai
+            # para os inseridos e o banco gera o id
+            item = {campo: dado for campo, dado in item.items() if campo not in chave or dado is not None}
+        identificador = valor if valor is not None else ('novo', posicao)
+        unicos[identificador] = {**unicos.get(identificador, {}), **item}
+
+    grupos = {}
+    for identificador, item in unicos.items():
+        grupos.setdefault(tuple(sorted(item)), []).append((identificador, item))
+
+    ids = {}
+    com_chave = [(campos, grupo) for campos, grupo in grupos.items() if all(coluna in campos for coluna in chave)]
+    sem_chave = [(campos, grupo) for campos, grupo in grupos.items() if not all(coluna in campos for coluna in chave)]
+    for campos, grupo in com_chave:
+        consulta = insert_do_banco(tabela)
+        # Sem campos para atualizar, reescreve a própria chave para o RETURNING trazer a linha
+        atualizar = {campo: consulta.excluded[campo] for campo in campos if campo not in chave}
+        consulta = consulta.on_conflict_do_update(
+            index_elements=colunas_chave, set_=atualizar or {chave[0]: consulta.excluded[chave[0]]})
+        # Linhas atualizadas mantêm o id antigo, então o RETURNING é casado pela
+        # chave e não pela ordem dos parâmetros
+        for linha in Session.execute(consulta.returning(tabela.c.id, *colunas_chave),
+                                     [item for _, item in grupo]):
+            ids[tuple(linha[1:])] = linha[0]
+
+    if 'id' in chave and engine.dialect.name == 'postgresql' and informadas - existentes:
+        # Registros criados com id explícito não avançam a sequência do SERIAL;
+        # ajusta antes de inserir os itens sem id para eles não colidirem
+        Session.execute(text(f"SELECT setval(pg_get_serial_sequence('{tabela.name}', 'id'), "
+                             f"(SELECT MAX(id) FROM {tabela.name}))"))
+
+    for campos, grupo in sem_chave:
+        linhas = Session.execute(insert_do_banco(tabela).returning(tabela.c.id, sort_by_parameter_order=True),
+                                 [item for _, item in grupo]).all()
+        for (identificador, _), linha in zip(grupo, linhas):
+            ids[identificador] = linha.id
+
+    return [(ids[valor if valor is not None else ('novo', posicao)], valor is None or valor not in existentes)
+            for posicao, valor in enumerate(chaves)]
+
+
+def upsert_em_lote(modelo, modelo_validacao, chave):
+    itens, rejeitados = validar_lote(modelo_validacao)
+    if rejeitados or not itens:
+        return None, (jsonify({'message': 'Nenhum registro gravado: o lote tem itens inválidos ou está vazio',
+                               'rejeitados': rejeitados}), 400)
+    try:
+        resultado = gravar_em_lote(modelo, itens, chave)
+        Session.commit()
+    except IntegrityError as e:
+        Session.rollback()
+        return None, (jsonify({'message': 'Nenhum registro gravado: o lote viola uma restrição do banco',
+                               'erro': str(e.orig).strip()}), 409)
+    criados = list(dict.fromkeys(id for id, criado in resultado if criado))
+    atualizados = list(dict.fromkeys(id for id, criado in resultado if not criado))
+    resposta = jsonify({'message': 'Lote gravado com sucesso!', 'ids': [id for id, _ in resultado],
+                        'criados': criados, 'atualizados': atualizados})
+    return resultado, (resposta, 201 if criados else 200)
+
+
+def excluir_em_lote(modelo):
+    # Aceita um array de ids ou {"ids": [...]}; tudo ou nada
+    data = request.get_json(silent=True)
+    ids = data.get('ids') if isinstance(data, dict) else data
+    if not isinstance(ids, list) or not ids or not all(isinstance(id, int) for id in ids):
+        return None, (jsonify({'message': 'Envie um array de ids inteiros'}), 400)
+    tabela = modelo.__table__
+    try:
+        excluidos = Session.execute(delete(tabela).where(tabela.c.id.in_(ids)).returning(tabela.c.id)).scalars().all()
+        Session.commit()
+    except IntegrityError as e:
+        Session.rollback()
+        return None, (jsonify({'message': 'Nenhum registro excluído: há registros que dependem destes',
+                               'erro': str(e.orig).strip()}), 409)
+    return excluidos, (jsonify({'message': 'Lote excluído com sucesso!', 'excluidos': excluidos}), 200)
+
+
+def invalidar_equipamentos(ids):
+    invalidar_catalogo('equipamento', *ids)
+    comandos_alterados(equipamentos=ids)
+
+
+@app.route('/salas/bulk', methods=['POST', 'PATCH'])
+def upsert_salas_bulk():
+    resultado, resposta = upsert_em_lote(Sala, SalaLoteModel, ('id',))
+    if resultado:
+        invalidar_catalogo('localizacao')
+    return resposta
+
+@app.route('/salas/bulk', methods=['DELETE'])
+def delete_salas_bulk():
+    excluidos, resposta = excluir_em_lote(Sala)
+    if excluidos:
+        invalidar_catalogo('localizacao')
+    return resposta
+
+@app.route('/equipamentos/bulk', methods=['POST', 'PATCH'])
+def upsert_equipamentos_bulk():
+    resultado, resposta = upsert_em_lote(Equipamento, EquipamentoLoteModel, ('id',))
+    if resultado:
+        invalidar_equipamentos([id for id, _ in resultado])
+    return resposta
+
+@app.route('/equipamentos/bulk', methods=['DELETE'])
+def delete_equipamentos_bulk():
+    excluidos, resposta = excluir_em_lote(Equipamento)
+    if excluidos:
+        invalidar_equipamentos(excluidos)
+    return resposta
+
+@app.route('/relacao/bulk', methods=['POST', 'PATCH'])
+def upsert_relacao_bulk():
+    resultado, resposta = upsert_em_lote(Relacao, RelacaoLoteModel, ('id_sala', 'id_equipamento'))
+    if resultado:
+        invalidar_catalogo('localizacao')
+    return resposta
+
+@app.route('/relacao/bulk', methods=['DELETE'])
+def delete_relacao_bulk():
+    excluidos, resposta = excluir_em_lote(Relacao)
+    if excluidos:
+        invalidar_catalogo('localizacao')
+    return resposta
+
+
 ##################### PROTOCOLO ######################
 
 
 @app.route('/protocolo', methods=['GET'])
 def get_protocolo():
-    protocolos = Protocolo.query.all()
-    output = []
-    for protocolo in protocolos:
-        protocolo_data = {
-            'id': protocolo.id,
-            'descricao': protocolo.descricao,
-            'id_comando': protocolo.id_comando
-        }
-        output.append(protocolo_data)
-    return jsonify({'protocolos': output})
+    output = cache_catalogo.obter(('protocolo', None), lambda: carregar_todos(CODIFICADOR_PROTOCOLO))
+    return resposta_json({'protocolos': output})
 
 @app.route('/protocolo/<id>', methods=['GET'])
 def get_protocolo_by_id(id):
-    protocolo = Protocolo.query.get(id)
-    if not protocolo:
+    protocolo_data = cache_catalogo.obter(('protocolo', str(id)), lambda: carregar_por_id(CODIFICADOR_PROTOCOLO, id))
+    if not protocolo_data:
         return jsonify({'message': 'Protocolo não encontrado'})
-    
-    protocolo_data = {
-        'id': protocolo.id,
-        'descricao': protocolo.descricao,
-        'id_comando': protocolo.id_comando
-    }
-    return jsonify({'protocolo': protocolo_data})
+    return resposta_json({'protocolo': protocolo_data})
 
 @app.route('/protocolo', methods=['POST'])
 def add_protocolo():
@@ -652,31 +2697,84 @@ def add_protocolo():
     )
     Session.add(new_protocolo)
     Session.commit()
+    invalidar_catalogo('protocolo')
+    comandos_alterados(protocolos=[new_protocolo.id])
     return jsonify({'message': 'Protocolo criado com sucesso'})
 
 @app.route('/protocolo/<id>', methods=['PUT'])
 def update_protocolo(id):
-    protocolo = Protocolo.query.get(id)
+    protocolo = Session.get(Protocolo, id)
     if not protocolo:
         return jsonify({'message': 'Protocolo não encontrado'})
     data = request.get_json()
     protocolo.descricao = data['descricao']
     protocolo.id_comando = data['id_comando']
     Session.commit()
+    invalidar_catalogo('protocolo', id)
+    comandos_alterados(protocolos=[id])
     return jsonify({'message': 'Protocolo atualizado com sucesso'})
 
 @app.route('/protocolo/<id>', methods=['DELETE'])
 def delete_protocolo(id):
-    protocolo = Protocolo.query.get(id)
+    protocolo = Session.get(Protocolo, id)
     if not protocolo:
         return jsonify({'message': 'Protocolo não encontrado'})
     Session.delete(protocolo)
     Session.commit()
+    invalidar_catalogo('protocolo', id)
+    comandos_alterados(protocolos=[id])
     return jsonify({'message': 'Protocolo excluído com sucesso'})
 
 
 
+############## CICLO DE VIDA ###############
+
+@app.route('/health', methods=['GET'])
+def health():
+    # Probe de prontidão: o worker só está pronto se alcança o banco
+    try:
+        Session.execute(text('SELECT 1'))
+    except Exception as e:
+        return jsonify({'status': 'indisponivel', 'erro': str(e)}), 503
+    return jsonify({'status': 'ok'})
+
+
+def aquecer():
+    # Abre as conexões do pool e carrega os caches do catálogo antes de o
+    # worker aceitar tráfego, para a primeira requisição não pagar esse custo
+    conexoes = [engine.connect() for _ in range(config.getint('Pool', 'pool_size', fallback=10))]
+    for conexao in conexoes:
+        conexao.close()
+    for tabela, codificador in (('equipamento', CODIFICADOR_EQUIPAMENTO),
+                                ('comandos', CODIFICADOR_COMANDOS),
+                                ('protocolo', CODIFICADOR_PROTOCOLO),
+                                ('permissoes', CODIFICADOR_PERMISSOES)):
+        cache_catalogo.obter((tabela, None), lambda codificador=codificador: carregar_todos(codificador))
+    garantir_comandos()
+    Session.remove()
+
+
+def encerrar():
+    # Chamado quando o worker sai (SIGTERM/reinício), depois de drenar as requisições
+    agendador.parar()
+    fila_comandos.parar()
+    despachante.fechar()
+    if gravador_logs is not None:
+        gravador_logs.parar()
+    metricas.encerrar()
+    difusor.fechar()
+    Session.remove()
+    replicas.parar()
+    engine.dispose()
 
 
 if __name__ == '__main__':
+    # Com debug=True o reloader executa este bloco em dois processos;
+    # o agendador só deve rodar no processo que atende as requisições
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        iniciar_replicas()
+        iniciar_agendador()
+        iniciar_estado()
+        iniciar_particoes_logs()
+        iniciar_gravacao_logs()
     app.run(debug=True,  host='0.0.0.0')
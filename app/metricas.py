@@ -0,0 +1,219 @@
+# Métricas no formato texto do Prometheus, sem dependências externas.
+#
+# Contadores, medidores e histogramas com rótulos ficam em memória no processo.
+# Com vários workers (gunicorn) cada um grava de tempos em tempos um retrato das
+# próprias métricas em <diretorio>/<pid>.json, e o /metrics de qualquer worker
+# soma os retratos de todos: a coleta não depende de qual worker atendeu.
+
+import json
+import os
+import threading
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores, extra=''):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, registro, nome, ajuda, rotulos):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.valores = {}
+        self._lock = registro._lock
+
+    def definir(self, valor, rotulos=()):
+        with self._lock:
+            self.valores[tuple(rotulos)] = valor
+
+    def estado(self):
+        return {'tipo': self.tipo, 'ajuda': self.ajuda, 'rotulos': self.rotulos,
+                'valores': [[list(rotulos), valor] for rotulos, valor in self.valores.items()]}
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, rotulos=()):
+        rotulos = tuple(rotulos)
+        with self._lock:
+            self.valores[rotulos] = self.valores.get(rotulos, 0) + valor
+
+
+class Medidor(Contador):
+    tipo = 'gauge'
+
+    def dec(self, valor=1, rotulos=()):
+        self.inc(-valor, rotulos)
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, registro, nome, ajuda, rotulos, limites=LIMITES_SEGUNDOS):
+        super().__init__(registro, nome, ajuda, rotulos)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, rotulos=()):
+        # Guarda contagens por faixa (não acumuladas), a soma e o total
+        rotulos = tuple(rotulos)
+        with self._lock:
+            atual = self.valores.get(rotulos)
+            if atual is None:
+                atual = self.valores[rotulos] = [0] * (len(self.limites) + 3)
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    atual[i] += 1
+                    break
+            else:
+                atual[len(self.limites)] += 1
+            atual[-2] += valor
+            atual[-1] += 1
+
+    def estado(self):
+        estado = super().estado()
+        estado['limites'] = self.limites
+        return estado
+
+
+class Registro:
+    def __init__(self, diretorio=None, intervalo=5):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self._metricas = {}
+        self._coletores = []
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _registrar(self, metrica):
+        self._metricas[metrica.nome] = metrica
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(self, nome, ajuda, rotulos))
+
+    def medidor(self, nome, ajuda, rotulos=()):
+        return self._registrar(Medidor(self, nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_SEGUNDOS):
+        return self._registrar(Histograma(self, nome, ajuda, rotulos, limites))
+
+    def coletor(self, funcao):
+        # Funções chamadas antes de cada leitura, para atualizar valores vindos de fora
+        self._coletores.append(funcao)
+        return funcao
+
+    def estado(self):
+        for funcao in self._coletores:
+            funcao()
+        with self._lock:
+            return {nome: metrica.estado() for nome, metrica in self._metricas.items()}
+
+    # Vários processos
+
+    def _arquivo(self):
+        return os.path.join(self.diretorio, f'{os.getpid()}.json')
+
+    def gravar(self, com_medidores=True):
+        if not self.diretorio:
+            return
+        estado = self.estado()
+        if not com_medidores:
+            # Medidores de um worker que saiu não valem mais; contadores continuam somando
+            estado = {nome: dados for nome, dados in estado.items() if dados['tipo'] != 'gauge'}
+        temporario = self._arquivo() + '.tmp'
+        with open(temporario, 'w') as arquivo:
+            json.dump(estado, arquivo)
+        os.replace(temporario, self._arquivo())
+
+    def _gravar_periodicamente(self):
+        while not self._parar.wait(self.intervalo):
+            self.gravar()
+
+    def iniciar(self):
+        # Chamado em cada worker depois do fork
+        if not self.diretorio or self._thread is not None:
+            return
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._thread = threading.Thread(target=self._gravar_periodicamente, name='metricas', daemon=True)
+        self._thread.start()
+
+    def encerrar(self):
+        if self._thread is None:
+            return
+        self._parar.set()
+        self._thread.join()
+        self._thread = None
+        self.gravar(com_medidores=False)
+
+    def _estados(self):
+        estados = [self.estado()]
+        if not self.diretorio or not os.path.isdir(self.diretorio):
+            return estados
+        proprio = os.path.basename(self._arquivo())
+        for nome in os.listdir(self.diretorio):
+            if nome == proprio or not nome.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.diretorio, nome)) as arquivo:
+                    estados.append(json.load(arquivo))
+            except (OSError, ValueError):
+                continue
+        return estados
+
+    @staticmethod
+    def _somar(estados):
+        total = {}
+        for estado in estados:
+            for nome, dados in estado.items():
+                destino = total.setdefault(nome, {'tipo': dados['tipo'], 'ajuda': dados['ajuda'],
+                                                  'rotulos': dados['rotulos'],
+                                                  'limites': dados.get('limites'), 'valores': {}})
+                for rotulos, valor in dados['valores']:
+                    chave = tuple(rotulos)
+                    atual = destino['valores'].get(chave)
+                    if atual is None:
+                        destino['valores'][chave] = list(valor) if isinstance(valor, list) else valor
+                    elif isinstance(valor, list):
+                        destino['valores'][chave] = [a + b for a, b in zip(atual, valor)]
+                    else:
+                        destino['valores'][chave] = atual + valor
+        return total
+
+    def texto(self):
+        linhas = []
+        for nome, dados in sorted(self._somar(self._estados()).items()):
+            linhas.append(f"# HELP {nome} {dados['ajuda']}")
+            linhas.append(f"# TYPE {nome} {dados['tipo']}")
+            for rotulos, valor in sorted(dados['valores'].items()):
+                if dados['tipo'] != 'histogram':
+                    linhas.append(f"{nome}{_rotulos(dados['rotulos'], rotulos)} {_numero(valor)}")
+                    continue
+                acumulado = 0
+                for limite, quantidade in zip(list(dados['limites']) + [float('inf')], valor):
+                    acumulado += quantidade
+                    le = f'le="{_numero(limite)}"'
+                    linhas.append(f"{nome}_bucket{_rotulos(dados['rotulos'], rotulos, le)} {acumulado}")
+                linhas.append(f"{nome}_sum{_rotulos(dados['rotulos'], rotulos)} {_numero(valor[-2])}")
+                linhas.append(f"{nome}_count{_rotulos(dados['rotulos'], rotulos)} {valor[-1]}")
+        return '\n'.join(linhas) + '\n'
@@ -0,0 +1,74 @@
+# Migrações versionadas do esquema do banco.
+#
+# Cada arquivo em migracoes/ se chama NNNN_descricao.sql e é aplicado uma única
+# vez, em ordem. A versão aplicada fica na tabela schema_version. Na subida o
+# processo só lê a versão atual; se não há nada pendente não executa DDL nem
+# pega lock. Havendo pendências, um advisory lock do PostgreSQL garante que
+# apenas um worker aplique as migrações enquanto os outros esperam.
+#
+# Os arquivos são SQL do PostgreSQL (vários comandos por arquivo, DO $$, GiST,
+# pg_trgm) e o lock também é dele; outros bancos são recusados com MigracaoErro.
+
+import os
+import re
+
+from sqlalchemy import inspect, text
+
+# Chave arbitrária do advisory lock das migrações
+CHAVE_LOCK = 7020250001
+
+PADRAO_ARQUIVO = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+class MigracaoErro(Exception):
+    pass
+
+
+def listar_migracoes(diretorio):
+    migracoes = []
+    for arquivo in os.listdir(diretorio):
+        encontrado = PADRAO_ARQUIVO.match(arquivo)
+        if encontrado:
+            migracoes.append((int(encontrado.group(1)), encontrado.group(2), os.path.join(diretorio, arquivo)))
+    return sorted(migracoes)
+
+
+def versao_atual(conexao):
+    if not inspect(conexao).has_table('schema_version'):
+        return 0
+    return conexao.execute(text("SELECT COALESCE(MAX(versao), 0) FROM schema_version")).scalar()
+
+
+def aplicar_migracoes(engine, diretorio):
+    # Devolve a lista de (versao, nome) aplicadas por este processo
+    if engine.dialect.name != 'postgresql':
+        raise MigracaoErro(f'As migrações de {diretorio} só rodam no PostgreSQL, não em {engine.dialect.name}')
+    migracoes = listar_migracoes(diretorio)
+    if not migracoes:
+        return []
+    with engine.connect() as conexao:
+        if versao_atual(conexao) >= migracoes[-1][0]:
+            return []
+
+    aplicadas = []
+    with engine.begin() as conexao:
+        # Liberado automaticamente no fim da transação
+        conexao.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': CHAVE_LOCK})
+        conexao.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                nome TEXT,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        # Outro worker pode ter aplicado tudo enquanto este esperava o lock
+        atual = versao_atual(conexao)
+        for versao, nome, caminho in migracoes:
+            if versao <= atual:
+                continue
+            with open(caminho, 'r') as arquivo_sql:
+                conexao.exec_driver_sql(arquivo_sql.read())
+            conexao.execute(text("INSERT INTO schema_version (versao, nome) VALUES (:versao, :nome)"),
+                            {'versao': versao, 'nome': nome})
+            aplicadas.append((versao, nome))
+    return aplicadas
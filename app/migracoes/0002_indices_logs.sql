@@ -0,0 +1,6 @@
+-- Índices para a listagem paginada de /logs (keyset em datas, id)
+CREATE INDEX IF NOT EXISTS idx_logs_datas_id ON logs (datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_equipamento_datas_id ON logs (id_equipamento, datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_sala_datas_id ON logs (sala, datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_usuario_datas_id ON logs (usuario, datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_acao_datas_id ON logs (acao, datas DESC, id DESC);
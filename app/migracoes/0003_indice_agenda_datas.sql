@@ -0,0 +1,2 @@
+-- Carga da agenda futura pelo agendador
+CREATE INDEX IF NOT EXISTS idx_agenda_datas ON agenda (datas);
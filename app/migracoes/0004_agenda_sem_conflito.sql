@@ -0,0 +1,38 @@
+-- Impede reservas sobrepostas na mesma sala; o índice GiST da restrição também
+-- atende a consulta de salas livres (/salas/livres).
+-- Com reservas sobrepostas ou com fim antes do início já gravadas a restrição
+-- não pode ser criada: a migração para com a lista dos ids a corrigir (a
+-- decisão de qual reserva fica é de quem cuida da agenda) e nada é aplicado.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+DO $$
+DECLARE
+    invertidas TEXT;
+    sobrepostas TEXT;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'agenda_sem_conflito') THEN
+        SELECT string_agg(id::text, ', ' ORDER BY id) INTO invertidas
+        FROM agenda
+        WHERE hora_fim::time < hora_inicio::time;
+        IF invertidas IS NOT NULL THEN
+            RAISE EXCEPTION USING MESSAGE =
+                'agenda tem reservas com hora_fim antes de hora_inicio (ids ' || left(invertidas, 1000) || ')';
+        END IF;
+
+        SELECT string_agg(a.id || '/' || b.id, ', ' ORDER BY a.id, b.id) INTO sobrepostas
+        FROM agenda a
+        JOIN agenda b ON b.id_sala = a.id_sala AND b.id > a.id
+        WHERE tsrange(a.datas::date + a.hora_inicio::time, a.datas::date + a.hora_fim::time)
+           && tsrange(b.datas::date + b.hora_inicio::time, b.datas::date + b.hora_fim::time);
+        IF sobrepostas IS NOT NULL THEN
+            RAISE EXCEPTION USING MESSAGE =
+                'agenda tem reservas sobrepostas na mesma sala (pares de ids ' || left(sobrepostas, 1000) || ')';
+        END IF;
+
+        ALTER TABLE agenda ADD CONSTRAINT agenda_sem_conflito EXCLUDE USING gist (
+            id_sala WITH =,
+            tsrange(datas::date + hora_inicio::time, datas::date + hora_fim::time) WITH &&
+        );
+    END IF;
+END
+$$;
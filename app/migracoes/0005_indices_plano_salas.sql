@@ -0,0 +1,4 @@
+-- Montagem do plano de controle das salas (/salas/<id>/plano e /salas/plano)
+CREATE INDEX IF NOT EXISTS idx_relacao_sala ON relacao (id_sala, id_equipamento);
+CREATE INDEX IF NOT EXISTS idx_comandos_protocolo ON comandos (id_protocolo);
+CREATE INDEX IF NOT EXISTS idx_salas_bloco_andar ON salas (bloco, andar);
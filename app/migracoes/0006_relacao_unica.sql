@@ -0,0 +1,11 @@
+-- Um equipamento aparece uma única vez em cada sala. O par é a chave do upsert
+-- de POST /relacao/bulk (ON CONFLICT (id_sala, id_equipamento)) e substitui o
+-- índice não único criado em 0005.
+DELETE FROM relacao r
+ USING relacao d
+ WHERE r.id_sala = d.id_sala
+   AND r.id_equipamento = d.id_equipamento
+   AND r.id > d.id;
+
+DROP INDEX IF EXISTS idx_relacao_sala;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_relacao_sala_equipamento ON relacao (id_sala, id_equipamento);
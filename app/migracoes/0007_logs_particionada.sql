@@ -0,0 +1,80 @@
+-- Particiona logs por mês (RANGE em datas). Consultas com intervalo de datas só
+-- leem as partições do intervalo, e meses antigos saem da tabela inteiros
+-- (DETACH + arquivo comprimido, ver particoes.py) em vez de um DELETE enorme.
+--
+-- A chave primária de uma tabela particionada precisa conter a coluna de
+-- partição, então passa a ser (id, datas) e datas deixa de aceitar nulo. Sem
+-- uma restrição única só em id, usuario.id_logs não pode mais referenciar logs.
+
+ALTER TABLE usuario DROP CONSTRAINT IF EXISTS usuario_id_logs_fkey;
+
+ALTER TABLE logs RENAME TO logs_antiga;
+ALTER INDEX logs_pkey RENAME TO logs_antiga_pkey;
+UPDATE logs_antiga SET datas = COALESCE(hora, '1970-01-01') WHERE datas IS NULL;
+
+CREATE TABLE logs (
+    id INTEGER NOT NULL DEFAULT nextval('logs_id_seq'),
+    datas TIMESTAMP NOT NULL,
+    hora TIMESTAMP,
+    equipamento TEXT,
+    id_equipamento INTEGER,
+    usuario TEXT,
+    sala TEXT,
+    acao TEXT,
+    PRIMARY KEY (id, datas),
+    FOREIGN KEY (id_equipamento) REFERENCES equipamento(id)
+) PARTITION BY RANGE (datas);
+
+-- A sequência seria apagada junto com logs_antiga
+ALTER SEQUENCE logs_id_seq OWNED BY logs.id;
+
+-- Linhas fora de qualquer mês criado (datas muito antigas ou no futuro distante)
+CREATE TABLE logs_padrao PARTITION OF logs DEFAULT;
+
+-- Cria a partição do mês de "mes" se ainda não existir. A tabela é criada solta,
+-- recebe as linhas desse mês que tenham caído em logs_padrao e só então é
+-- anexada: ATTACH bloqueia menos a tabela logs que CREATE TABLE ... PARTITION OF.
+CREATE OR REPLACE FUNCTION criar_particao_logs(mes DATE) RETURNS TEXT AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes)::date;
+    fim DATE := (date_trunc('month', mes) + interval '1 month')::date;
+    nome TEXT := 'logs_' || to_char(mes, 'YYYY_MM');
+BEGIN
+    IF to_regclass(nome) IS NULL THEN
+        EXECUTE 'CREATE TABLE ' || quote_ident(nome) || ' (LIKE logs INCLUDING DEFAULTS)';
+        EXECUTE 'WITH movidas AS (DELETE FROM logs_padrao WHERE datas >= ' || quote_literal(inicio)
+            || ' AND datas < ' || quote_literal(fim) || ' RETURNING *) INSERT INTO '
+            || quote_ident(nome) || ' SELECT * FROM movidas';
+        EXECUTE 'ALTER TABLE logs ATTACH PARTITION ' || quote_ident(nome) || ' FOR VALUES FROM ('
+            || quote_literal(inicio) || ') TO (' || quote_literal(fim) || ')';
+    END IF;
+    RETURN nome;
+END
+$$ LANGUAGE plpgsql;
+
+-- Um mês por partição desde o log mais antigo até três meses à frente
+DO $$
+DECLARE
+    mes DATE;
+BEGIN
+    mes := date_trunc('month', COALESCE((SELECT min(datas) FROM logs_antiga WHERE datas >= '2000-01-01'), now()));
+    WHILE mes <= date_trunc('month', now()) + interval '3 months' LOOP
+        PERFORM criar_particao_logs(mes);
+        mes := mes + interval '1 month';
+    END LOOP;
+END
+$$;
+
+INSERT INTO logs (id, datas, hora, equipamento, id_equipamento, usuario, sala, acao)
+SELECT id, datas, hora, equipamento, id_equipamento, usuario, sala, acao FROM logs_antiga;
+
+DROP TABLE logs_antiga;
+
+-- Os índices de 0002, agora criados em cada partição; mais rápido depois da carga
+CREATE INDEX IF NOT EXISTS idx_logs_datas_id ON logs (datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_equipamento_datas_id ON logs (id_equipamento, datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_sala_datas_id ON logs (sala, datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_usuario_datas_id ON logs (usuario, datas DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_acao_datas_id ON logs (acao, datas DESC, id DESC);
+
+ANALYZE logs;
@@ -0,0 +1,17 @@
+-- Busca textual de /busca e filtros por texto de /salas e /equipamentos.
+-- Os índices GIN de trigramas atendem ILIKE com curinga nas duas pontas e a
+-- busca aproximada (operador <%, word_similarity). As expressões de texto_busca
+-- precisam ser idênticas às usadas nas consultas de main.py.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_salas_busca_trgm ON salas
+    USING gin ((coalesce(descricao, '') || ' ' || coalesce(bloco, '') || ' ' || coalesce(andar, '')) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_salas_descricao_trgm ON salas USING gin (descricao gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_equipamento_busca_trgm ON equipamento
+    USING gin ((coalesce(descricao, '') || ' ' || coalesce(modelo, '') || ' ' || coalesce(marca, '')) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_equipamento_descricao_trgm ON equipamento USING gin (descricao gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_equipamento_marca_modelo ON equipamento (marca, modelo);
+
+ANALYZE salas;
+ANALYZE equipamento;
@@ -0,0 +1,221 @@
+# Partições mensais da tabela logs e arquivo dos meses antigos.
+#
+# A tabela logs é particionada por mês em datas (migração 0007). A manutenção
+# cria as partições dos próximos meses antes que sejam necessárias e, para os
+# meses além do período de retenção, desanexa a partição (DETACH), exporta as
+# linhas para um arquivo comprimido em disco e só então apaga a tabela. Uma
+# partição desanexada que não chegou a ser exportada (queda no meio do caminho)
+# é exportada na próxima execução.
+#
+# O arquivo é um CSV com gzip (biblioteca padrão) ou Parquet quando o pyarrow
+# estiver instalado. As linhas ficam na ordem de /logs, (datas, id) decrescente,
+# e podem ser lidas de volta com ler().
+
+import csv
+import gzip
+import os
+import re
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUNAS = ('id', 'datas', 'hora', 'equipamento', 'id_equipamento', 'usuario', 'sala', 'acao')
+PADRAO_NOME = re.compile(r'^logs_(\d{4})_(\d{2})$')
+FRACAO = re.compile(r'\.\d{1,6}$')
+EXTENSOES = {'csv.gz': '.csv.gz', 'parquet': '.parquet'}
+# Linhas por lote ao exportar para Parquet
+LOTE_PARQUET = 50_000
+
+
+def somar_meses(mes, meses):
+    total = mes.year * 12 + mes.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def nome_particao(mes):
+    return f'logs_{mes.year:04d}_{mes.month:02d}'
+
+
+def mes_da_particao(nome):
+    encontrado = PADRAO_NOME.match(nome)
+    if encontrado is None:
+        return None
+    return date(int(encontrado.group(1)), int(encontrado.group(2)), 1)
+
+
+def _inteiro(valor):
+    return None if valor is None else int(valor)
+
+
+def _data(valor):
+    # O COPY do PostgreSQL corta os zeros à direita da fração (10:00:00.12345,
+    # 10:00:00.5) e o fromisoformat do Python 3.9 só aceita 3 ou 6 dígitos
+    if valor is None:
+        return None
+    return datetime.fromisoformat(FRACAO.sub(lambda m: m.group(0).ljust(7, '0'), valor))
+
+
+CONVERSORES_CSV = {'id': _inteiro, 'id_equipamento': _inteiro, 'datas': _data, 'hora': _data}
+
+
+def sincronizar(caminho, modo=os.O_RDONLY):
+    # fsync de um arquivo já fechado ou de um diretório (grava as entradas dele)
+    descritor = os.open(caminho, modo)
+    try:
+        os.fsync(descritor)
+    finally:
+        os.close(descritor)
+
+
+class ParticoesLogs:
+    def __init__(self, engine, diretorio, meses_adiante=3, meses_retidos=12, formato='csv.gz'):
+        if formato not in EXTENSOES:
+            raise ValueError(f'Formato de arquivo desconhecido: {formato}')
+        if formato == 'parquet' and pyarrow is None:
+            print('pyarrow não está instalado; os logs serão arquivados em csv.gz')
+            formato = 'csv.gz'
+        self.engine = engine
+        self.diretorio = diretorio
+        self.meses_adiante = meses_adiante
+        self.meses_retidos = meses_retidos
+        self.formato = formato
+
+    # Manutenção (só PostgreSQL)
+
+    def manter(self, chave, hoje=None):
+        # Devolve os meses arquivados; não faz nada se outro processo já estiver
+        # cuidando das partições (advisory lock de sessão)
+        mes_atual = (hoje or date.today()).replace(day=1)
+        with self.engine.connect() as conexao:
+            if not conexao.execute(text("SELECT pg_try_advisory_lock(:chave)"), {'chave': chave}).scalar():
+                return []
+            conexao.commit()
+            try:
+                self.criar_adiantadas(conexao, mes_atual)
+                return self.arquivar_antigas(conexao, somar_meses(mes_atual, -self.meses_retidos))
+            finally:
+                conexao.rollback()
+                conexao.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': chave})
+                conexao.commit()
+
+    def criar_adiantadas(self, conexao, mes_atual):
+        for meses in range(self.meses_adiante + 1):
+            conexao.execute(text("SELECT criar_particao_logs(:mes)"), {'mes': somar_meses(mes_atual, meses)})
+            conexao.commit()
+
+    def particoes(self, conexao):
+        # (nome, anexada) das tabelas logs_AAAA_MM, anexadas ou não
+        linhas = conexao.execute(text("""
+            SELECT c.relname, i.inhrelid IS NOT NULL
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'logs'::regclass
+            WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+              AND c.relname LIKE 'logs\\_%'
+        """)).all()
+        return [(nome, anexada) for nome, anexada in linhas if mes_da_particao(nome) is not None]
+
+    def arquivar_antigas(self, conexao, limite):
+        arquivados = []
+        for nome, anexada in sorted(self.particoes(conexao)):
+            mes = mes_da_particao(nome)
+            if mes >= limite:
+                continue
+            if anexada:
+                conexao.execute(text(f'ALTER TABLE logs DETACH PARTITION "{nome}"'))
+                conexao.commit()
+            self.exportar(conexao, nome)
+            conexao.execute(text(f'DROP TABLE "{nome}"'))
+            conexao.commit()
+            arquivados.append(mes)
+        return arquivados
+
+    def exportar(self, conexao, nome):
+        os.makedirs(self.diretorio, exist_ok=True)
+        destino = self.caminho(mes_da_particao(nome))
+        temporario = destino + '.tmp'
+        consulta = f'SELECT {", ".join(COLUNAS)} FROM "{nome}" ORDER BY datas DESC, id DESC'
+        if self.formato == 'parquet':
+            self._exportar_parquet(conexao, consulta, temporario)
+        else:
+            cursor = conexao.connection.driver_connection.cursor()
+            with gzip.open(temporario, 'wt', newline='') as arquivo:
+                cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER, NULL '\\N')", arquivo)
+            cursor.close()
+        # Só substitui o arquivo final depois de escrito por completo e gravado
+        # no disco, e o DROP da partição (em arquivar_antigas) só acontece depois
+        # que a renomeação também foi gravada: uma queda de energia não pode
+        # deixar o mês sem a tabela e sem o arquivo
+        sincronizar(temporario)
+        os.replace(temporario, destino)
+        sincronizar(self.diretorio, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+        conexao.commit()
+
+    def _exportar_parquet(self, conexao, consulta, caminho):
+        resultado = conexao.execution_options(stream_results=True).execute(text(consulta))
+        esquema = pyarrow.schema([('id', pyarrow.int64()), ('datas', pyarrow.timestamp('us')),
+                                  ('hora', pyarrow.timestamp('us')), ('equipamento', pyarrow.string()),
+                                  ('id_equipamento', pyarrow.int64()), ('usuario', pyarrow.string()),
+                                  ('sala', pyarrow.string()), ('acao', pyarrow.string())])
+        with pyarrow.parquet.ParquetWriter(caminho, esquema, compression='zstd') as escritor:
+            for linhas in resultado.partitions(LOTE_PARQUET):
+                colunas = list(zip(*linhas))
+                escritor.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(coluna, tipo.type) for coluna, tipo in zip(colunas, esquema)],
+                    schema=esquema))
+
+    # Leitura dos meses arquivados
+
+    def caminho(self, mes, formato=None):
+        return os.path.join(self.diretorio, nome_particao(mes) + EXTENSOES[formato or self.formato])
+
+    def arquivos(self):
+        # {mes: caminho} dos meses arquivados, em qualquer formato
+        encontrados = {}
+        if not os.path.isdir(self.diretorio):
+            return encontrados
+        for nome in os.listdir(self.diretorio):
+            for extensao in EXTENSOES.values():
+                if nome.endswith(extensao):
+                    mes = mes_da_particao(nome[:-len(extensao)])
+                    if mes is not None:
+                        encontrados[mes] = os.path.join(self.diretorio, nome)
+        return encontrados
+
+    def ler(self, mes):
+        # Tuplas na ordem de COLUNAS; None se o mês não foi arquivado
+        caminho = self.arquivos().get(mes)
+        if caminho is None:
+            return None
+        if caminho.endswith('.parquet'):
+            return self._ler_parquet(caminho)
+        return self._ler_csv(caminho)
+
+    @staticmethod
+    def _ler_csv(caminho):
+        with gzip.open(caminho, 'rt', newline='') as arquivo:
+            leitor = csv.reader(arquivo)
+            cabecalho = next(leitor, None)
+            if cabecalho is None:
+                return
+            conversores = [CONVERSORES_CSV.get(coluna) for coluna in cabecalho]
+            for linha in leitor:
+                valores = []
+                for valor, conversor in zip(linha, conversores):
+                    valor = None if valor == '\\N' else valor
+                    valores.append(conversor(valor) if conversor else valor)
+                yield tuple(valores)
+
+    @staticmethod
+    def _ler_parquet(caminho):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow é necessário para ler arquivos Parquet')
+        arquivo = pyarrow.parquet.ParquetFile(caminho)
+        for lote in arquivo.iter_batches(columns=list(COLUNAS)):
+            for linha in lote.to_pylist():
+                yield tuple(linha[coluna] for coluna in COLUNAS)
@@ -0,0 +1,190 @@
+# Relatório de uso dos ares-condicionados (horas ligado por sala e dia),
+# comparado com a ocupação da agenda para achar ares ligados em salas vazias.
+#
+# Todas as contas são feitas com arrays NumPy, sem laço por linha:
+#   - os eventos de ligar/desligar chegam como colunas (sala, equipamento,
+#     instante, ligado); ordenados por (sala, equipamento, instante), cada evento
+#     "ligado" vira um intervalo que termina no evento seguinte do mesmo par;
+#   - os intervalos são quebrados à meia-noite e somados por (sala, dia) com
+#     bincount;
+#   - a parte de cada intervalo que coincide com aula sai de uma função
+#     acumulada da ocupação da sala (tempo de aula até o instante x), obtida com
+#     searchsorted sobre os intervalos da agenda já unidos.
+#
+# Instantes são segundos desde 1970-01-01 no horário das colunas TIMESTAMP
+# (sem fuso), e os dias começam em "origem", também em segundos.
+
+import itertools
+
+import numpy as np
+
+DIA = 86400.0
+
+
+def colunas(linhas, quantidade):
+    # Linhas numéricas do banco -> uma array float64 por coluna, sem tuplas intermediárias
+    valores = np.fromiter(itertools.chain.from_iterable(linhas), dtype=np.float64)
+    return list(valores.reshape(-1, quantidade).T)
+
+
+def colunas_agregadas(listas):
+    # Uma lista por coluna (array_agg do PostgreSQL; None quando não há linhas)
+    return [np.asarray(lista or [], dtype=np.float64) for lista in listas]
+
+
+def _chaves(salas):
+    # Índice de cada sala em um vetor ordenado de salas distintas
+    unicas, indices = np.unique(salas, return_inverse=True)
+    return unicas, indices.reshape(-1)
+
+
+def intervalos_ligado(pares, instantes, ligado, fim):
+    # pares: inteiro por (sala, equipamento). Devolve (par, inicio, fim) dos
+    # trechos ligados; o último evento de cada par vale até "fim"
+    ordem = np.lexsort((instantes, pares))
+    pares, instantes, ligado = pares[ordem], instantes[ordem], ligado[ordem]
+    proximo = np.empty_like(instantes)
+    proximo[:-1] = instantes[1:]
+    ultimo = np.ones(len(pares), dtype=bool)
+    ultimo[:-1] = pares[1:] != pares[:-1]
+    proximo[ultimo] = fim
+    ligado = ligado.astype(bool)
+    return pares[ligado], instantes[ligado], np.minimum(proximo[ligado], fim)
+
+
+def dividir_por_dia(grupos, inicios, fins, origem, dias):
+    # Recorta os intervalos a [origem, origem + dias) e quebra à meia-noite.
+    # Devolve (grupo, dia, inicio, fim) de cada pedaço
+    limite = origem + dias * DIA
+    inicios = np.clip(inicios, origem, limite)
+    fins = np.clip(fins, origem, limite)
+    validos = fins > inicios
+    grupos, inicios, fins = grupos[validos], inicios[validos], fins[validos]
+    if not len(grupos):
+        vazio = np.empty(0)
+        return grupos, vazio.astype(np.int64), vazio, vazio
+
+    primeiro = ((inicios - origem) // DIA).astype(np.int64)
+    ultimo = ((fins - origem - 1e-6) // DIA).astype(np.int64)
+    pedacos = ultimo - primeiro + 1
+    repetidos = np.repeat(np.arange(len(grupos)), pedacos)
+    # Posição de cada pedaço dentro do seu intervalo: 0, 1, 2, ...
+    deslocamento = np.arange(len(repetidos)) - np.repeat(np.cumsum(pedacos) - pedacos, pedacos)
+    dia = primeiro[repetidos] + deslocamento
+    comeco_dia = origem + dia * DIA
+    return (grupos[repetidos], dia,
+            np.maximum(inicios[repetidos], comeco_dia),
+            np.minimum(fins[repetidos], comeco_dia + DIA))
+
+
+def unir_intervalos(grupos, inicios, fins):
+    # Une intervalos sobrepostos do mesmo grupo; devolve-os ordenados e disjuntos
+    if not len(grupos):
+        return grupos, inicios, fins
+    ordem = np.lexsort((inicios, grupos))
+    grupos, inicios, fins = grupos[ordem], inicios[ordem], fins[ordem]
+    novo_grupo = np.ones(len(grupos), dtype=bool)
+    novo_grupo[1:] = grupos[1:] != grupos[:-1]
+    # Maior fim visto até aqui dentro do grupo: um deslocamento crescente por
+    # grupo faz o máximo acumulado recomeçar em cada grupo
+    deslocamento = np.cumsum(novo_grupo) * (fins.max() - fins.min() + DIA)
+    maior_fim = np.maximum.accumulate(fins + deslocamento) - deslocamento
+    inicio_bloco = novo_grupo.copy()
+    inicio_bloco[1:] |= inicios[1:] > maior_fim[:-1]
+    posicoes = np.flatnonzero(inicio_bloco)
+    return grupos[posicoes], inicios[posicoes], np.maximum.reduceat(fins, posicoes)
+
+
+class Ocupacao:
+    # Tempo de aula acumulado até um instante, por sala, a partir de intervalos
+    # disjuntos. Cada sala ocupa uma faixa própria de uma linha do tempo única,
+    # para que uma só busca binária atenda todas as salas
+    def __init__(self, salas, inicios, fins, origem, dias):
+        self.origem = origem
+        self.faixa = (dias + 2) * DIA
+        self.inicios = self._linha(salas, inicios)
+        self.fins = self._linha(salas, fins)
+        duracoes = self.fins - self.inicios
+        self.acumulado = np.concatenate(([0.0], np.cumsum(duracoes)))
+
+    def _linha(self, salas, instantes):
+        return salas * self.faixa + (instantes - self.origem + DIA)
+
+    def ate(self, salas, instantes):
+        x = self._linha(salas, instantes)
+        i = np.searchsorted(self.inicios, x, side='right') - 1
+        anterior = np.maximum(i, 0)
+        parcial = np.clip(x - self.inicios[anterior], 0, self.fins[anterior] - self.inicios[anterior])
+        return np.where(i >= 0, self.acumulado[anterior] + parcial, 0.0)
+
+    def entre(self, salas, inicios, fins):
+        if not len(self.inicios):
+            return np.zeros(len(salas))
+        return self.ate(salas, fins) - self.ate(salas, inicios)
+
+
+def uso_por_dia(eventos, aulas, origem, dias):
+    # eventos: (id_sala, id_equipamento, instante, ligado); aulas: (id_sala, inicio, fim).
+    # Devolve as salas envolvidas e, para cada uma e cada dia, os segundos de ar
+    # ligado (somando os aparelhos da sala), de aula e de ar ligado sem aula
+    salas_eventos, equipamentos, instantes, ligado = eventos
+    salas_aulas, inicios_aulas, fins_aulas = aulas
+    salas, indices = _chaves(np.concatenate((salas_eventos, salas_aulas)).astype(np.int64))
+    sala_evento, sala_aula = indices[:len(salas_eventos)], indices[len(salas_eventos):]
+    n = len(salas) * dias
+
+    equipamentos = equipamentos.astype(np.int64)
+    base = int(equipamentos.max(initial=0)) + 1
+    pares, inicios, fins = intervalos_ligado(sala_evento * base + equipamentos, instantes, ligado,
+                                             origem + dias * DIA)
+    sala_ligado = pares // base
+    sala_ligado, dia, inicios, fins = dividir_por_dia(sala_ligado, inicios, fins, origem, dias)
+
+    # A ocupação só precisa cobrir o período (mais a margem de um dia de Ocupacao)
+    inicios_aulas = np.clip(inicios_aulas, origem, origem + dias * DIA)
+    fins_aulas = np.clip(fins_aulas, origem, origem + dias * DIA)
+    sala_aula, inicios_aulas, fins_aulas = unir_intervalos(sala_aula, inicios_aulas, fins_aulas)
+    ocupacao = Ocupacao(sala_aula, inicios_aulas, fins_aulas, origem, dias)
+    com_aula = ocupacao.entre(sala_ligado, inicios, fins)
+
+    posicao = sala_ligado * dias + dia
+    ligado_s = np.bincount(posicao, weights=fins - inicios, minlength=n)
+    vazio_s = np.bincount(posicao, weights=fins - inicios - com_aula, minlength=n)
+
+    sala_aula, dia_aula, inicios_aulas, fins_aulas = dividir_por_dia(sala_aula, inicios_aulas, fins_aulas,
+                                                                     origem, dias)
+    ocupado_s = np.bincount(sala_aula * dias + dia_aula, weights=fins_aulas - inicios_aulas, minlength=n)
+
+    formato = (len(salas), dias)
+    return salas, ligado_s.reshape(formato), ocupado_s.reshape(formato), vazio_s.reshape(formato)
+
+
+def somar_por_grupo(rotulos, *valores):
+    # Soma as linhas de arrays sala x dia pelo rótulo de cada sala (bloco, andar...)
+    grupos, indices = _chaves(rotulos)
+    somados = []
+    for valor in valores:
+        dias = valor.shape[1]
+        posicao = (indices[:, None] * dias + np.arange(dias)).ravel()
+        somados.append(np.bincount(posicao, weights=valor.ravel(),
+                                   minlength=len(grupos) * dias).reshape(len(grupos), dias))
+    return grupos, somados
+
+
+def compactar(salas, *valores):
+    # Um dia (colunas de arrays sala x dia) só com as salas que tiveram uso
+    usadas = np.zeros(len(salas), dtype=bool)
+    for valor in valores:
+        usadas |= valor != 0
+    return (salas[usadas],) + tuple(valor[usadas] for valor in valores)
+
+
+def juntar_dias(diarios):
+    # Lista de dias compactados -> salas e arrays sala x dia
+    salas = np.unique(np.concatenate([dia[0] for dia in diarios] + [np.empty(0, dtype=np.int64)]))
+    matrizes = [np.zeros((len(salas), len(diarios))) for _ in range(len(diarios[0]) - 1)]
+    for n, (salas_dia, *valores) in enumerate(diarios):
+        linhas = np.searchsorted(salas, salas_dia)
+        for matriz, valor in zip(matrizes, valores):
+            matriz[linhas, n] = valor
+    return salas, matrizes
@@ -0,0 +1,151 @@
+# Réplicas de leitura do PostgreSQL.
+#
+# Cada réplica tem a sua engine, com o mesmo pool da primária. Uma thread
+# confere a cada "intervalo" segundos se a réplica responde e quanto está
+# atrasada em relação à primária. escolher() devolve, em rodízio, a engine de
+# uma réplica que respondeu e está com atraso até atraso_max, ou None quando
+# nenhuma serve e a leitura deve ir para a primária. Um erro de conexão numa
+# réplica a tira do rodízio na hora, até a próxima conferência dar certo.
+
+import itertools
+import threading
+import time
+import traceback
+
+from sqlalchemy import event, text
+
+# Segundos de atraso da réplica. Com tudo recebido já aplicado ela está em dia,
+# mesmo que a última transação seja antiga (primária sem escritas). Em
+# recuperação sem receptor de WAL ativo a replicação caiu: NULL (não usar).
+# Fora de recuperação o servidor não é réplica de ninguém: 0.
+ATRASO_POSTGRESQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+def medir_atraso(conexao):
+    if conexao.dialect.name != 'postgresql':
+        # SQLite e afins nos testes: a "réplica" é sempre considerada em dia
+        conexao.execute(text('SELECT 1'))
+        return 0.0
+    atraso = conexao.execute(ATRASO_POSTGRESQL).scalar()
+    return None if atraso is None else float(atraso)
+
+
+class Replica:
+    def __init__(self, nome, engine):
+        self.nome = nome
+        self.engine = engine
+        self.disponivel = False
+        self.atraso = None
+        self.erro = None
+        self.conferida = None
+        self.leituras = 0
+        self.quedas = 0
+
+
+class Replicas:
+    def __init__(self, engines, atraso_max=5.0, intervalo=2.0, medir=medir_atraso):
+        # engines: [(nome, engine)]; medir(conexao) -> segundos de atraso ou None
+        self.replicas = [Replica(nome, engine) for nome, engine in engines]
+        self.atraso_max = atraso_max
+        self.intervalo = intervalo
+        self.medir = medir
+        self.na_primaria = 0
+        self._rodizio = itertools.count()
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error',
+                         lambda contexto, replica=replica: self._ao_erro(replica, contexto))
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def _ao_erro(self, replica, contexto):
+        if contexto.is_disconnect:
+            with self._lock:
+                if replica.disponivel:
+                    replica.quedas += 1
+                replica.disponivel = False
+                replica.erro = f'{contexto.original_exception.__class__.__name__}: {contexto.original_exception}'
+
+    def conferir(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conexao:
+                    atraso = self.medir(conexao)
+                erro = None if atraso is not None else 'replicação parada'
+            except Exception as e:
+                atraso, erro = None, f'{e.__class__.__name__}: {e}'
+            with self._lock:
+                disponivel = erro is None and atraso <= self.atraso_max
+                if replica.disponivel and not disponivel:
+                    replica.quedas += 1
+                replica.disponivel = disponivel
+                replica.atraso = atraso
+                replica.erro = erro
+                replica.conferida = time.time()
+
+    def escolher(self):
+        # Engine da próxima réplica disponível ou None (usar a primária)
+        with self._lock:
+            disponiveis = [replica for replica in self.replicas if replica.disponivel]
+            if not disponiveis:
+                self.na_primaria += 1
+                return None
+            replica = disponiveis[next(self._rodizio) % len(disponiveis)]
+            replica.leituras += 1
+            return replica.engine
+
+    def iniciar(self):
+        # A primeira conferência é feita aqui: até ela, tudo vai para a primária
+        if not self.replicas or self._thread is not None:
+            return
+        self.conferir()
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name='replicas', daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.conferir()
+            except Exception:
+                traceback.print_exc()
+
+    def descartar_conexoes(self):
+        # Depois do fork: as conexões abertas no master não podem ser compartilhadas
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(self.intervalo + 5)
+            self._thread = None
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'atraso_max': self.atraso_max,
+                'intervalo': self.intervalo,
+                'leituras_na_primaria': self.na_primaria,
+                'replicas': [{
+                    'nome': replica.nome,
+                    'disponivel': replica.disponivel,
+                    'atraso': None if replica.atraso is None else round(replica.atraso, 3),
+                    'erro': replica.erro,
+                    'conferida': replica.conferida,
+                    'leituras': replica.leituras,
+                    'quedas': replica.quedas
+                } for replica in self.replicas]
+            }
@@ -0,0 +1,180 @@
+# Serialização das respostas a partir de tuplas de colunas.
+#
+# As listagens consultam só as colunas (select), sem montar objetos ORM nem
+# passar pelo identity map, e cada modelo tem um Codificador pré-montado com
+# os nomes dos campos e as conversões necessárias. O JSON é gerado com orjson
+# quando disponível, caindo para o json da biblioteca padrão.
+#
+# As exportações (csv, ndjson, parquet) recebem os lotes de linhas de um cursor
+# no servidor e geram o corpo aos pedaços, sem montar o resultado em memória.
+
+import csv
+import io
+import json
+from datetime import date, datetime, time
+
+from flask import Response, request, stream_with_context
+from sqlalchemy import select
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def _padrao(valor):
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    raise TypeError(f'Objeto do tipo {type(valor).__name__} não é serializável em JSON')
+
+
+if orjson is not None:
+    def dumps(dados):
+        return orjson.dumps(dados, default=_padrao)
+else:
+    def dumps(dados):
+        return json.dumps(dados, default=_padrao, ensure_ascii=False).encode()
+
+
+def data_iso(valor):
+    # Equivalente a strftime("%Y-%m-%d"), bem mais barato
+    return valor.date().isoformat()
+
+
+def hora_iso(valor):
+    # Equivalente a strftime("%H:%M:%S")
+    return valor.time().isoformat(timespec='seconds')
+
+
+class Codificador:
+    def __init__(self, *colunas, conversores=None):
+        self.colunas = colunas
+        self.nomes = tuple(coluna.key for coluna in colunas)
+        conversores = conversores or {}
+        self._conversores = tuple((i, conversores[nome]) for i, nome in enumerate(self.nomes)
+                                  if nome in conversores)
+
+    @classmethod
+    def do_modelo(cls, modelo, conversores=None):
+        return cls(*modelo.__table__.columns, conversores=conversores)
+
+    def coluna(self, nome):
+        return self.colunas[self.nomes.index(nome)]
+
+    def select(self):
+        return select(*self.colunas)
+
+    def dict(self, linha):
+        if self._conversores:
+            linha = list(linha)
+            for i, conversor in self._conversores:
+                if linha[i] is not None:
+                    linha[i] = conversor(linha[i])
+        return dict(zip(self.nomes, linha))
+
+    def lista(self, linhas):
+        return [self.dict(linha) for linha in linhas]
+
+
+def quer_ndjson():
+    return (request.args.get('formato') == 'ndjson'
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+
+def resposta_json(dados, status=200):
+    return Response(dumps(dados), status=status, mimetype='application/json')
+
+
+def resposta_ndjson(linhas, codificador):
+    # Envia uma linha JSON por registro à medida que o banco devolve as linhas
+    def gerar():
+        for linha in linhas:
+            yield dumps(codificador.dict(linha)) + b'\n'
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+
+
+# Exportação em lotes
+
+def _csv(lotes, codificador):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(codificador.nomes)
+    for linhas in lotes:
+        escritor.writerows(linhas)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson(lotes, codificador):
+    for linhas in lotes:
+        yield b''.join(dumps(codificador.dict(linha)) + b'\n' for linha in linhas)
+
+
+class _Pedacos:
+    # Destino do ParquetWriter que guarda o que foi escrito até o próximo yield
+    def __init__(self):
+        self.pedacos = []
+        self.closed = False
+
+    def write(self, dados):
+        self.pedacos.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def esvaziar(self):
+        dados = b''.join(self.pedacos)
+        self.pedacos = []
+        return dados
+
+
+TIPOS_ARROW = {int: 'int64', datetime: 'timestamp', date: 'date32', float: 'float64', bool: 'bool_'}
+
+
+def esquema_arrow(codificador):
+    campos = []
+    for nome, coluna in zip(codificador.nomes, codificador.colunas):
+        tipo = TIPOS_ARROW.get(coluna.type.python_type, 'string')
+        campos.append((nome, pyarrow.timestamp('us') if tipo == 'timestamp' else getattr(pyarrow, tipo)()))
+    return pyarrow.schema(campos)
+
+
+def _parquet(lotes, codificador):
+    # Um row group por lote; o rodapé com os metadados sai no fim
+    esquema = esquema_arrow(codificador)
+    destino = _Pedacos()
+    escritor = pyarrow.parquet.ParquetWriter(destino, esquema, compression='zstd')
+    for linhas in lotes:
+        colunas = list(zip(*linhas))
+        escritor.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(coluna, campo.type) for coluna, campo in zip(colunas, esquema)], schema=esquema))
+        yield destino.esvaziar()
+    escritor.close()
+    yield destino.esvaziar()
+
+
+FORMATOS_EXPORTACAO = {
+    'csv': ('text/csv', _csv),
+    'ndjson': ('application/x-ndjson', _ndjson),
+    'parquet': ('application/vnd.apache.parquet', _parquet),
+}
+
+
+def resposta_exportacao(lotes, codificador, formato, nome):
+    # lotes: iterável de listas de linhas, ex. Result.partitions() com yield_per
+    mimetype, gerar = FORMATOS_EXPORTACAO[formato]
+    return Response(stream_with_context(gerar(lotes, codificador)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{nome}.{formato}"'})
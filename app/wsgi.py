@@ -0,0 +1,25 @@
+# Ponto de entrada WSGI para o servidor de produção e para os testes.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# A aplicação é montada uma vez por processo, no import de main.py (rotas,
+# engine e caches são globais daquele módulo). obter_app() não monta outra:
+# devolve essa mesma instância com a verificação das réplicas de leitura em
+# andamento e, opcionalmente, já aquecida (pool de conexões aberto e caches
+# carregados). Nos testes, DATABASE_URL escolhe o banco e deve estar definida
+# antes do primeiro import.
+#
+# No gunicorn as réplicas e o aquecimento ficam para o post_fork de cada worker
+# (gunicorn.conf.py): uma thread iniciada no master não sobreviveria ao fork.
+
+import main
+
+
+def obter_app(aquecer=False):
+    main.iniciar_replicas()
+    if aquecer:
+        main.aquecer()
+    return main.app
+
+
+app = main.app
@@ -0,0 +1,191 @@
+# Verificação offline do agendador da agenda (sem banco e sem dispositivos).
+#
+# Com o RelogioSimulado carrega milhares de aulas, avança o relógio de evento
+# em evento e confere que cada ligar/desligar dispara na ordem e no instante
+# certos, que inserir, alterar e remover itens depois da carga só mexe naqueles
+# itens, que aulas seguidas na mesma sala não a deixam desligada (o lote passa
+# pela FilaComandos, que fica com o último comando de cada equipamento) e que
+# editar uma aula em andamento não liga a sala de novo. Depois, com o relógio
+# real, mede o atraso de disparo (jitter) de milhares de salas.
+#
+# Uso:
+#   SALAS=5000 python benchmarks/agendador.py
+
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+SALAS = int(os.environ.get('SALAS', 5000))
+AULAS_POR_SALA = int(os.environ.get('AULAS_POR_SALA', 4))
+JITTER_MAX = float(os.environ.get('JITTER_MAX', 1.0))
+
+sys.path.insert(0, APP)
+
+from agendador import Agendador, RelogioSimulado, acoes_por_sala  # noqa: E402
+from fila_comandos import Comando, FilaComandos  # noqa: E402
+
+INICIO = datetime(2026, 3, 2, 7, 0)
+
+
+def gerar_aulas(aleatorio):
+    # (id_agenda, id_sala, inicio, fim); metade das salas tem aulas seguidas
+    aulas = []
+    for id_sala in range(1, SALAS + 1):
+        instante = INICIO + timedelta(minutes=aleatorio.randrange(0, 120), seconds=aleatorio.randrange(60))
+        for _ in range(AULAS_POR_SALA):
+            duracao = timedelta(minutes=aleatorio.choice((50, 100)))
+            aulas.append((len(aulas) + 1, id_sala, instante, instante + duracao))
+            intervalo = 0 if id_sala % 2 else aleatorio.randrange(1, 30)
+            instante += duracao + timedelta(minutes=intervalo)
+    return aulas
+
+
+def esperados(aulas):
+    return sorted([(inicio, id_agenda, id_sala, 'ligar') for id_agenda, id_sala, inicio, _ in aulas]
+                  + [(fim, id_agenda, id_sala, 'desligar') for id_agenda, id_sala, _, fim in aulas])
+
+
+def rodar(agendador, relogio, ate=None):
+    # Avança o relógio até cada próximo evento; devolve (instante, evento) disparados
+    disparados = []
+    while True:
+        proximo = agendador.proximo_instante()
+        if proximo is None or (ate is not None and proximo > ate):
+            break
+        relogio.atual = proximo
+        disparados.extend((relogio.agora(), evento) for evento in agendador.processar())
+    if ate is not None:
+        relogio.atual = ate
+    return disparados
+
+
+def conferir_ordem_e_instante(aleatorio):
+    aulas = gerar_aulas(aleatorio)
+    relogio = RelogioSimulado(INICIO - timedelta(minutes=1))
+    lotes = []
+    agendador = Agendador(lotes.append, relogio)
+    inicio = time.perf_counter()
+    agendador.carregar(aleatorio.sample(aulas, len(aulas)))
+    carga = time.perf_counter() - inicio
+    disparados = rodar(agendador, relogio)
+
+    instantes = [instante for instante, _ in disparados]
+    assert instantes == sorted(instantes), 'eventos fora de ordem'
+    obtidos = sorted((instante, *evento) for instante, evento in disparados)
+    assert obtidos == esperados(aulas), 'eventos diferentes dos planejados (instante ou ação)'
+    assert len(agendador) == 0
+    # Cada lote dispara uma vez por instante, com todos os eventos daquele instante
+    assert len(lotes) == len(set(instantes))
+    print(f'{len(aulas)} aulas em {SALAS} salas: carga {carga * 1000:.0f} ms, '
+          f'{len(disparados)} eventos em {len(lotes)} lotes, na ordem e no instante planejados')
+
+
+def conferir_recarga_incremental():
+    relogio = RelogioSimulado(INICIO)
+    agendador = Agendador(lambda eventos: None, relogio)
+    hora = lambda minutos: INICIO + timedelta(minutes=minutos)
+    agendador.carregar([(1, 10, hora(10), hora(60)), (2, 20, hora(10), hora(60)), (3, 30, hora(30), hora(90))])
+    agendador.agendar(4, 40, hora(20), hora(40))       # inserido
+    agendador.agendar(2, 20, hora(15), hora(70))       # alterado
+    agendador.remover(3)                               # removido
+    disparados = [(instante, evento) for instante, evento in rodar(agendador, relogio)]
+    assert disparados == [
+        (hora(10), (1, 10, 'ligar')), (hora(15), (2, 20, 'ligar')), (hora(20), (4, 40, 'ligar')),
+        (hora(40), (4, 40, 'desligar')), (hora(60), (1, 10, 'desligar')), (hora(70), (2, 20, 'desligar')),
+    ], disparados
+    print('inserir, alterar e remover depois da carga: só os itens afetados mudam')
+
+
+def conferir_aula_em_andamento():
+    relogio = RelogioSimulado(INICIO)
+    agendador = Agendador(lambda eventos: None, relogio)
+    hora = lambda minutos: INICIO + timedelta(minutes=minutos)
+    agendador.carregar([(1, 10, hora(0), hora(60))])
+    assert [evento for _, evento in rodar(agendador, relogio, ate=hora(30))] == [(1, 10, 'ligar')]
+    # Estender o fim de uma aula já começada não liga a sala de novo
+    agendador.agendar(1, 10, hora(0), hora(90))
+    assert [evento for _, evento in rodar(agendador, relogio)] == [(1, 10, 'desligar')]
+    assert relogio.agora() == hora(90)
+    print('editar uma aula em andamento não dispara outro ligar')
+
+
+def conferir_aulas_seguidas():
+    # Sala 10: aula 1 das 8h às 9h e aula 2 das 9h às 10h; sala 20: só a aula 3, até 9h
+    relogio = RelogioSimulado(INICIO)
+    enviados = []
+    estados = {}
+
+    def enviar_lote(itens):
+        enviados.extend(itens)
+        return [{'ip': ip, 'ok': True, 'status': 200, 'erro': None} for ip, _ in itens]
+
+    def ao_concluir(comandos, resultados):
+        estados.update((comando.id_equipamento, comando.estado) for comando in comandos)
+
+    fila = FilaComandos(enviar_lote, ao_concluir, estados.get, janela=0.05)
+    estado = {'ligar': 'ligado', 'desligar': 'desligado'}
+
+    def disparar(eventos):
+        # Como disparar_agenda em main.py: sala 10 tem o equipamento 100 e a sala 20 o 200
+        ligar, desligar = acoes_por_sala(eventos)
+        for acao, id_salas in (('ligar', ligar), ('desligar', desligar)):
+            fila.enfileirar([Comando(id_sala * 10, f'sala-{id_sala}', 'A', acao, acao.encode(), estado[acao])
+                             for id_sala in sorted(id_salas)])
+
+    hora = lambda minutos: INICIO + timedelta(minutes=minutos)
+    agendador = Agendador(disparar, relogio)
+    agendador.carregar([(1, 10, hora(60), hora(120)), (2, 10, hora(120), hora(180)), (3, 20, hora(60), hora(120))])
+    for minutos in (60, 120, 180):
+        rodar(agendador, relogio, ate=hora(minutos))
+        time.sleep(0.2)
+    fila.parar()
+    assert enviados == [('sala-10', b'ligar'), ('sala-20', b'ligar'), ('sala-20', b'desligar'),
+                        ('sala-10', b'desligar')], enviados
+    print('aulas seguidas: a sala segue ligada na troca de aula e só desliga no fim da última')
+
+
+def medir_jitter(aleatorio):
+    # Relógio real: SALAS aulas começando nos próximos 2 s, atraso de cada ligar
+    atrasos = []
+    planejado = {}
+
+    def disparar(eventos):
+        agora = datetime.now()
+        atrasos.extend((agora - planejado[id_agenda]).total_seconds()
+                       for id_agenda, _, acao in eventos if acao == 'ligar')
+
+    agendador = Agendador(disparar)
+    base = datetime.now() + timedelta(seconds=0.5)
+    itens = []
+    for id_agenda in range(1, SALAS + 1):
+        planejado[id_agenda] = base + timedelta(milliseconds=aleatorio.randrange(2000))
+        itens.append((id_agenda, id_agenda, planejado[id_agenda], planejado[id_agenda] + timedelta(hours=1)))
+    agendador.carregar(itens)
+    agendador.iniciar()
+    limite = time.monotonic() + 10
+    while len(atrasos) < SALAS and time.monotonic() < limite:
+        time.sleep(0.05)
+    agendador.parar()
+    assert len(atrasos) == SALAS, f'{len(atrasos)} de {SALAS} salas ligadas'
+    atrasos.sort()
+    p99 = atrasos[int(len(atrasos) * 0.99)]
+    print(f'jitter com relógio real ({SALAS} salas): p50 {atrasos[len(atrasos) // 2] * 1000:.2f} ms, '
+          f'p99 {p99 * 1000:.2f} ms, máx {atrasos[-1] * 1000:.2f} ms')
+    assert atrasos[0] >= 0, 'evento disparado antes da hora'
+    assert atrasos[-1] < JITTER_MAX, f'jitter acima de {JITTER_MAX} s'
+
+
+def executar():
+    aleatorio = random.Random(3)
+    conferir_ordem_e_instante(aleatorio)
+    conferir_recarga_incremental()
+    conferir_aula_em_andamento()
+    conferir_aulas_seguidas()
+    medir_jitter(aleatorio)
+
+
+if __name__ == '__main__':
+    executar()
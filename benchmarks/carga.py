@@ -0,0 +1,83 @@
+# Gerador de carga HTTP simples e concorrente, sem dependências externas.
+#
+# Cada cliente é uma thread com uma conexão keep-alive própria que repete as
+# requisições até o tempo (ou o total de requisições) acabar. Devolve vazão e
+# percentis de latência.
+
+import http.client
+import itertools
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def gerar_carga(url_base, requisicoes, clientes=32, segundos=10, total=None):
+    # requisicoes: lista de (metodo, caminho, corpo) usada em rodízio, ou uma função
+    # que recebe o número da requisição e devolve essa tupla. O corpo pode ser
+    # None, bytes ou um objeto que será enviado como JSON.
+    if not callable(requisicoes):
+        lista = requisicoes
+        requisicoes = lambda i: lista[i % len(lista)]
+    destino = urlsplit(url_base)
+    latencias = []
+    status = {}
+    lock = threading.Lock()
+    contador = itertools.count()
+    fim = time.perf_counter() + segundos
+
+    def cliente():
+        conexao = http.client.HTTPConnection(destino.hostname, destino.port, timeout=30)
+        minhas_latencias = []
+        meus_status = {}
+        while time.perf_counter() < fim:
+            i = next(contador)
+            if total is not None and i >= total:
+                break
+            metodo, caminho, corpo = requisicoes(i)
+            if corpo is not None and not isinstance(corpo, bytes):
+                corpo = json.dumps(corpo).encode()
+            inicio = time.perf_counter()
+            try:
+                cabecalhos = {'Content-Type': 'application/json'} if corpo is not None else {}
+                conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+                resposta = conexao.getresponse()
+                resposta.read()
+                codigo = resposta.status
+                if resposta.will_close:
+                    conexao.close()
+            except (OSError, http.client.HTTPException):
+                conexao.close()
+                codigo = 'erro'
+            minhas_latencias.append((time.perf_counter() - inicio) * 1000)
+            meus_status[codigo] = meus_status.get(codigo, 0) + 1
+        conexao.close()
+        with lock:
+            latencias.extend(minhas_latencias)
+            for codigo, quantidade in meus_status.items():
+                status[codigo] = status.get(codigo, 0) + quantidade
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=cliente) for _ in range(clientes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        'requisicoes': len(latencias),
+        'duracao_s': round(duracao, 3),
+        'req_s': round(len(latencias) / duracao, 1) if duracao else 0.0,
+        'p50_ms': round(percentil(latencias, 0.50), 3),
+        'p95_ms': round(percentil(latencias, 0.95), 3),
+        'p99_ms': round(percentil(latencias, 0.99), 3),
+        'status': {str(codigo): quantidade for codigo, quantidade in sorted(status.items(), key=str)}
+    }
@@ -0,0 +1,108 @@
+# Teste de concorrência do pool de conexões.
+#
+# Dispara 200 clientes em paralelo contra rotas de leitura e escrita da API e,
+# ao final, confere em /pool que nenhuma conexão ficou presa (em_uso == 0).
+# Também mostra o tempo de espera por conexão registrado pelo pool.
+#
+# Uso (com a API do docker-compose no ar):
+#   API_URL=http://localhost:5000 python benchmarks/conexoes.py
+#
+# Sem API nem PostgreSQL, a mesma verificação roda no próprio processo: a
+# aplicação é importada sobre um SQLite temporário (ou DATABASE_URL), cada
+# cliente usa um test_client do Flask e o pool é lido com estatisticas_pool:
+#   python benchmarks/conexoes.py local
+
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+API_URL = os.environ.get('API_URL', 'http://localhost:5000')
+CLIENTES = 200
+REQUISICOES_POR_CLIENTE = 50
+
+ROTAS = [
+    ('GET', '/salas', None),
+    ('GET', '/equipamentos', None),
+    ('GET', '/agenda', None),
+    ('GET', '/logs?limite=50', None),
+    ('GET', '/salas/plano', None),
+    ('POST', '/logs', {'sala': 'Sala teste', 'acao': 'ligar', 'usuario': 'teste-conexoes'}),
+]
+
+
+def chamar(metodo, caminho, corpo=None):
+    dados = json.dumps(corpo).encode() if corpo is not None else None
+    requisicao = urllib.request.Request(API_URL + caminho, data=dados, method=metodo,
+                                        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(requisicao, timeout=60) as resposta:
+            resposta.read()
+            return resposta.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def cliente(numero, chamar=chamar):
+    erros = 0
+    for i in range(REQUISICOES_POR_CLIENTE):
+        metodo, caminho, corpo = ROTAS[(numero + i) % len(ROTAS)]
+        if chamar(metodo, caminho, corpo) >= 500:
+            erros += 1
+    return erros
+
+
+def rodar(cliente):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CLIENTES) as executor:
+        erros = sum(executor.map(cliente, range(CLIENTES)))
+    segundos = time.perf_counter() - inicio
+    total = CLIENTES * REQUISICOES_POR_CLIENTE
+    print(f'{total} requisições em {segundos:.1f}s ({total / segundos:.0f} req/s), {erros} erros 5xx')
+    return erros
+
+
+def pool_da_api():
+    with urllib.request.urlopen(API_URL + '/pool') as resposta:
+        return json.loads(resposta.read())
+
+
+def pool_local():
+    # A aplicação no próprio processo, sobre um SQLite temporário. O SQLite
+    # grava um de cada vez: o timeout longo faz os POSTs esperarem pela trava
+    # em vez de falharem com "database is locked"
+    diretorio = tempfile.mkdtemp(prefix='climabom-conexoes-')
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(diretorio, 'conexoes.db') + '?timeout=120')
+    os.chdir(APP)
+    sys.path.insert(0, APP)
+    import main
+    if main.engine.dialect.name != 'postgresql':
+        main.Base.metadata.create_all(main.engine)
+
+    def cliente_local(numero):
+        teste = main.app.test_client()
+        return cliente(numero, lambda metodo, caminho, corpo: teste.open(caminho, method=metodo,
+                                                                        json=corpo).status_code)
+
+    erros = rodar(cliente_local)
+    main.Session.remove()
+    return erros, main.estatisticas_pool(main.engine)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['local']:
+        erros, pool = pool_local()
+    else:
+        erros = rodar(cliente)
+        pool = pool_da_api()
+    print('pool:', json.dumps(pool, indent=2))
+
+    if pool.get('em_uso', 0) != 0 or erros:
+        print('FALHA: conexões presas no pool ou erros do servidor')
+        sys.exit(1)
+    print('OK: nenhuma conexão vazou')
@@ -0,0 +1,44 @@
+# Benchmark do envio concorrente de comandos para 1.000 salas simuladas.
+#
+# Sobe o servidor de dispositivos falsos, envia um comando para cada uma das
+# 1.000 salas (ips 127.0.x.y distintos) com o Despachante da API e mostra a
+# vazão e a latência por sala (p50/p95/p99).
+#
+# Uso:
+#   python benchmarks/despacho.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from despacho import Despachante  # noqa: E402
+import dispositivo_falso  # noqa: E402
+
+PORTA = 8081
+SALAS = 1_000
+RODADAS = 3
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+if __name__ == '__main__':
+    servidor = dispositivo_falso.iniciar(PORTA, latencia=0.02, falhas=0.01)
+    envios = [(f'127.0.{n // 250}.{1 + n % 250}:{PORTA}', {'comando': 'desligar', 'id_equipamento': n})
+              for n in range(SALAS)]
+    for concorrencia in (16, 64, 256):
+        despachante = Despachante(timeout=2.0, tentativas=3, backoff=0.05, concorrencia=concorrencia)
+        for rodada in range(RODADAS):
+            inicio = time.perf_counter()
+            resultados = despachante.enviar_lote(envios)
+            segundos = time.perf_counter() - inicio
+            latencias = sorted(r['latencia_ms'] for r in resultados)
+            falhas = sum(1 for r in resultados if not r['ok'])
+            print(f"concorrência {concorrencia:>4} rodada {rodada + 1}: {SALAS / segundos:8.0f} salas/s  "
+                  f"p50 {percentil(latencias, 0.50):7.2f} ms  p95 {percentil(latencias, 0.95):7.2f} ms  "
+                  f"p99 {percentil(latencias, 0.99):7.2f} ms  falhas {falhas}")
+        despachante.fechar()
+    servidor.shutdown()
@@ -0,0 +1,77 @@
+# Servidor HTTP que simula os controladores das salas.
+#
+# Responde POST /comando com latência e taxa de falhas configuráveis. Como no
+# Linux todo o bloco 127.0.0.0/8 chega na interface de loopback, cadastrar as
+# salas com ips 127.0.x.y:PORTA simula milhares de controladores distintos com
+# um único processo.
+#
+# Uso:
+#   python benchmarks/dispositivo_falso.py --porta 8081 --latencia 0.02 --falhas 0.01
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ControladorFalso(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latencia = 0.0
+    falhas = 0.0
+    recebidos = 0
+    # (instante, host) de cada comando recebido, para medir a taxa por controlador
+    chegadas = []
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        corpo = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with ControladorFalso._lock:
+            ControladorFalso.recebidos += 1
+            ControladorFalso.chegadas.append((time.monotonic(), self.headers.get('Host')))
+        if self.latencia:
+            time.sleep(random.expovariate(1 / self.latencia))
+        if random.random() < self.falhas:
+            self.responder(503, {'erro': 'falha simulada'})
+            return
+        self.responder(200, {'recebido': json.loads(corpo or b'null')})
+
+    def responder(self, status, dados):
+        corpo = json.dumps(dados).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorFalso(ThreadingHTTPServer):
+    # Fila de conexões grande para não descartar SYNs de milhares de salas
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def iniciar(porta=8081, latencia=0.0, falhas=0.0):
+    # Sobe o servidor em uma thread e devolve a instância (use shutdown() para parar)
+    ControladorFalso.latencia = latencia
+    ControladorFalso.falhas = falhas
+    servidor = ServidorFalso(('0.0.0.0', porta), ControladorFalso)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--porta', type=int, default=8081)
+    parser.add_argument('--latencia', type=float, default=0.0, help='latência média em segundos')
+    parser.add_argument('--falhas', type=float, default=0.0, help='fração de respostas 503')
+    args = parser.parse_args()
+    ControladorFalso.latencia = args.latencia
+    ControladorFalso.falhas = args.falhas
+    servidor = ServidorFalso(('0.0.0.0', args.porta), ControladorFalso)
+    print(f'Controladores falsos em 127.0.0.0/8 na porta {args.porta}')
+    servidor.serve_forever()
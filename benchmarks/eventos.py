@@ -0,0 +1,173 @@
+# Benchmark de GET /eventos (Server-Sent Events).
+#
+# Abre CONEXOES streams ociosos num único cliente (um selector, sem uma thread
+# por conexão), confere que todos foram aceitos e então grava logs pela API,
+# medindo quanto tempo leva até cada stream receber o evento (p50/p99/máximo).
+# Com PID informado, mostra também a memória residente do servidor antes e
+# depois de abrir as conexões.
+#
+# Uso (API no ar, ex. gunicorn do docker-compose; aumente o ulimit -n):
+#   API_URL=http://localhost:5000 CONEXOES=2000 [PID=<pid do worker>] \
+#   python benchmarks/eventos.py
+#
+# Sem API, "local" confere no próprio processo (SQLite temporário) a sequência
+# do PostgreSQL: o worker que grava um log aplica e publica o estado e depois
+# recebe o próprio aviso 'estado', que não pode repetir nem engolir eventos; o
+# mesmo aviso vindo de outro worker publica log e estado:
+#   python benchmarks/eventos.py local
+
+import json
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from carga import percentil
+
+API_URL = os.environ.get('API_URL', 'http://localhost:5000')
+CONEXOES = int(os.environ.get('CONEXOES', 2000))
+RODADAS = int(os.environ.get('RODADAS', 5))
+PID = os.environ.get('PID')
+MARCA = b'event: log'
+
+
+def rss(pid):
+    with open(f'/proc/{pid}/status') as arquivo:
+        for linha in arquivo:
+            if linha.startswith('VmRSS:'):
+                return int(linha.split()[1]) / 1024
+    return 0
+
+
+def abrir(endereco, seletor):
+    conexao = socket.create_connection(endereco)
+    conexao.sendall(f'GET /eventos?tipos=log HTTP/1.1\r\nHost: {endereco[0]}\r\n'
+                    'Accept: text/event-stream\r\n\r\n'.encode())
+    conexao.setblocking(False)
+    seletor.register(conexao, selectors.EVENT_READ, {'recebido': b'', 'aceita': False, 'eventos': 0})
+    return conexao
+
+
+def ler(seletor, ate, condicao):
+    # Lê de todas as conexões até condicao() ou o prazo; devolve o instante de
+    # chegada do último evento de cada conexão
+    chegadas = {}
+    while time.perf_counter() < ate and not condicao():
+        for chave, _ in seletor.select(timeout=0.1):
+            dados = chave.fileobj.recv(65536)
+            if not dados:
+                seletor.unregister(chave.fileobj)
+                continue
+            # Guarda só o fim do que chegou, curto demais para conter um evento
+            # inteiro já contado, mas suficiente para um que veio partido
+            recebido = chave.data['recebido'] + dados
+            if recebido.startswith(b'HTTP/') and not recebido.startswith(b'HTTP/1.1 200'):
+                # Recusada (ex. 503 no limite de conexões): libera a conexão no servidor
+                seletor.unregister(chave.fileobj)
+                chave.fileobj.close()
+                continue
+            chave.data['aceita'] = chave.data['aceita'] or b'retry:' in recebido
+            novos = recebido.count(MARCA)
+            if novos:
+                chave.data['eventos'] += novos
+                chegadas[chave.fileobj] = time.perf_counter()
+            chave.data['recebido'] = recebido[-(len(MARCA) - 1):]
+    return chegadas
+
+
+def primeiro_equipamento():
+    # Só logs de equipamentos viram eventos
+    with urllib.request.urlopen(API_URL + '/equipamentos') as resposta:
+        return json.load(resposta)[0]['id']
+
+
+def gravar_log(id_equipamento):
+    corpo = json.dumps({'id_equipamento': id_equipamento, 'acao': 'benchmark', 'usuario': 'benchmark'}).encode()
+    requisicao = urllib.request.Request(API_URL + '/logs', data=corpo, method='POST',
+                                        headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(requisicao):
+        pass
+
+
+def main():
+    url = urllib.parse.urlparse(API_URL)
+    endereco = (url.hostname, url.port or 80)
+    seletor = selectors.DefaultSelector()
+    antes = rss(PID) if PID else None
+
+    inicio = time.perf_counter()
+    conexoes = [abrir(endereco, seletor) for _ in range(CONEXOES)]
+    aceitas = lambda: sum(chave.data['aceita'] for chave in seletor.get_map().values())
+    ler(seletor, time.perf_counter() + 30, lambda: aceitas() == len(seletor.get_map()))
+    print(f'{aceitas()}/{CONEXOES} streams abertos em {time.perf_counter() - inicio:.1f} s')
+    if PID:
+        print(f'RSS do servidor: {antes:.1f} MiB -> {rss(PID):.1f} MiB')
+
+    id_equipamento = primeiro_equipamento()
+    for rodada in range(RODADAS):
+        enviado = time.perf_counter()
+        gravar_log(id_equipamento)
+        chegadas = ler(seletor, enviado + 10,
+                       lambda: all(chave.data['eventos'] > rodada for chave in seletor.get_map().values()))
+        atrasos = sorted((instante - enviado) * 1000 for instante in chegadas.values())
+        if not atrasos:
+            print(f'rodada {rodada}: nenhum stream recebeu o evento')
+            continue
+        print(f'rodada {rodada}: {len(atrasos)}/{aceitas()} receberam; p50 {percentil(atrasos, 0.5):.1f} ms  '
+              f'p99 {percentil(atrasos, 0.99):.1f} ms  máx {atrasos[-1]:.1f} ms')
+
+    for conexao in conexoes:
+        conexao.close()
+
+
+def conferir_estado_local():
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+    diretorio = tempfile.mkdtemp(prefix='climabom-eventos-')
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(diretorio, 'eventos.db'))
+    os.chdir(app)
+    sys.path.insert(0, app)
+    import main as api
+    api.Base.metadata.create_all(api.engine)
+    assinatura = api.difusor.assinar()
+
+    def tipos():
+        return [evento['tipo'] for evento in assinatura.proximos(0.1)]
+
+    def gravar(acao, segundos):
+        # O que create_log faz depois do commit, e os avisos que iriam no NOTIFY
+        agora = datetime(2026, 3, 2, 8, 0, segundos)
+        registros = api.resumir_estado([{'id_equipamento': 1, 'acao': acao, 'usuario': 'benchmark',
+                                         'datas': agora, 'sala': 'Sala 1', 'equipamento': 'Ar 1'}])
+        api.aplicar_estado(registros)
+        return api.montar_avisos_estado(registros)
+
+    avisos = gravar('ligar', 0)
+    assert tipos() == ['log', 'estado']
+    for aviso in avisos:
+        api.aplicar_aviso_estado(aviso)
+    assert tipos() == [], 'o próprio aviso publicou de novo'
+    print('worker que gravou: log e estado publicados uma vez')
+
+    # Outro worker: o mesmo aviso com outra origem e um estado que ele não viu
+    avisos = gravar('desligar', 1)
+    tipos()
+    api.estado_dispositivos = api.EstadoDispositivos()
+    for aviso in avisos:
+        dados = json.loads(aviso)
+        dados['origem'] = -1
+        api.aplicar_aviso_estado(json.dumps(dados))
+    assert tipos() == ['log', 'estado']
+    print('outro worker: log e estado publicados a partir do aviso')
+    api.difusor.cancelar(assinatura)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['local']:
+        conferir_estado_local()
+    else:
+        main()
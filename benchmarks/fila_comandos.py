@@ -0,0 +1,101 @@
+# Benchmark da fila de comandos contra o servidor de dispositivos falsos.
+#
+# Simula o começo de uma aula: BLOCOS x SALAS salas com dois equipamentos cada
+# recebem, em poucos milissegundos, ligar, ligar, desligar, ligar (agenda e
+# usuários ao mesmo tempo) e, depois que tudo saiu, mais um ligar. Mostra quantos
+# comandos foram recebidos, fundidos, ignorados por repetir o estado e enviados,
+# quantos chegaram aos controladores e a maior taxa por bloco em uma janela de um
+# segundo. A taxa é conferida na saída do balde de fichas (comando.saida), que
+# não pode passar de taxa + rajada; na chegada aos controladores a latência de
+# cada envio aproxima ou afasta os comandos e ela é só mostrada.
+#
+# Uso:
+#   TAXA=50 RAJADA=20 python benchmarks/fila_comandos.py
+
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from despacho import Despachante  # noqa: E402
+from fila_comandos import Comando, FilaComandos  # noqa: E402
+import dispositivo_falso  # noqa: E402
+
+PORTA = 8082
+BLOCOS = int(os.environ.get('BLOCOS', 4))
+SALAS = int(os.environ.get('SALAS', 50))
+TAXA = float(os.environ.get('TAXA', 50))
+RAJADA = int(os.environ.get('RAJADA', 20))
+ESTADOS = {'ligar': 'ligado', 'desligar': 'desligado'}
+
+
+def maior_taxa(chegadas):
+    # Maior número de chegadas em qualquer janela de 1 s
+    maior, inicio = 0, 0
+    for fim in range(len(chegadas)):
+        while chegadas[fim] - chegadas[inicio] > 1.0:
+            inicio += 1
+        maior = max(maior, fim - inicio + 1)
+    return maior
+
+
+def main():
+    servidor = dispositivo_falso.iniciar(PORTA, latencia=0.01)
+    despachante = Despachante(timeout=2.0, tentativas=2, backoff=0.05, concorrencia=64)
+    estados = {}
+    saidas = collections.defaultdict(list)
+
+    def concluir(comandos, resultados):
+        for comando, resultado in zip(comandos, resultados):
+            saidas[comando.segmento].append(comando.saida)
+            if resultado['ok']:
+                estados[comando.id_equipamento] = comando.estado
+
+    fila = FilaComandos(despachante.enviar_lote, ao_concluir=concluir, estado_atual=estados.get,
+                        taxa=TAXA, rajada=RAJADA, janela=0.1)
+    equipamentos = [(f'B{bloco}', f'127.0.{bloco + 1}.{1 + sala}:{PORTA}', (bloco * SALAS + sala) * 2 + n)
+                    for bloco in range(BLOCOS) for sala in range(SALAS) for n in range(2)]
+
+    def rajada(acao):
+        return fila.enfileirar([Comando(id_equipamento, ip, bloco, acao,
+                                        {'comando': acao, 'id_equipamento': id_equipamento}, ESTADOS[acao])
+                                for bloco, ip, id_equipamento in equipamentos])
+
+    inicio = time.perf_counter()
+    futuros = []
+    for acao in ('ligar', 'ligar', 'desligar', 'ligar'):
+        futuros += rajada(acao)
+    resultados = [futuro.result() for futuro in futuros]
+    duracao = time.perf_counter() - inicio
+    repetidos = [futuro.result() for futuro in rajada('ligar')]
+
+    estatisticas = fila.estatisticas()
+    print(f'{len(equipamentos)} equipamentos em {BLOCOS} blocos; rajada resolvida em {duracao:.2f} s')
+    print(f"recebidos {estatisticas['recebidos']}  fundidos {estatisticas['coalescidos']}  "
+          f"ignorados {estatisticas['ignorados']}  enviados {estatisticas['enviados']}  "
+          f"falhas {estatisticas['falhas']}  taxa de coalescência {estatisticas['taxa_coalescencia']}")
+    print(f'chegaram aos controladores: {dispositivo_falso.ControladorFalso.recebidos}; '
+          f"repetição depois da rajada ignorada: {sum(1 for r in repetidos if r.get('ignorado'))}/{len(repetidos)}; "
+          f"estado final ligado: {sum(1 for e in estados.values() if e == 'ligado')}/{len(equipamentos)}")
+
+    # parar() espera os ao_concluir que ainda não terminaram
+    fila.parar()
+    por_bloco = collections.defaultdict(list)
+    for instante, host in dispositivo_falso.ControladorFalso.chegadas:
+        por_bloco[f"B{int(host.split('.')[2]) - 1}"].append(instante)
+    for bloco, chegadas in sorted(por_bloco.items()):
+        print(f'bloco {bloco}: {len(chegadas)} comandos, no máximo {maior_taxa(sorted(saidas[bloco]))} '
+              f'em 1 s na saída da fila (limite {TAXA:.0f}/s + rajada {RAJADA}), '
+              f'{maior_taxa(sorted(chegadas))} na chegada aos controladores')
+    assert all(r['ok'] for r in resultados)
+    for bloco, instantes in saidas.items():
+        assert maior_taxa(sorted(instantes)) <= TAXA + RAJADA, f'bloco {bloco} acima de taxa + rajada'
+
+    despachante.fechar()
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
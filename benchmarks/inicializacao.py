@@ -0,0 +1,69 @@
+# Mede o tempo de subida do processo web (import de main.py).
+#
+# A primeira subida contra um banco vazio aplica as migrações; as seguintes só
+# leem schema_version e não devem executar DDL. Também sobe vários processos
+# ao mesmo tempo, como faria um servidor com vários workers, para conferir que
+# eles não disputam locks de DDL.
+#
+# Uso (com o banco do docker-compose acessível como "db", como na API):
+#   python benchmarks/inicializacao.py
+#
+# Sem PostgreSQL, a mesma subida roda sobre um SQLite temporário (ou
+# DATABASE_URL), sem migrações, e confere ainda que wsgi.obter_app(aquecer=True)
+# devolve uma aplicação pronta, com /health respondendo 200:
+#   python benchmarks/inicializacao.py local
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+REPETICOES = 10
+WORKERS = 8
+
+
+def subir(codigo='import wsgi'):
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, '-c', codigo], cwd=APP, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - inicio
+
+
+def subir_em_paralelo(quantidade):
+    inicio = time.perf_counter()
+    processos = [subprocess.Popen([sys.executable, '-c', 'import wsgi'], cwd=APP,
+                                  stdout=subprocess.DEVNULL) for _ in range(quantidade)]
+    for processo in processos:
+        if processo.wait() != 0:
+            raise RuntimeError('Falha ao subir um dos workers')
+    return time.perf_counter() - inicio
+
+
+def conferir_pronta():
+    # No próprio processo, como nos testes: aquecida, a aplicação já responde
+    sys.path.insert(0, APP)
+    os.chdir(APP)
+    import wsgi
+    resposta = wsgi.obter_app(aquecer=True).test_client().get('/health')
+    assert resposta.status_code == 200, resposta.get_json()
+    print('obter_app(aquecer=True): /health 200')
+
+
+if __name__ == '__main__':
+    local = sys.argv[1:] == ['local']
+    if local:
+        diretorio = tempfile.mkdtemp(prefix='climabom-inicializacao-')
+        os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(diretorio, 'inicializacao.db'))
+        print(f'primeira subida (cria as tabelas): '
+              f'{subir("import main; main.Base.metadata.create_all(main.engine)") * 1000:8.1f} ms')
+    else:
+        print(f'primeira subida (aplica migrações pendentes): {subir() * 1000:8.1f} ms')
+    tempos = sorted(subir() for _ in range(REPETICOES))
+    print(f'subidas seguintes: mediana {statistics.median(tempos) * 1000:8.1f} ms, '
+          f'máx {tempos[-1] * 1000:8.1f} ms')
+    print(f'{WORKERS} workers em paralelo: {subir_em_paralelo(WORKERS) * 1000:8.1f} ms')
+    if local:
+        conferir_pronta()
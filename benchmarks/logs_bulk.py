@@ -0,0 +1,49 @@
+# Benchmark de ingestão em lote de /logs/bulk.
+#
+# Envia lotes NDJSON de tamanhos crescentes e mostra a vazão em linhas/s.
+# A meta é pelo menos 50 mil linhas/s com um único worker.
+#
+# Uso (com a API do docker-compose no ar):
+#   API_URL=http://localhost:5000 python benchmarks/logs_bulk.py
+
+import json
+import os
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+API_URL = os.environ.get('API_URL', 'http://localhost:5000')
+TAMANHOS = [1_000, 10_000, 100_000, 500_000]
+
+
+def gerar_ndjson(total):
+    inicio = datetime(2024, 3, 1, 7, 0, 0)
+    linhas = []
+    for n in range(total):
+        momento = (inicio + timedelta(milliseconds=n)).isoformat()
+        linhas.append(json.dumps({
+            'datas': momento,
+            'hora': momento,
+            'equipamento': f'Ar {n % 500}',
+            'usuario': 'controlador',
+            'sala': f'Sala {n % 2000}',
+            'acao': 'ligar' if n % 2 == 0 else 'desligar'
+        }))
+    return ('\n'.join(linhas) + '\n').encode()
+
+
+def enviar(corpo):
+    requisicao = urllib.request.Request(
+        API_URL + '/logs/bulk', data=corpo, method='POST',
+        headers={'Content-Type': 'application/x-ndjson'})
+    inicio = time.perf_counter()
+    with urllib.request.urlopen(requisicao) as resposta:
+        resultado = json.loads(resposta.read())
+    return time.perf_counter() - inicio, resultado
+
+
+if __name__ == '__main__':
+    print(f"{'linhas':>10} {'tempo (s)':>10} {'linhas/s':>12} {'rejeitadas':>11}")
+    for total in TAMANHOS:
+        segundos, resultado = enviar(gerar_ndjson(total))
+        print(f"{total:>10} {segundos:>10.3f} {resultado['inseridos'] / segundos:>12.0f} {len(resultado['rejeitados']):>11}")
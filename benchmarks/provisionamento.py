@@ -0,0 +1,75 @@
+# Benchmark do cadastro de um prédio novo: 10k salas, 10k equipamentos e as
+# relações sala x equipamento, uma requisição por registro (POST /salas,
+# /equipamentos e /relacao) contra os endpoints em lote (/salas/bulk,
+# /equipamentos/bulk e /relacao/bulk). Os registros criados são apagados no fim.
+#
+# Uso (com a API e o banco do docker-compose no ar):
+#   API_URL=http://localhost:5000 python benchmarks/provisionamento.py
+
+import json
+import os
+import time
+import urllib.request
+
+from carga import gerar_carga
+
+API_URL = os.environ.get('API_URL', 'http://localhost:5000')
+SALAS = int(os.environ.get('SALAS', 10_000))
+CLIENTES = 16
+
+
+def enviar(metodo, caminho, corpo):
+    requisicao = urllib.request.Request(API_URL + caminho, data=json.dumps(corpo).encode(), method=metodo,
+                                        headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(requisicao, timeout=600) as resposta:
+        return json.loads(resposta.read())
+
+
+def ids_do_bloco(bloco):
+    with urllib.request.urlopen(API_URL + '/salas') as resposta:
+        return [sala['id'] for sala in json.loads(resposta.read()) if sala['bloco'] == bloco]
+
+
+def ids_dos_equipamentos(marca):
+    with urllib.request.urlopen(API_URL + '/equipamentos') as resposta:
+        return [equipamento['id'] for equipamento in json.loads(resposta.read()) if equipamento['marca'] == marca]
+
+
+def individual():
+    inicio = time.perf_counter()
+    gerar_carga(API_URL, lambda i: ('POST', '/salas', {'descricao': f'Sala {i}', 'andar': str(i % 10),
+                                                      'bloco': 'PROV-1'}),
+                clientes=CLIENTES, segundos=3600, total=SALAS)
+    gerar_carga(API_URL, lambda i: ('POST', '/equipamentos', {'descricao': f'Ar {i}', 'marca': 'PROV-1'}),
+                clientes=CLIENTES, segundos=3600, total=SALAS)
+    salas, equipamentos = ids_do_bloco('PROV-1'), ids_dos_equipamentos('PROV-1')
+    gerar_carga(API_URL, lambda i: ('POST', '/relacao', {'id_sala': salas[i], 'id_equipamento': equipamentos[i]}),
+                clientes=CLIENTES, segundos=3600, total=min(len(salas), len(equipamentos)))
+    return time.perf_counter() - inicio, salas, equipamentos
+
+
+def em_lote():
+    inicio = time.perf_counter()
+    salas = enviar('POST', '/salas/bulk', [{'descricao': f'Sala {i}', 'andar': str(i % 10), 'bloco': 'PROV-2'}
+                                           for i in range(SALAS)])['ids']
+    equipamentos = enviar('PATCH', '/equipamentos/bulk', [{'descricao': f'Ar {i}', 'marca': 'PROV-2'}
+                                                          for i in range(SALAS)])['ids']
+    enviar('POST', '/relacao/bulk', [{'id_sala': sala, 'id_equipamento': equipamento}
+                                     for sala, equipamento in zip(salas, equipamentos)])
+    return time.perf_counter() - inicio, salas, equipamentos
+
+
+def limpar(salas, equipamentos):
+    with urllib.request.urlopen(API_URL + '/relacao') as resposta:
+        relacoes = [relacao['id'] for relacao in json.loads(resposta.read())['relacao']
+                    if relacao['id_sala'] in set(salas)]
+    for caminho, ids in (('/relacao/bulk', relacoes), ('/equipamentos/bulk', equipamentos), ('/salas/bulk', salas)):
+        if ids:
+            enviar('DELETE', caminho, ids)
+
+
+if __name__ == '__main__':
+    for nome, funcao in (('uma requisição por registro', individual), ('em lote', em_lote)):
+        segundos, salas, equipamentos = funcao()
+        print(f'{nome:<28} {SALAS} salas + {SALAS} equipamentos + relações: {segundos:8.2f} s')
+        limpar(salas, equipamentos)
@@ -0,0 +1,60 @@
+# Compara o servidor de desenvolvimento (python main.py) com o gunicorn.
+#
+# Sobe cada servidor, espera /health responder, aplica a mesma carga em rotas
+# de leitura e mostra requisições/s e latência.
+#
+# Uso (com o banco do docker-compose acessível como "db", como na API):
+#   python benchmarks/servidor.py
+
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from carga import gerar_carga
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+CLIENTES = 64
+SEGUNDOS = 15
+
+REQUISICOES = [
+    ('GET', '/health', None),
+    ('GET', '/equipamentos', None),
+    ('GET', '/comandos', None),
+    ('GET', '/salas', None),
+    ('GET', '/logs?limite=50', None),
+]
+
+SERVIDORES = [
+    ('desenvolvimento', 'http://127.0.0.1:5000', [sys.executable, 'main.py']),
+    ('gunicorn', 'http://127.0.0.1:5001',
+     [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', '127.0.0.1:5001', 'wsgi:app']),
+]
+
+
+def esperar_pronto(url, limite=60):
+    fim = time.time() + limite
+    while time.time() < fim:
+        try:
+            with urllib.request.urlopen(url + '/health', timeout=2) as resposta:
+                if resposta.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'{url} não ficou pronto')
+
+
+if __name__ == '__main__':
+    for nome, url, comando in SERVIDORES:
+        processo = subprocess.Popen(comando, cwd=APP, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    start_new_session=True)
+        try:
+            esperar_pronto(url)
+            resultado = gerar_carga(url, REQUISICOES, clientes=CLIENTES, segundos=SEGUNDOS)
+            print(f"{nome:<16} {resultado['req_s']:>9.1f} req/s  p50 {resultado['p50_ms']:7.2f} ms  "
+                  f"p99 {resultado['p99_ms']:8.2f} ms  status {resultado['status']}")
+        finally:
+            os.killpg(processo.pid, signal.SIGTERM)
+            processo.wait()
@@ -0,0 +1,49 @@
+# Sobe a API (main.py) contando os comandos SQL executados pela engine.
+#
+# Usado por rotas.py: o total de consultas fica em GET /_bench/consultas e o
+# benchmark divide a diferença entre duas leituras pelo número de requisições.
+# Em bancos que não são PostgreSQL as migrações não se aplicam e o esquema é
+# criado a partir dos modelos.
+#
+# Uso: DATABASE_URL=... python benchmarks/servidor_medido.py PORTA
+
+import logging
+import os
+import sys
+import threading
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+os.chdir(APP)
+sys.path.insert(0, APP)
+
+import main  # noqa: E402
+
+if main.engine.dialect.name != 'postgresql':
+    main.Base.metadata.create_all(main.engine)
+
+# O benchmark mede as rotas, não a autenticação (ver autenticacao.py): sem
+# exigir token, /usuarios e /permissoes também aceitam requisições sem token
+if not main.EXIGIR_AUTENTICACAO:
+    main.ESCOPOS_SEMPRE_EXIGIDOS.clear()
+
+consultas = [0]
+lock = threading.Lock()
+
+
+@event.listens_for(main.engine, 'before_cursor_execute')
+def contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    with lock:
+        consultas[0] += 1
+
+
+@main.app.route('/_bench/consultas', methods=['GET'])
+def get_consultas():
+    return main.jsonify({'consultas': consultas[0]})
+
+
+if __name__ == '__main__':
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', int(sys.argv[1]), main.app, threaded=True).serve_forever()
@@ -0,0 +1,4 @@
+#!/bin/sh
+# Roda só na criação do banco: permite que a réplica (db-replica) copie este
+# servidor com pg_basebackup e acompanhe o WAL dele
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"